@@ -0,0 +1,929 @@
+# backend/backups.py
+"""Online snapshots of the SQLite databases: base copies plus WAL increments,
+with retention and verified, point-in-time restore.
+
+Copying pullrequests.db with cp while the API writes can capture a torn
+file. A base snapshot goes through SQLite's online backup API instead, a few
+hundred pages per step with a short pause between steps.
+
+In WAL mode, which the API switches to when backups are enabled, the copy
+holds one read transaction across all of its steps. Every page then comes
+from the same point in time, and a WAL reader never blocks writers. In
+rollback-journal mode each step holds a shared lock only while it runs, but
+a write landing between steps makes SQLite restart the copy. After
+MAX_RESTARTS the attempt is dropped and tried again after a growing pause,
+up to MAX_ATTEMPTS times; writers are never locked out for a one-step copy.
+
+Increments need WAL mode. A committed transaction stays in the -wal file
+until a checkpoint copies it into the database, so an increment reads only
+the frames committed since the previous snapshot (checking SQLite's frame
+checksums) and stores the newest image of each page they touch. Its cost
+follows the write rate, not the size of the database. The WAL must not
+start over before its frames are read: the manager keeps a read transaction
+open on each database, which stops any checkpoint from finishing and so
+from restarting the WAL. Only before a base copy does it let go, run a
+passive checkpoint and take hold again, so the WAL starts over with each
+chain. set_wal_mode turns off automatic checkpoints, which could not finish
+anyway. After the API restarts, an increment finding a WAL that started
+over in the meantime gives way to a full snapshot.
+
+Snapshots form chains, one per database file (or per shard):
+
+    <dir>/<source>/<id>.db           base copy, opens as a normal database
+    <dir>/<source>/<id>.pages.gz     pages committed since the previous snapshot
+    <dir>/<source>/manifest.json     every snapshot, oldest first
+    <dir>/<source>/head.json         how far the last snapshot read the WAL
+
+Every snapshot is a restore point: by id, or the newest one captured at or
+before a given time, so point-in-time restore resolves to the snapshot
+interval. Every full_every-th snapshot starts a new chain, and only the
+newest keep_full chains are kept.
+
+Restoring rebuilds the chain into a temporary file and only then moves it
+into place. Each file of the chain must match the SHA-256 recorded when it
+was written, and the result must pass PRAGMA integrity_check. Stop the API
+before restoring over its database:
+
+    python backups.py list --dir backups/
+    python backups.py restore --dir backups/ --source main --to pullrequests.db [--snapshot ID | --at 2026-10-19T08:30:00+00:00] [--force]
+    python backups.py verify --dir backups/
+
+`python backups.py bench` measures snapshot duration and write latency
+while snapshots run, for both journal modes.
+"""
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# 256 pages is 1 MB at the default 4 KB page size
+STEP_PAGES = 256
+STEP_PAUSE_MS = 5.0
+MAX_RESTARTS = 3
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF_S = 1.0
+_DELTA_MAGIC = b"PSB1"
+_DELTA_HEADER = struct.Struct("!4sIII")  # magic, page size, page count, changed pages
+_PAGE_NUMBER = struct.Struct("!I")
+# See https://www.sqlite.org/fileformat2.html#walformat
+_WAL_HEADER = struct.Struct(">8I")  # magic, version, page size, checkpoint seq, salt-1, salt-2, checksum-1, checksum-2
+_WAL_FRAME_HEADER = struct.Struct(">6I")  # page number, pages after commit (0 otherwise), salt-1, salt-2, checksum-1, checksum-2
+_WAL_MAGIC = 0x377F0682  # the low bit is set when checksums are big-endian
+_MASK = 0xFFFFFFFF
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class _CopyRestarted(Exception):
+    pass
+
+
+class _ChainBroken(Exception):
+    pass
+
+
+def set_wal_mode(engine):
+    """Switch a SQLite engine's database to write-ahead logging (persists in the file)
+
+    Checkpoints are left to BackupManager. While it holds the WAL between
+    snapshots none can finish, so automatic ones would only retry on every
+    commit.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "connect")
+    def disable_autocheckpoint(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA wal_autocheckpoint=0")
+
+    # Connections opened before the listener keep the default
+    engine.dispose()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+
+# ---------- Reading the WAL ----------
+
+class WalPosition(NamedTuple):
+    """How far a reader got through one generation of a WAL file"""
+    salts: Tuple[int, int]
+    page_size: int
+    big_endian: bool
+    frames: int
+    checksum: Tuple[int, int]
+
+    @classmethod
+    def load(cls, data: Optional[dict]) -> Optional["WalPosition"]:
+        if data is None:
+            return None
+        return cls(tuple(data["salts"]), data["page_size"], data["big_endian"], data["frames"], tuple(data["checksum"]))
+
+
+@functools.lru_cache(maxsize=4)
+def _checksum_powers(pairs: int) -> np.ndarray:
+    """A^0 .. A^pairs modulo 2^32, for A = [[1, 1], [1, 2]]"""
+    powers = np.empty((pairs + 1, 2, 2), dtype=np.uint64)
+    a, b, c, d = 1, 0, 0, 1
+    for k in range(pairs + 1):
+        powers[k] = ((a, b), (c, d))
+        a, b, c, d = (a + c) & _MASK, (b + d) & _MASK, (a + 2 * c) & _MASK, (b + 2 * d) & _MASK
+    return powers
+
+
+def wal_checksum(data: bytes, big_endian: bool, checksum: Tuple[int, int] = (0, 0)) -> Tuple[int, int]:
+    """SQLite's WAL checksum of data, continued from checksum
+
+    Each pair of words (x0, x1) takes the sums s to A·s + (x0, x0 + x1), so a
+    run of n pairs is A^n·s plus every pair weighted by a power of A: one numpy
+    pass rather than a Python loop over each word. uint64 arithmetic wraps at
+    2^64, which keeps the result exact modulo 2^32.
+    """
+    words = np.frombuffer(data, dtype=">u4" if big_endian else "<u4").astype(np.uint64)
+    first, second = words[0::2], words[1::2] + words[0::2]
+    pairs = len(first)
+    powers = _checksum_powers(pairs)
+    weights = powers[pairs - 1::-1]
+    c0 = int((weights[:, 0, 0] * first + weights[:, 0, 1] * second).sum())
+    c1 = int((weights[:, 1, 0] * first + weights[:, 1, 1] * second).sum())
+    (a, b), (c, d) = powers[pairs].tolist()
+    s0, s1 = checksum
+    return (a * s0 + b * s1 + c0) & _MASK, (c * s0 + d * s1 + c1) & _MASK
+
+
+def wal_start(wal_path: str) -> Optional[WalPosition]:
+    """The position before the first frame of the WAL's current generation, None without a valid WAL"""
+    try:
+        with open(wal_path, "rb") as f:
+            header = f.read(_WAL_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < _WAL_HEADER.size:
+        return None
+    magic, _, page_size, _, salt1, salt2, check1, check2 = _WAL_HEADER.unpack(header)
+    if magic & ~1 != _WAL_MAGIC:
+        return None
+    big_endian = bool(magic & 1)
+    if wal_checksum(header[:24], big_endian) != (check1, check2):
+        return None
+    return WalPosition((salt1, salt2), page_size, big_endian, 0, (check1, check2))
+
+
+def read_wal(wal_path: str, start: WalPosition, on_commit: Optional[Callable[[list], None]] = None) -> WalPosition:
+    """Check the frames after start and pass each committed transaction's to on_commit
+
+    Frames are (page number, database pages after the commit, page). Reading
+    stops at the first frame from another generation or with a bad checksum.
+    Frames after the last commit belong to a transaction still being written
+    and are left for the next read.
+    """
+    frame_size = _WAL_FRAME_HEADER.size + start.page_size
+    position, checksum, frames = start, start.checksum, start.frames
+    transaction = []
+    try:
+        f = open(wal_path, "rb")
+    except FileNotFoundError:
+        return start
+    with f:
+        f.seek(_WAL_HEADER.size + start.frames * frame_size)
+        while True:
+            frame = f.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            page_number, commit_pages, salt1, salt2, check1, check2 = _WAL_FRAME_HEADER.unpack_from(frame)
+            if (salt1, salt2) != start.salts:
+                break
+            page = frame[_WAL_FRAME_HEADER.size:]
+            checksum = wal_checksum(frame[:8] + page, start.big_endian, checksum)
+            if checksum != (check1, check2):
+                break
+            frames += 1
+            transaction.append((page_number, commit_pages, page))
+            if commit_pages:
+                if on_commit is not None:
+                    on_commit(transaction)
+                transaction = []
+                position = position._replace(frames=frames, checksum=checksum)
+    return position
+
+
+# ---------- Files ----------
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def integrity_check(path: str) -> str:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def write_pages(path: str, page_size: int, page_count: int, pages: Dict[int, bytes]):
+    """Write pages (numbered from 0) into a database file and cut it to page_count pages"""
+    with open(path, "r+b") as target:
+        for number, page in pages.items():
+            target.seek(number * page_size)
+            target.write(page)
+        target.truncate(page_count * page_size)
+
+
+def set_rollback_journal_header(path: str):
+    """Mark a rebuilt file as a rollback-journal database
+
+    Pages replayed from a WAL carry 2 in header bytes 18-19 (WAL mode), which
+    makes every later open, even read-only, look for -wal and -shm files.
+    """
+    with open(path, "r+b") as f:
+        f.seek(18)
+        f.write(b"\x01\x01")
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 2)
+
+
+def latency_impact(requests: Iterable[Tuple[float, float]], windows: Iterable[Tuple[float, float]]) -> dict:
+    """Request latency while a snapshot ran vs the rest of the time.
+
+    requests are (started_at, duration_ms) pairs and windows are (started_at,
+    finished_at) pairs, all in Unix seconds.
+    """
+    windows = list(windows)
+    during, outside = [], []
+    for started, duration_ms in requests:
+        finished = started + duration_ms / 1000
+        overlaps = any(started < end and finished > begin for begin, end in windows)
+        (during if overlaps else outside).append(duration_ms)
+    describe = lambda values: {"requests": len(values), "p50_ms": percentile(values, 0.5), "p95_ms": percentile(values, 0.95)}
+    return {"during_backup": describe(during), "otherwise": describe(outside)}
+
+
+class BackupManager:
+    def __init__(
+        self,
+        sources: Dict[str, str],
+        directory: str,
+        full_every: int = 24,
+        keep_full: int = 7,
+        step_pages: int = STEP_PAGES,
+        step_pause_ms: float = STEP_PAUSE_MS,
+        max_attempts: int = MAX_ATTEMPTS,
+        retry_backoff_s: float = RETRY_BACKOFF_S,
+    ):
+        # source name -> database file path
+        self.sources = sources
+        self.directory = directory
+        self.full_every = max(1, full_every)
+        self.keep_full = max(1, keep_full)
+        self.step_pages = step_pages
+        self.step_pause = step_pause_ms / 1000
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff_s
+        self.lock = threading.Lock()
+        # One connection per source holding a read transaction open (in WAL
+        # mode), so no checkpoint can restart the WAL between snapshots
+        self.holders: Dict[str, sqlite3.Connection] = {}
+        # Sources whose read transaction has been held since their head was saved
+        self.pinned = set()
+        # (started_at, finished_at) of recent runs, for latency_impact
+        self.windows: List[Tuple[float, float]] = []
+        self.runs = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    # ---------- Manifest ----------
+
+    def source_dir(self, source: str) -> str:
+        return os.path.join(self.directory, source)
+
+    def manifest(self, source: str) -> List[dict]:
+        path = os.path.join(self.source_dir(source), "manifest.json")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)["snapshots"]
+
+    def save_manifest(self, source: str, snapshots: List[dict]):
+        self.write_json(os.path.join(self.source_dir(source), "manifest.json"), {"source": source, "snapshots": snapshots})
+
+    def head(self, source: str) -> Optional[dict]:
+        """Where the chain's last snapshot stopped: its WAL position and page count"""
+        path = os.path.join(self.source_dir(source), "head.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_head(self, source: str, wal: Optional[WalPosition], page_count: int):
+        self.write_json(os.path.join(self.source_dir(source), "head.json"), {
+            "wal": wal._asdict() if wal else None,
+            "page_count": page_count,
+        })
+
+    @staticmethod
+    def write_json(path: str, data: dict):
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    # ---------- Taking snapshots ----------
+
+    def hold(self, source: str) -> sqlite3.Connection:
+        conn = self.holders.get(source)
+        if conn is None:
+            conn = sqlite3.connect(self.sources[source], timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA wal_autocheckpoint=0")
+            self.holders[source] = conn
+        return conn
+
+    def pin(self, source: str):
+        """Open the holder's read transaction; held, no checkpoint can complete and restart the WAL"""
+        conn = self.hold(source)
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+            conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+    def unpin(self, source: str):
+        conn = self.holders.get(source)
+        if conn is not None and conn.in_transaction:
+            conn.execute("COMMIT")
+        self.pinned.discard(source)
+
+    def copy(self, source_path: str, target_path: str) -> dict:
+        """Online-backup source into target in steps; returns step and restart counts
+
+        Raises _CopyRestarted once writes have restarted a rollback-journal copy
+        MAX_RESTARTS times.
+        """
+        counters = {"steps": 0, "restarts": 0}
+        remaining_before = [None]
+
+        def progress(status, remaining, total):
+            counters["steps"] += 1
+            if remaining_before[0] is not None and remaining > remaining_before[0]:
+                counters["restarts"] += 1
+                if counters["restarts"] >= MAX_RESTARTS:
+                    raise _CopyRestarted()
+            remaining_before[0] = remaining
+            if remaining:
+                time.sleep(self.step_pause)
+
+        source = sqlite3.connect(source_path, timeout=30, isolation_level=None)
+        target = sqlite3.connect(target_path)
+        try:
+            wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            if wal:
+                # Pin one read snapshot for every step
+                source.execute("BEGIN")
+                source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=self.step_pages, progress=progress)
+            # Snapshots are standalone files; a WAL header would make every
+            # later open (even read-only) create -wal and -shm files beside them
+            target.execute("PRAGMA journal_mode=DELETE").fetchone()
+            counters["page_size"] = target.execute("PRAGMA page_size").fetchone()[0]
+            counters["page_count"] = target.execute("PRAGMA page_count").fetchone()[0]
+            if wal:
+                source.execute("COMMIT")
+        finally:
+            target.close()
+            source.close()
+        return counters
+
+    def take_base(self, source: str, staging: str) -> dict:
+        """Copy source into staging, brought forward to the WAL's last commit; returns details and the new head"""
+        path = self.sources[source]
+        wal_path = path + "-wal"
+        holder = self.hold(source)
+        wal_mode = holder.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        head = self.head(source)
+        restarts = 0
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            for leftover in (staging, staging + "-journal"):
+                if os.path.exists(leftover):
+                    os.unlink(leftover)
+            before = None
+            if wal_mode:
+                before = self.wal_end(wal_path, head)
+                # Let the WAL start over at the next write, so it only holds
+                # this chain's frames, then hold it again before copying
+                self.unpin(source)
+                holder.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+                self.pin(source)
+            try:
+                copied = self.copy(path, staging)
+            except _CopyRestarted:
+                restarts += MAX_RESTARTS
+                continue
+            restarts += copied["restarts"]
+            if not wal_mode:
+                return {**copied, "attempts": attempt + 1, "restarts": restarts, "wal_frames": 0,
+                        "head": (None, copied["page_count"])}
+
+            # The copy is of some commit between before and now. Replaying every
+            # frame committed since before brings it to the newest one; pages
+            # the copy already had are simply written again. A WAL that started
+            # over did so after the checkpoint above, as the pin allows no other
+            # restart, so replaying its frames from the first is enough.
+            now = wal_start(wal_path)
+            start = before if now is not None and before is not None and now.salts == before.salts else now
+            pages, page_count = {}, [copied["page_count"]]
+
+            def take(transaction):
+                for page_number, commit_pages, page in transaction:
+                    pages[page_number - 1] = page
+                page_count[0] = transaction[-1][1]
+
+            after = read_wal(wal_path, start, take) if start else None
+            if pages:
+                write_pages(staging, copied["page_size"], page_count[0], pages)
+                set_rollback_journal_header(staging)
+            self.pinned.add(source)
+            return {**copied, "page_count": page_count[0], "attempts": attempt + 1, "restarts": restarts,
+                    "wal_frames": (after.frames - start.frames) if after else 0,
+                    "head": (after, page_count[0])}
+        raise SnapshotError(
+            f"{source} kept changing during {self.max_attempts} copy attempts; "
+            "the next scheduled snapshot tries again (WAL mode avoids this)"
+        )
+
+    @staticmethod
+    def wal_end(wal_path: str, head: Optional[dict]) -> Optional[WalPosition]:
+        """The WAL's last commit, reading on from head when it is of the same generation"""
+        start = wal_start(wal_path)
+        if start is None:
+            return None
+        last = WalPosition.load(head["wal"]) if head else None
+        if last is not None and last.salts == start.salts:
+            start = last
+        return read_wal(wal_path, start)
+
+    def read_increment(self, source: str, head: dict) -> dict:
+        """Pages committed to the WAL since head; raises _ChainBroken when some may be missing"""
+        wal_path = self.sources[source] + "-wal"
+        holder = self.hold(source)
+        if holder.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            raise _ChainBroken("incremental snapshots need WAL mode")
+        page_size = holder.execute("PRAGMA page_size").fetchone()[0]
+        # Held since the head was saved, the pin rules out a restart other than
+        # the one the base's checkpoint allowed, which lost no frames
+        continuous = source in self.pinned
+        self.pin(source)
+        last = WalPosition.load(head["wal"])
+        now = wal_start(wal_path)
+        if now is None:
+            if last is not None:
+                raise _ChainBroken("the WAL was checkpointed and removed")
+            return {"pages": {}, "page_size": page_size, "page_count": head["page_count"], "wal_frames": 0,
+                    "head": (None, head["page_count"])}
+        if last is not None and now.salts == last.salts:
+            start = last
+        elif continuous:
+            start = now
+        else:
+            raise _ChainBroken("the WAL may have started over since the last snapshot")
+        pages, page_count = {}, [head["page_count"]]
+
+        def take(transaction):
+            for page_number, commit_pages, page in transaction:
+                pages[page_number - 1] = page
+            page_count[0] = transaction[-1][1]
+
+        end = read_wal(wal_path, start, take)
+        self.pinned.add(source)
+        # Pages past the final size were freed by a later commit in the same run
+        pages = {number: page for number, page in pages.items() if number < page_count[0]}
+        return {"pages": pages, "page_size": page_size, "page_count": page_count[0], "wal_frames": end.frames - start.frames,
+                "head": (end, page_count[0])}
+
+    def snapshot(self, source: str, kind: str = "auto") -> dict:
+        """Snapshot one source; kind is full, incremental or auto (chain length decides)"""
+        if kind not in ("auto", "full", "incremental"):
+            raise ValueError("kind must be auto, full or incremental")
+        os.makedirs(self.source_dir(source), exist_ok=True)
+        snapshots = self.manifest(source)
+        chain = 0
+        for entry in reversed(snapshots):
+            chain += 1
+            if entry["kind"] == "full":
+                break
+        else:
+            chain = 0
+        head = self.head(source)
+        if kind == "auto":
+            kind = "incremental" if chain and head and chain < self.full_every else "full"
+        elif kind == "incremental" and not (chain and head):
+            kind = "full"
+
+        started_at = time.time()
+        started = time.perf_counter()
+        snapshot_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        entry = {"id": snapshot_id, "kind": kind, "created_at": started_at}
+        if kind == "incremental":
+            try:
+                increment = self.read_increment(source, head)
+            except _ChainBroken as e:
+                kind = entry["kind"] = "full"
+                entry["reason"] = str(e)
+        if kind == "incremental":
+            entry.update(
+                base=snapshots[-1]["id"],
+                captured_at=time.time(),
+                page_size=increment["page_size"],
+                page_count=increment["page_count"],
+                wal_frames=increment["wal_frames"],
+                changed_pages=len(increment["pages"]),
+                file=f"{snapshot_id}.pages.gz",
+            )
+            path = os.path.join(self.source_dir(source), entry["file"])
+            self.write_delta(path, entry["page_size"], increment["page_count"], increment["pages"])
+            entry["file_sha256"] = file_sha256(path)
+            new_head = increment["head"]
+        else:
+            staging = os.path.join(self.source_dir(source), ".staging.db")
+            copied = self.take_base(source, staging)
+            entry["captured_at"] = time.time()
+            check = integrity_check(staging)
+            if check != "ok":
+                os.unlink(staging)
+                raise SnapshotError(f"Copy of {source} failed integrity_check: {check}")
+            entry.update(
+                base=None,
+                page_size=copied["page_size"],
+                page_count=copied["page_count"],
+                wal_frames=copied["wal_frames"],
+                changed_pages=copied["page_count"],
+                sha256=file_sha256(staging),
+                steps=copied["steps"],
+                restarts=copied["restarts"],
+                attempts=copied["attempts"],
+                file=f"{snapshot_id}.db",
+            )
+            os.replace(staging, os.path.join(self.source_dir(source), entry["file"]))
+            new_head = copied["head"]
+        entry["bytes"] = os.path.getsize(os.path.join(self.source_dir(source), entry["file"]))
+        entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.save_head(source, *new_head)
+        snapshots.append(entry)
+        self.save_manifest(source, self.apply_retention(source, snapshots))
+        self.windows.append((started_at, time.time()))
+        del self.windows[:-100]
+        return {"source": source, **entry}
+
+    @staticmethod
+    def write_delta(path: str, page_size: int, page_count: int, pages: Dict[int, bytes]):
+        with gzip.open(path + ".tmp", "wb", compresslevel=6) as out:
+            out.write(_DELTA_HEADER.pack(_DELTA_MAGIC, page_size, page_count, len(pages)))
+            for number in sorted(pages):
+                out.write(_PAGE_NUMBER.pack(number))
+                out.write(pages[number])
+        os.replace(path + ".tmp", path)
+
+    def apply_retention(self, source: str, snapshots: List[dict]) -> List[dict]:
+        """Drop whole chains older than the newest keep_full full snapshots"""
+        fulls = [index for index, entry in enumerate(snapshots) if entry["kind"] == "full"]
+        if len(fulls) <= self.keep_full:
+            return snapshots
+        cut = fulls[-self.keep_full]
+        for entry in snapshots[:cut]:
+            try:
+                os.unlink(os.path.join(self.source_dir(source), entry["file"]))
+            except FileNotFoundError:
+                pass
+        return snapshots[cut:]
+
+    def snapshot_all(self, kind: str = "auto") -> List[dict]:
+        with self.lock:
+            self.runs += 1
+            try:
+                return [self.snapshot(source, kind) for source in self.sources]
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                raise
+
+    # ---------- Schedule ----------
+
+    def start(self, interval_s: float):
+        def run():
+            while not self.stopping.wait(interval_s):
+                try:
+                    self.snapshot_all()
+                except Exception as e:
+                    print(f"⚠️ Scheduled backup failed, retrying next interval: {e}")
+
+        self.thread = threading.Thread(target=run, name="backups", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        with self.lock:
+            for conn in self.holders.values():
+                conn.close()
+            self.holders.clear()
+            self.pinned.clear()
+
+    # ---------- Restore ----------
+
+    def restore(
+        self,
+        source: str,
+        target_path: str,
+        snapshot_id: Optional[str] = None,
+        force: bool = False,
+        at: Optional[float] = None,
+    ) -> dict:
+        """Rebuild a snapshot (the newest, or the newest captured by at) and move it to target_path"""
+        if os.path.exists(target_path) and not force:
+            raise FileExistsError(f"{target_path} exists; pass force to replace it")
+        started = time.perf_counter()
+        directory = os.path.dirname(os.path.abspath(target_path))
+        fd, rebuilt = tempfile.mkstemp(suffix=".db", dir=directory)
+        os.close(fd)
+        try:
+            entry = self.rebuild(source, rebuilt, snapshot_id, at)
+            for suffix in ("-wal", "-shm", "-journal"):
+                # Leftovers from the old database would be replayed over the restored one
+                if os.path.exists(target_path + suffix):
+                    os.unlink(target_path + suffix)
+            os.replace(rebuilt, target_path)
+        finally:
+            if os.path.exists(rebuilt):
+                os.unlink(rebuilt)
+        return {
+            "source": source,
+            "snapshot": entry["id"],
+            "captured_at": entry.get("captured_at", entry["created_at"]),
+            "path": target_path,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def rebuild(self, source: str, path: str, snapshot_id: Optional[str] = None, at: Optional[float] = None) -> dict:
+        """Materialise a snapshot into path and verify it; returns its manifest entry"""
+        snapshots = self.manifest(source)
+        if not snapshots:
+            raise SnapshotError(f"No snapshots of {source} in {self.directory}")
+        index = len(snapshots) - 1
+        if snapshot_id is not None:
+            ids = [entry["id"] for entry in snapshots]
+            if snapshot_id not in ids:
+                raise SnapshotError(f"Snapshot {snapshot_id} of {source} not found")
+            index = ids.index(snapshot_id)
+        elif at is not None:
+            captured = [i for i, entry in enumerate(snapshots) if entry.get("captured_at", entry["created_at"]) <= at]
+            if not captured:
+                raise SnapshotError(f"No snapshot of {source} was captured by {datetime.fromtimestamp(at, timezone.utc).isoformat()}")
+            index = captured[-1]
+        first = index
+        while snapshots[first]["kind"] != "full":
+            first -= 1
+            if first < 0:
+                raise SnapshotError(f"Snapshot {snapshots[index]['id']} has no full snapshot to start from")
+
+        chain = snapshots[first:index + 1]
+        for entry in chain:
+            # Page-hash increments from before WAL shipping only recorded the rebuilt file's checksum
+            expected = entry["sha256"] if entry["kind"] == "full" else entry.get("file_sha256")
+            if expected and file_sha256(os.path.join(self.source_dir(source), entry["file"])) != expected:
+                raise SnapshotError(f"{source} snapshot file {entry['file']} does not match its recorded checksum")
+        shutil.copyfile(os.path.join(self.source_dir(source), chain[0]["file"]), path)
+        for entry in chain[1:]:
+            self.apply_delta(os.path.join(self.source_dir(source), entry["file"]), path)
+        set_rollback_journal_header(path)
+        entry = chain[-1]
+        if entry["kind"] != "full" and "sha256" in entry and file_sha256(path) != entry["sha256"]:
+            raise SnapshotError(f"Rebuilt {source} snapshot {entry['id']} does not match its recorded checksum")
+        check = integrity_check(path)
+        if check != "ok":
+            raise SnapshotError(f"Rebuilt {source} snapshot {entry['id']} failed integrity_check: {check}")
+        return entry
+
+    @staticmethod
+    def apply_delta(delta_path: str, path: str):
+        with gzip.open(delta_path, "rb") as delta, open(path, "r+b") as target:
+            magic, page_size, page_count, changed = _DELTA_HEADER.unpack(delta.read(_DELTA_HEADER.size))
+            if magic != _DELTA_MAGIC:
+                raise SnapshotError(f"{delta_path} is not a page delta")
+            for _ in range(changed):
+                (number,) = _PAGE_NUMBER.unpack(delta.read(_PAGE_NUMBER.size))
+                target.seek(number * page_size)
+                target.write(delta.read(page_size))
+            target.truncate(page_count * page_size)
+
+    def verify(self, source: str, snapshot_id: Optional[str] = None) -> dict:
+        """Rebuild a snapshot into a scratch file and check it, without restoring"""
+        fd, scratch = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            entry = self.rebuild(source, scratch, snapshot_id)
+        finally:
+            os.unlink(scratch)
+        return {"source": source, "snapshot": entry["id"], "ok": True}
+
+    # ---------- Reporting ----------
+
+    def stats(self) -> dict:
+        sources = {}
+        for source in self.sources:
+            snapshots = self.manifest(source)
+            durations = [entry["duration_ms"] for entry in snapshots]
+            captured = [entry.get("captured_at", entry["created_at"]) for entry in snapshots]
+            sources[source] = {
+                "snapshots": len(snapshots),
+                "full": sum(entry["kind"] == "full" for entry in snapshots),
+                "bytes": sum(entry["bytes"] for entry in snapshots),
+                "latest": snapshots[-1] if snapshots else None,
+                # Restore points span this range, one per snapshot
+                "restorable_from": min(captured) if captured else None,
+                "restorable_to": max(captured) if captured else None,
+                "p50_duration_ms": percentile(durations, 0.5),
+                "max_duration_ms": max(durations) if durations else None,
+            }
+        return {
+            "directory": self.directory,
+            "full_every": self.full_every,
+            "keep_full": self.keep_full,
+            "step_pages": self.step_pages,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "sources": sources,
+        }
+
+
+# ---------- Benchmark ----------
+
+def bench(rows: int, seconds: float, step_pages: List[int]):
+    """Write latency with no backup running, then while snapshots loop, per journal mode"""
+    for journal_mode in ("delete", "wal"):
+        directory = tempfile.mkdtemp(prefix="poetsync-backup-bench-")
+        path = os.path.join(directory, "bench.db")
+        conn = sqlite3.connect(path)
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        conn.execute("CREATE TABLE poems (id INTEGER PRIMARY KEY, content TEXT)")
+        conn.executemany("INSERT INTO poems (content) VALUES (?)", ((f"line {i} " * 40,) for i in range(rows)))
+        conn.commit()
+        conn.close()
+        size_mb = os.path.getsize(path) / 1e6
+
+        def measure(backing_up: Optional[int]) -> Tuple[List[float], List[dict], int]:
+            stop = threading.Event()
+            results = []
+            failed = [0]
+            manager = BackupManager({"bench": path}, os.path.join(directory, f"snapshots-{backing_up}"), step_pages=backing_up or STEP_PAGES)
+
+            def snapshots():
+                while not stop.is_set():
+                    try:
+                        results.append(manager.snapshot("bench"))
+                    except SnapshotError:
+                        failed[0] += 1
+
+            thread = threading.Thread(target=snapshots) if backing_up else None
+            if thread:
+                thread.start()
+            writer = sqlite3.connect(path, timeout=30)
+            # As set_wal_mode does for the API: only the backup manager checkpoints
+            writer.execute("PRAGMA wal_autocheckpoint=0")
+            latencies = []
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                writer.execute("INSERT INTO poems (content) VALUES (?)", ("new poem " * 40,))
+                writer.commit()
+                latencies.append((time.perf_counter() - started) * 1000)
+                time.sleep(0.002)
+            writer.close()
+            stop.set()
+            if thread:
+                thread.join()
+            manager.close()
+            return latencies, results, failed[0]
+
+        print(f"journal_mode={journal_mode}, {size_mb:.1f} MB database")
+        for setting in [None, *step_pages]:
+            latencies, results, failed = measure(setting)
+            label = "no backup" if setting is None else f"backup, {setting if setting > 0 else 'all'} pages/step"
+            line = f"  {label:<26} write p50 {percentile(latencies, 0.5):>6} ms  p99 {percentile(latencies, 0.99):>7} ms  max {max(latencies):>7.1f} ms"
+            if results or failed:
+                durations = [result["duration_ms"] for result in results]
+                fulls = [result for result in results if result["kind"] == "full"]
+                incremental = [result for result in results if result["kind"] == "incremental"]
+                line += f"  | {len(results)} snapshots"
+                if fulls:
+                    line += f", full median {statistics.median(result['duration_ms'] for result in fulls):.0f} ms"
+                    line += f", {sum(result['restarts'] for result in fulls)} restarts"
+                if incremental:
+                    line += f", incremental median {statistics.median(result['duration_ms'] for result in incremental):.0f} ms"
+                    line += f" / {statistics.median(result['changed_pages'] for result in incremental):.0f} pages"
+                if failed:
+                    line += f", {failed} gave up after {MAX_ATTEMPTS} attempts"
+            print(line)
+        shutil.rmtree(directory)
+
+
+def parse_time(value: str) -> float:
+    """Unix seconds, or an ISO 8601 time (UTC unless it names an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = commands.add_parser("snapshot", help="Take a snapshot of a database file now")
+    snapshot_parser.add_argument("--db", required=True)
+    snapshot_parser.add_argument("--dir", required=True)
+    snapshot_parser.add_argument("--source", default="main")
+    snapshot_parser.add_argument("--kind", choices=("auto", "full", "incremental"), default="auto")
+    list_parser = commands.add_parser("list", help="List snapshots")
+    list_parser.add_argument("--dir", required=True)
+    restore_parser = commands.add_parser("restore", help="Rebuild, verify and write out a snapshot")
+    restore_parser.add_argument("--dir", required=True)
+    restore_parser.add_argument("--source", default="main")
+    restore_parser.add_argument("--to", required=True)
+    restore_choice = restore_parser.add_mutually_exclusive_group()
+    restore_choice.add_argument("--snapshot", default=None, help="Snapshot id (defaults to the newest)")
+    restore_choice.add_argument("--at", type=parse_time, default=None, help="Newest snapshot captured at or before this time")
+    restore_parser.add_argument("--force", action="store_true", help="Replace an existing file")
+    verify_parser = commands.add_parser("verify", help="Rebuild and check snapshots without restoring")
+    verify_parser.add_argument("--dir", required=True)
+    verify_parser.add_argument("--all", action="store_true", help="Every snapshot, not just the newest of each source")
+    bench_parser = commands.add_parser("bench", help="Measure write latency while snapshots run")
+    bench_parser.add_argument("--rows", type=int, default=50000)
+    bench_parser.add_argument("--seconds", type=float, default=5)
+    bench_parser.add_argument("--step-pages", type=int, nargs="+", default=[64, STEP_PAGES, -1])
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.rows, args.seconds, args.step_pages)
+        return
+    if args.command == "snapshot":
+        manager = BackupManager({args.source: args.db}, args.dir)
+        try:
+            result = manager.snapshot(args.source, args.kind)
+        finally:
+            manager.close()
+        print(f"✅ {result['kind']} snapshot {result['id']}: {result['changed_pages']} pages, {result['bytes']} bytes in {result['duration_ms']} ms")
+        return
+
+    sources = sorted(name for name in os.listdir(args.dir) if os.path.isdir(os.path.join(args.dir, name)))
+    manager = BackupManager({source: None for source in sources}, args.dir)
+    if args.command == "list":
+        for source in sources:
+            print(source)
+            for entry in manager.manifest(source):
+                captured = datetime.fromtimestamp(entry.get("captured_at", entry["created_at"]), timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"  {entry['id']}  {captured}  {entry['kind']:<11} {entry['changed_pages']:>7} pages  {entry['bytes']:>10} bytes  {entry['duration_ms']:>8} ms")
+    elif args.command == "restore":
+        result = manager.restore(args.source, args.to, args.snapshot, args.force, at=args.at)
+        print(f"✅ Restored {result['source']} snapshot {result['snapshot']} to {result['path']} (checksums and integrity_check passed) in {result['duration_ms']} ms")
+    elif args.command == "verify":
+        failed = 0
+        for source in sources:
+            ids = [entry["id"] for entry in manager.manifest(source)]
+            for snapshot_id in (ids if args.all else ids[-1:]):
+                try:
+                    manager.verify(source, snapshot_id)
+                    print(f"✅ {source} {snapshot_id}")
+                except SnapshotError as e:
+                    failed += 1
+                    print(f"❌ {source} {snapshot_id}: {e}")
+        raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
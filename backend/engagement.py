@@ -0,0 +1,288 @@
+# backend/engagement.py
+"""Engagement counters and the trending/popular ranking for explore.
+
+Views, likes and pull requests received are counted in memory and written to
+the poem_engagement table in batches every few seconds, so a hot poem costs
+one UPSERT per flush instead of one row update per request. The table is kept
+apart from poems on purpose: bumping a counter must not bump the poem's
+optimistic-locking version and make the author's next edit fail.
+
+Rankings are held in an in-process index built at startup and kept current
+from the event bus (poem created / updated / deleted) and from record():
+
+    popular   views + 5 * likes + 10 * PRs received
+    trending  the same events, each decaying with a 24 hour half-life
+
+A trending score is stored as log(sum of w * e^(decay * (t - EPOCH))), so
+adding an event is one log-add and the order of poems never changes just
+because time passes; nothing has to be rescored on a timer. The score as of
+now is e^(key - decay * (now - EPOCH)). Unlikes lower popular but are not
+subtracted from trending. Callers only record a like or unlike that changed
+the poem_likes table, so each user counts once.
+
+Both the index and a flush clamp counts at zero, so an unlike can never leave
+a negative count, and a flush only writes rows for poems that still exist. A poem deleted
+while its deltas were in flight therefore leaves no orphan row behind.
+
+Like the event bus, the index is per process: with several API workers each
+ranks its own recent activity on top of what was flushed at startup.
+"""
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+from sqlalchemy import bindparam, exists, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+KINDS = ("views", "likes", "pull_requests")
+WEIGHTS = {"views": 1.0, "likes": 5.0, "pull_requests": 10.0}
+# A new poem starts with this much trending weight, so fresh work is visible
+CREATION_WEIGHT = 2.0
+TRENDING_HALF_LIFE_HOURS = 24
+DECAY = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+# Fixed reference time for trending keys (2023-11-14)
+EPOCH = 1_700_000_000
+SORTS = ("trending", "popular")
+
+
+def timestamp(value) -> float:
+    """Seconds since the Unix epoch for a naive-UTC datetime or its ISO string"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value is None:
+        return time.time()
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def trending_key(weight: float, at: float) -> float:
+    return math.log(weight) + DECAY * (at - EPOCH)
+
+
+def log_add(a: Optional[float], b: float) -> float:
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+class RankingIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # poem_id -> mutable entry; the sorted lists hold immutable tuples
+        # derived from it, so an entry is unlinked before it changes
+        self.entries: Dict[str, dict] = {}
+        self.trending = SortedList()
+        self.popular = SortedList()
+
+    # ---------- Maintenance ----------
+
+    @staticmethod
+    def popular_score(entry: dict) -> float:
+        return sum(WEIGHTS[kind] * entry[kind] for kind in KINDS)
+
+    def unlink(self, entry: dict):
+        if entry["public"]:
+            self.trending.discard((-entry["trending"], -entry["created"], entry["id"]))
+            self.popular.discard((-self.popular_score(entry), -entry["created"], entry["id"]))
+
+    def link(self, entry: dict):
+        if entry["public"]:
+            self.trending.add((-entry["trending"], -entry["created"], entry["id"]))
+            self.popular.add((-self.popular_score(entry), -entry["created"], entry["id"]))
+
+    def upsert(self, poem_id: str, created, public: bool, counts: Optional[dict] = None, trending: Optional[float] = None):
+        with self.lock:
+            entry = self.entries.get(poem_id)
+            if entry is not None:
+                self.unlink(entry)
+                entry["public"] = public
+            else:
+                created_at = timestamp(created)
+                entry = {
+                    "id": poem_id,
+                    "created": created_at,
+                    "public": public,
+                    "trending": trending if trending is not None else trending_key(CREATION_WEIGHT, created_at),
+                    **{kind: (counts or {}).get(kind) or 0 for kind in KINDS},
+                }
+                self.entries[poem_id] = entry
+            self.link(entry)
+
+    def remove(self, poem_id: str):
+        with self.lock:
+            entry = self.entries.pop(poem_id, None)
+            if entry is not None:
+                self.unlink(entry)
+
+    def record(self, poem_id: str, kind: str, n: int = 1, at: Optional[float] = None) -> Optional[float]:
+        """Apply n events of kind; returns the poem's new trending key, if it is indexed"""
+        with self.lock:
+            entry = self.entries.get(poem_id)
+            if entry is None:
+                return None
+            self.unlink(entry)
+            entry[kind] = max(0, entry[kind] + n)
+            if n > 0:
+                entry["trending"] = log_add(entry["trending"], trending_key(WEIGHTS[kind] * n, at or time.time()))
+            self.link(entry)
+            return entry["trending"]
+
+    def on_event(self, event):
+        """Event bus listener: track poem creation, visibility and deletion"""
+        data = event.data
+        if event.type == "poem.deleted":
+            self.remove(data["id"])
+        elif event.type in ("poem.created", "poem.updated"):
+            self.upsert(data["id"], data["created_at"], data["is_public"])
+
+    # ---------- Reads ----------
+
+    def page(self, sort: str, offset: int, limit: int, include: Optional[set] = None) -> Tuple[List[str], int]:
+        """Ranked poem ids, optionally only those in include, and how many there are"""
+        with self.lock:
+            ranked = self.trending if sort == "trending" else self.popular
+            if include is None:
+                return [poem_id for _, _, poem_id in ranked[offset:offset + limit]], len(ranked)
+            matching = [poem_id for _, _, poem_id in ranked if poem_id in include]
+        return matching[offset:offset + limit], len(matching)
+
+    def stats(self, poem_id: str, now: Optional[float] = None) -> dict:
+        with self.lock:
+            entry = self.entries.get(poem_id)
+            if entry is None:
+                return {}
+            now = now or time.time()
+            return {
+                "views": entry["views"],
+                "likes": entry["likes"],
+                "pull_requests_received": entry["pull_requests"],
+                "popular_score": self.popular_score(entry),
+                "trending_score": round(math.exp(entry["trending"] - DECAY * (now - EPOCH)), 4),
+            }
+
+
+class EngagementCounters:
+    """Write-behind counters: record() is in-memory, flush() UPSERTs the deltas"""
+
+    def __init__(self, table, engines: dict, ranking: RankingIndex, flush_interval: float = 5.0):
+        self.table = table
+        self.engines = engines
+        self.ranking = ranking
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        # poem_id -> {"shard": shard_id, "views": n, "likes": n, "pull_requests": n}
+        self.pending: Dict[str, dict] = {}
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="engagement-flush", daemon=True)
+        self.thread.start()
+
+    def load(self):
+        """Rebuild the ranking index from every shard"""
+        poems = self.table.metadata.tables["poems"]
+        statement = select(
+            poems.c.id, poems.c.created_at, poems.c.is_public,
+            *[self.table.c[kind] for kind in KINDS], self.table.c.trending,
+        ).select_from(poems.outerjoin(self.table, self.table.c.poem_id == poems.c.id))
+        for bind in self.engines.values():
+            with bind.connect() as conn:
+                for row in conn.execute(statement):
+                    counts = {kind: getattr(row, kind) for kind in KINDS}
+                    self.ranking.upsert(row.id, row.created_at, bool(row.is_public), counts, row.trending)
+
+    def record(self, poem_id: str, shard_id: str, kind: str, n: int = 1):
+        trending = self.ranking.record(poem_id, kind, n)
+        with self.lock:
+            delta = self.pending.setdefault(poem_id, {"shard": shard_id, **{k: 0 for k in KINDS}})
+            delta[kind] += n
+            delta["trending"] = trending
+
+    def discard(self, poem_id: str):
+        with self.lock:
+            self.pending.pop(poem_id, None)
+
+    def flush(self) -> int:
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+        by_shard: Dict[str, list] = {}
+        now = datetime.utcnow()
+        for poem_id, delta in batch.items():
+            by_shard.setdefault(delta["shard"], []).append({
+                "poem_id": poem_id,
+                **{kind: delta[kind] for kind in KINDS},
+                "trending": delta.get("trending"),
+                "updated_at": now,
+            })
+
+        written = 0
+        statement = self.upsert_statement()
+        for shard_id, rows in by_shard.items():
+            try:
+                with self.engines[shard_id].begin() as conn:
+                    conn.execute(statement, rows)
+                written += len(rows)
+            except Exception as e:
+                self.flush_errors += 1
+                print(f"⚠️ Engagement flush to shard {shard_id} failed, retrying next time: {e}")
+                self.requeue(rows, shard_id)
+        self.flushes += 1
+        self.flushed_rows += written
+        return written
+
+    def upsert_statement(self):
+        """Add each row's deltas to its poem's counters, never below zero and only while the poem exists"""
+        poems = self.table.metadata.tables["poems"]
+        columns = ["poem_id", *KINDS, "trending", "updated_at"]
+        # The deltas are bound directly: excluded.* would hold the clamped insert values
+        params = {name: bindparam(name, type_=self.table.c[name].type) for name in columns}
+        rows = select(
+            params["poem_id"],
+            *[func.max(params[kind], 0) for kind in KINDS],
+            params["trending"],
+            params["updated_at"],
+        ).where(exists().where(poems.c.id == params["poem_id"]))
+        statement = insert(self.table).from_select(columns, rows)
+        return statement.on_conflict_do_update(
+            index_elements=[self.table.c.poem_id],
+            set_={
+                **{kind: func.max(self.table.c[kind] + params[kind], 0) for kind in KINDS},
+                "trending": func.coalesce(params["trending"], self.table.c.trending),
+                "updated_at": params["updated_at"],
+            },
+        )
+
+    def requeue(self, rows: list, shard_id: str):
+        with self.lock:
+            for row in rows:
+                delta = self.pending.setdefault(row["poem_id"], {"shard": shard_id, **{k: 0 for k in KINDS}})
+                for kind in KINDS:
+                    delta[kind] += row[kind]
+                delta.setdefault("trending", row["trending"])
+
+    def run(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stopping.set()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            "pending_poems": pending,
+            "flush_interval_s": self.flush_interval,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+            "indexed_poems": len(self.ranking.entries),
+            "ranked_public_poems": len(self.ranking.trending),
+        }
@@ -0,0 +1,169 @@
+# backend/events.py
+"""In-process event bus for poem and pull-request changes.
+
+Endpoints publish after their commit; clients subscribe to topics over SSE or
+WebSocket instead of re-fetching lists:
+
+    explore             public poems created, updated or deleted
+    poem:{poem_id}      one poem: edits, deletion and pull requests against it
+    author:{user_id}    pull requests on this user's poems or opened by them
+    pull-requests       every pull request event (review queues)
+
+Each event gets an increasing id and is kept in a bounded history, so a client
+that reconnects with its last id (SSE's Last-Event-ID) is replayed what it
+missed. If that id has already fallen out of history the client is told to
+`reset` and re-fetch once. Every subscriber has a bounded buffer; one that
+falls behind is disconnected rather than letting its backlog grow, and can
+resume from its last id.
+
+The bus is per process: with several API workers, each only sees events from
+requests it served itself.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, List, Optional, Set
+
+TOPIC_PREFIXES = ("poem:", "author:")
+GLOBAL_TOPICS = ("explore", "pull-requests")
+MAX_TOPICS = 32
+
+
+class SlowConsumer(Exception):
+    pass
+
+
+def validate_topics(topics: Iterable[str]) -> Set[str]:
+    topics = {topic.strip() for topic in topics if topic.strip()}
+    if not topics:
+        raise ValueError("Subscribe to at least one topic")
+    if len(topics) > MAX_TOPICS:
+        raise ValueError(f"At most {MAX_TOPICS} topics per subscription")
+    for topic in topics:
+        if topic not in GLOBAL_TOPICS and not any(
+            topic.startswith(prefix) and len(topic) > len(prefix) for prefix in TOPIC_PREFIXES
+        ):
+            raise ValueError(f"Unknown topic: {topic}")
+    return topics
+
+
+class Event:
+    __slots__ = ("id", "type", "topics", "data", "timestamp")
+
+    def __init__(self, event_id: int, event_type: str, topics: Set[str], data: dict):
+        self.id = event_id
+        self.type = event_type
+        self.topics = topics
+        self.data = data
+        self.timestamp = time.time()
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "type": self.type, "topics": sorted(self.topics), "data": self.data}
+
+
+class Subscription:
+    """A subscriber's buffer; only touched from the event loop it was created on"""
+
+    def __init__(self, bus: "EventBus", topics: Set[str], max_buffer: int):
+        self.bus = bus
+        self.topics = topics
+        self.max_buffer = max_buffer
+        self.loop = asyncio.get_running_loop()
+        self.buffer = deque()
+        self.ready = asyncio.Event()
+        self.dropped = False
+        # Set when the requested replay is no longer available
+        self.reset = False
+
+    def offer(self, event: Event):
+        if self.dropped or not (event.topics & self.topics):
+            return
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped = True
+            self.bus.dropped += 1
+        else:
+            self.buffer.append(event)
+        self.ready.set()
+
+    async def next(self) -> Event:
+        while not self.buffer and not self.dropped:
+            self.ready.clear()
+            await self.ready.wait()
+        if self.dropped:
+            raise SlowConsumer()
+        return self.buffer.popleft()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, history: int = 1024, max_buffer: int = 256):
+        self.history = deque(maxlen=history)
+        self.max_buffer = max_buffer
+        self.subscribers: List[Subscription] = []
+        # Called synchronously with every event, in the publishing thread
+        self.listeners: List[Callable[[Event], None]] = []
+        self.lock = threading.Lock()
+        # Start from the clock so ids keep increasing across restarts and a
+        # client resuming from an older process is told to reset
+        self.last_id = int(time.time() * 1000)
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, event_type: str, topics: Iterable[str], data: dict) -> Event:
+        """Record an event and fan it out; safe to call from any thread"""
+        with self.lock:
+            self.last_id += 1
+            event = Event(self.last_id, event_type, set(topics), data)
+            self.history.append(event)
+            self.published += 1
+            for subscription in self.subscribers:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.offer, event)
+                except RuntimeError:
+                    # Its loop has shut down; the subscriber is going away
+                    pass
+        for listener in self.listeners:
+            listener(event)
+        return event
+
+    def add_listener(self, listener: Callable[[Event], None]):
+        """Register an in-process callback, e.g. to keep an index current"""
+        self.listeners.append(listener)
+
+    def subscribe(self, topics: Set[str], last_event_id: Optional[int] = None) -> Subscription:
+        """Register a subscriber, replaying events after last_event_id.
+
+        Must be called on the event loop that will consume it.
+        """
+        subscription = Subscription(self, topics, self.max_buffer)
+        with self.lock:
+            # Registered and replayed under the lock: nothing published in
+            # between can be missed or delivered twice
+            self.subscribers.append(subscription)
+            if last_event_id is not None:
+                oldest = self.history[0].id if self.history else self.last_id + 1
+                missed = [event for event in self.history if event.id > last_event_id and event.topics & topics]
+                if last_event_id < oldest - 1 or last_event_id > self.last_id or len(missed) > self.max_buffer:
+                    subscription.reset = True
+                else:
+                    subscription.buffer.extend(missed)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "subscribers": len(self.subscribers),
+                "published": self.published,
+                "dropped_subscribers": self.dropped,
+                "last_event_id": self.last_id,
+                "history": len(self.history),
+                "max_buffer": self.max_buffer,
+            }
@@ -0,0 +1,538 @@
+# backend/imagegen.py
+"""Stable Diffusion loading and named generation profiles.
+
+A profile bundles every knob that trades image quality against latency
+(scheduler, step count, resolution, guidance, dtype, attention slicing, CPU
+threads and memory format) so routes can pick one by name per request.
+Text-encoder outputs are cached by token ids, so regenerating a poem with a
+different seed or profile skips the CLIP forward pass. Callers can ask for
+progressive previews, decoded from the latents every few steps with a cheap
+linear approximation of the VAE.
+
+Several variants of one prompt run as a single batched pipeline call
+(num_images_per_prompt), sharing the prompt encoding and scheduler setup, with
+one seeded generator per image so each variant matches, to within rounding,
+what a single-image request with its seed would give. A batch that would not
+fit in free RAM (or GPU memory) is split into chunks sized from an estimate of
+the per-image working set, and a chunk that still runs out of memory is halved
+and retried.
+"""
+import base64
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import torch
+from diffusers import (
+    StableDiffusionPipeline,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    PNDMScheduler,
+)
+
+MODEL_ID = "CompVis/stable-diffusion-v1-4"
+DEFAULT_PROFILE = "standard"
+
+# Few-step solvers converge in 8-25 steps; PNDM is the model's stock scheduler
+SCHEDULERS = {
+    "dpmsolver++": lambda config: DPMSolverMultistepScheduler.from_config(
+        config, algorithm_type="dpmsolver++", use_karras_sigmas=True
+    ),
+    "euler_a": lambda config: EulerAncestralDiscreteScheduler.from_config(config),
+    "pndm": lambda config: PNDMScheduler.from_config(config),
+}
+
+# Least-squares map from SD 1.x latent channels to RGB; a near-free stand-in for
+# the VAE decoder that is good enough to show composition and colour
+LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+# Aim for about this many previews per run, spaced at least this far apart
+PREVIEWS_PER_RUN = 8
+PREVIEW_MIN_INTERVAL = 0.25
+PREVIEW_MAX_SIDE = 128
+
+# Upper bound on variants per request
+MAX_VARIANTS = 8
+# Share of free memory a variant batch may plan to use
+MEMORY_HEADROOM = 0.7
+# Convolution activations, skip connections and the VAE decode per image, on
+# top of the attention scores estimated in variant_bytes
+VARIANT_BASE_BYTES = 384 * 1024 * 1024
+
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+# Interactive previews use every core; longer runs leave half for the API
+# and for other workers' previews
+CPU_THREADS = os.cpu_count() or 1
+BATCH_THREADS = max(1, CPU_THREADS // 2)
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    name: str
+    scheduler: str
+    num_inference_steps: int
+    height: int
+    width: int
+    guidance_scale: float
+    # Tried in order; the first the device runs natively is used (see dtype_supported)
+    dtypes: Tuple[str, ...] = ("float32",)
+    attention_slicing: bool = False
+    # None leaves torch's thread pool at its default size
+    num_threads: Optional[int] = None
+    channels_last: bool = True
+
+
+PROFILES: Dict[str, GenerationProfile] = {
+    "preview": GenerationProfile(
+        name="preview",
+        scheduler="dpmsolver++",
+        num_inference_steps=8,
+        height=384,
+        width=384,
+        guidance_scale=5.0,
+        dtypes=("bfloat16", "float16", "float32"),
+        attention_slicing=True,
+        num_threads=CPU_THREADS,
+    ),
+    "standard": GenerationProfile(
+        name="standard",
+        scheduler="dpmsolver++",
+        num_inference_steps=20,
+        height=512,
+        width=512,
+        guidance_scale=7.0,
+        dtypes=("bfloat16", "float16", "float32"),
+        num_threads=BATCH_THREADS,
+    ),
+    # The library defaults generate_image used before profiles existed, with
+    # its float16 on CUDA and float32 elsewhere
+    "high": GenerationProfile(
+        name="high",
+        scheduler="pndm",
+        num_inference_steps=50,
+        height=512,
+        width=512,
+        guidance_scale=7.5,
+        dtypes=("float16", "float32"),
+        num_threads=BATCH_THREADS,
+    ),
+}
+
+
+class PromptEmbeddingCache:
+    """Byte-bounded LRU of text-encoder outputs keyed by tokenized prompt"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embeds
+
+    def put(self, key, embeds: torch.Tensor):
+        size = embeds.element_size() * embeds.nelement()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = embeds
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.element_size() * evicted.nelement()
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def encode_png_base64(image) -> str:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def encode_jpeg_base64(image, quality: int = 70) -> str:
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def latents_to_preview(latents: torch.Tensor):
+    """Approximate RGB preview of the first latent in a batch, PREVIEW_MAX_SIDE px on its long side"""
+    from PIL import Image
+
+    factors = LATENT_RGB_FACTORS.to(device=latents.device, dtype=torch.float32)
+    rgb = torch.einsum("chw,cr->hwr", latents[0].float(), factors)
+    pixels = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte().cpu().numpy()
+    image = Image.fromarray(pixels)
+    scale = PREVIEW_MAX_SIDE / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.BILINEAR)
+
+
+def default_device() -> str:
+    return os.environ.get("POETSYNC_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+
+
+@lru_cache(maxsize=None)
+def cpu_flags() -> FrozenSet[str]:
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            match = re.search(r"^flags\s*:(.*)$", cpuinfo.read(), re.MULTILINE)
+    except OSError:
+        return frozenset()
+    return frozenset(match.group(1).split()) if match else frozenset()
+
+
+def dtype_supported(device: str, name: str) -> bool:
+    """Whether the device computes in this dtype natively; emulated half precision is slower than float32"""
+    if name == "float32":
+        return True
+    if device.startswith("cuda"):
+        return name == "float16" or torch.cuda.is_bf16_supported()
+    return name == "bfloat16" and bool({"avx512_bf16", "amx_bf16"} & cpu_flags())
+
+
+def available_memory(device: str) -> Optional[int]:
+    """Free bytes on the device: GPU memory on CUDA, MemAvailable otherwise"""
+    if device.startswith("cuda"):
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free
+    try:
+        with open("/proc/meminfo") as meminfo:
+            match = re.search(r"^MemAvailable:\s+(\d+) kB", meminfo.read(), re.MULTILINE)
+        if match:
+            return int(match.group(1)) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def variant_bytes(profile: GenerationProfile, dtype: torch.dtype) -> int:
+    """Rough peak working set one extra image adds to a batch.
+
+    The largest tensors are the self-attention scores of the UNet's
+    full-resolution blocks: (latent pixels)^2 per head, twice over for
+    classifier-free guidance. Attention slicing computes one head at a time.
+    """
+    tokens = (profile.height // 8) * (profile.width // 8)
+    heads = 1 if profile.attention_slicing else 8
+    element = torch.tensor([], dtype=dtype).element_size()
+    # Scores and their softmax are alive together
+    attention = 2 * 2 * heads * tokens * tokens * element
+    return attention + VARIANT_BASE_BYTES
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+class ImageGenerator:
+    """Runs profiles against lazily loaded pipelines, one generation at a time"""
+
+    def __init__(self, model_id: str = MODEL_ID, device: Optional[str] = None):
+        self.model_id = model_id
+        self.device = device or default_device()
+        self._pipes = {}
+        self._schedulers = {}
+        self._negative_embeds = {}
+        cache_mb = int(os.environ.get("POETSYNC_PROMPT_CACHE_MB", "64"))
+        self.prompt_cache = PromptEmbeddingCache(cache_mb * 1024 * 1024)
+        # Schedulers, attention slicing and torch's thread count are pipeline-
+        # or process-wide state, so concurrent requests take turns
+        self._lock = threading.Lock()
+
+    def resolve_dtype(self, profile: GenerationProfile) -> torch.dtype:
+        for name in profile.dtypes:
+            if dtype_supported(self.device, name):
+                return DTYPES[name]
+        return torch.float32
+
+    def pipe_key(self, profile: GenerationProfile) -> tuple:
+        return (self.resolve_dtype(profile), profile.channels_last)
+
+    def get_pipe(self, profile: GenerationProfile) -> StableDiffusionPipeline:
+        """Load (once) the pipeline matching the profile's dtype and memory format"""
+        key = self.pipe_key(profile)
+        pipe = self._pipes.get(key)
+        if pipe is None:
+            pipe = StableDiffusionPipeline.from_pretrained(self.model_id, torch_dtype=key[0]).to(self.device)
+            pipe.set_progress_bar_config(disable=True)
+            if profile.channels_last:
+                pipe.unet.to(memory_format=torch.channels_last)
+                pipe.vae.to(memory_format=torch.channels_last)
+            self._pipes[key] = pipe
+            # The unconditional ("") embedding is the same for every request
+            self._negative_embeds[key] = self.run_text_encoder(pipe, "")
+        return pipe
+
+    def get_scheduler(self, pipe: StableDiffusionPipeline, name: str):
+        key = (id(pipe), name)
+        scheduler = self._schedulers.get(key)
+        if scheduler is None:
+            scheduler = SCHEDULERS[name](pipe.scheduler.config)
+            self._schedulers[key] = scheduler
+        return scheduler
+
+    def tokenize(self, pipe: StableDiffusionPipeline, prompt: str):
+        return pipe.tokenizer(
+            prompt,
+            padding="max_length",
+            max_length=pipe.tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt",
+        )
+
+    def run_text_encoder(self, pipe: StableDiffusionPipeline, prompt: str) -> torch.Tensor:
+        """Encode the prompt exactly as StableDiffusionPipeline._encode_prompt does"""
+        text_inputs = self.tokenize(pipe, prompt)
+        attention_mask = None
+        if getattr(pipe.text_encoder.config, "use_attention_mask", False):
+            attention_mask = text_inputs.attention_mask.to(pipe.device)
+        with torch.inference_mode():
+            embeds = pipe.text_encoder(text_inputs.input_ids.to(pipe.device), attention_mask=attention_mask)[0]
+        return embeds.to(dtype=pipe.text_encoder.dtype)
+
+    def encode_prompt(self, profile: GenerationProfile, prompt: str):
+        """Return (prompt_embeds, negative_prompt_embeds), reusing cached encodings"""
+        pipe = self.get_pipe(profile)
+        pipe_key = self.pipe_key(profile)
+        # Prompts past CLIP's 77-token window are truncated before encoding, so
+        # keying on the truncated ids lets such prompts share an entry
+        token_ids = tuple(self.tokenize(pipe, prompt).input_ids[0].tolist())
+        cache_key = (pipe_key, token_ids)
+        prompt_embeds = self.prompt_cache.get(cache_key)
+        if prompt_embeds is None:
+            prompt_embeds = self.run_text_encoder(pipe, prompt)
+            self.prompt_cache.put(cache_key, prompt_embeds)
+        return prompt_embeds, self._negative_embeds[pipe_key]
+
+    def preview_callback(self, profile: GenerationProfile, on_preview: Callable[[dict], None]):
+        """Build a pipeline step callback that emits throttled latent previews"""
+        total = profile.num_inference_steps
+        every = max(1, total // PREVIEWS_PER_RUN)
+        last_sent = [0.0]
+
+        def callback(step: int, timestep, latents: torch.Tensor):
+            done = step + 1
+            if done % every or done == total:
+                return
+            now = time.perf_counter()
+            if now - last_sent[0] < PREVIEW_MIN_INTERVAL:
+                return
+            last_sent[0] = now
+            on_preview({"step": done, "total": total, "image": encode_jpeg_base64(latents_to_preview(latents))})
+
+        return callback
+
+    def max_batch(self, profile: GenerationProfile) -> int:
+        """How many images of this profile fit in one pipeline call right now"""
+        limit = int(os.environ.get("POETSYNC_MAX_VARIANT_BATCH", MAX_VARIANTS))
+        free = available_memory(self.device)
+        if free is None:
+            return max(1, limit)
+        fits = int(free * MEMORY_HEADROOM) // variant_bytes(profile, self.resolve_dtype(profile))
+        return max(1, min(limit, fits))
+
+    def prepare(self, profile: GenerationProfile) -> StableDiffusionPipeline:
+        """Point the pipeline at the profile's scheduler and attention mode; hold self._lock"""
+        pipe = self.get_pipe(profile)
+        pipe.scheduler = self.get_scheduler(pipe, profile.scheduler)
+        if profile.attention_slicing:
+            pipe.enable_attention_slicing()
+        else:
+            pipe.disable_attention_slicing()
+        return pipe
+
+    def generate(
+        self,
+        prompt: str,
+        profile: GenerationProfile,
+        seed: Optional[int] = None,
+        on_preview: Optional[Callable[[dict], None]] = None,
+        output_type: str = "pil",
+    ) -> dict:
+        """Generate one image; returns the PIL image plus timing and settings.
+
+        With on_preview set, it is called from the generating thread with a
+        small JPEG preview every few denoising steps. output_type="np" returns
+        the pipeline's float RGB array in [0, 1] instead of a PIL image.
+        """
+        with self._lock:
+            pipe = self.prepare(profile)
+            previous_threads = torch.get_num_threads()
+            if profile.num_threads:
+                torch.set_num_threads(profile.num_threads)
+            generator = torch.Generator(device="cpu").manual_seed(seed) if seed is not None else None
+            callback = self.preview_callback(profile, on_preview) if on_preview else None
+            try:
+                started = time.perf_counter()
+                prompt_embeds, negative_prompt_embeds = self.encode_prompt(profile, prompt)
+                with torch.inference_mode():
+                    image = pipe(
+                        prompt_embeds=prompt_embeds,
+                        negative_prompt_embeds=negative_prompt_embeds,
+                        height=profile.height,
+                        width=profile.width,
+                        num_inference_steps=profile.num_inference_steps,
+                        guidance_scale=profile.guidance_scale,
+                        generator=generator,
+                        callback=callback,
+                        output_type=output_type,
+                    ).images[0]
+                wall_time = time.perf_counter() - started
+            finally:
+                torch.set_num_threads(previous_threads)
+
+        return {
+            "image": image,
+            "profile": profile.name,
+            "wall_time_ms": round(wall_time * 1000, 1),
+            "settings": asdict(profile),
+        }
+
+    def generate_variants(
+        self,
+        prompt: str,
+        profile: GenerationProfile,
+        seeds: List[int],
+        on_preview: Optional[Callable[[dict], None]] = None,
+        output_type: str = "pil",
+    ) -> dict:
+        """Generate one image per seed from a single prompt encoding.
+
+        Seeds run in as few pipeline calls as memory allows; "batches" in the
+        result lists the size of each call. Previews follow the first image of
+        each call. output_type is passed to the pipeline as in generate().
+        """
+        if not seeds:
+            raise ValueError("At least one seed is required")
+        with self._lock:
+            pipe = self.prepare(profile)
+            previous_threads = torch.get_num_threads()
+            if profile.num_threads:
+                torch.set_num_threads(profile.num_threads)
+            callback = self.preview_callback(profile, on_preview) if on_preview else None
+            images, batches = [], []
+            try:
+                started = time.perf_counter()
+                prompt_embeds, negative_prompt_embeds = self.encode_prompt(profile, prompt)
+                batch_size = self.max_batch(profile)
+                while len(images) < len(seeds):
+                    chunk = seeds[len(images):len(images) + batch_size]
+                    try:
+                        with torch.inference_mode():
+                            output = pipe(
+                                prompt_embeds=prompt_embeds,
+                                negative_prompt_embeds=negative_prompt_embeds,
+                                num_images_per_prompt=len(chunk),
+                                height=profile.height,
+                                width=profile.width,
+                                num_inference_steps=profile.num_inference_steps,
+                                guidance_scale=profile.guidance_scale,
+                                generator=[torch.Generator(device="cpu").manual_seed(seed) for seed in chunk],
+                                callback=callback,
+                                output_type=output_type,
+                            )
+                    except (RuntimeError, MemoryError) as e:
+                        if len(chunk) == 1 or not is_out_of_memory(e):
+                            raise
+                        if self.device.startswith("cuda"):
+                            torch.cuda.empty_cache()
+                        batch_size = len(chunk) // 2
+                        continue
+                    images.extend(output.images)
+                    batches.append(len(chunk))
+                wall_time = time.perf_counter() - started
+            finally:
+                torch.set_num_threads(previous_threads)
+
+        return {
+            "images": images,
+            "seeds": list(seeds),
+            "batches": batches,
+            "profile": profile.name,
+            "wall_time_ms": round(wall_time * 1000, 1),
+            "settings": asdict(profile),
+        }
+
+    def render(
+        self,
+        prompt: str,
+        profile: GenerationProfile,
+        seed: Optional[int] = None,
+        on_preview: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """Generate one image and return a JSON-ready result with a base64 PNG"""
+        result = self.generate(prompt, profile, seed=seed, on_preview=on_preview)
+        result["image"] = encode_png_base64(result["image"])
+        return result
+
+    def render_variants(
+        self,
+        prompt: str,
+        profile: GenerationProfile,
+        seeds: List[int],
+        on_preview: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """Generate one image per seed; returns {"variants": [{"seed", "image"}], ...} with base64 PNGs"""
+        result = self.generate_variants(prompt, profile, seeds, on_preview=on_preview)
+        images, seeds = result.pop("images"), result.pop("seeds")
+        result["variants"] = [{"seed": seed, "image": encode_png_base64(image)} for seed, image in zip(seeds, images)]
+        return result
+
+    def stats(self) -> dict:
+        return {"prompt_cache": self.prompt_cache.stats()}
+
+
+def load_image_generator(profile_name: str = DEFAULT_PROFILE) -> Optional[ImageGenerator]:
+    """Create the generator and warm the default profile's pipeline"""
+    try:
+        generator = ImageGenerator()
+        generator.get_pipe(PROFILES[profile_name])
+        return generator
+    except Exception as e:
+        print("❌ Failed to load Stable Diffusion pipeline:", e)
+        return None
@@ -0,0 +1,549 @@
+# backend/inference_workers.py
+"""Dedicated Stable Diffusion worker processes shared by every API worker.
+
+Run the pool once per host:
+
+    python inference_workers.py --workers 2 --socket /tmp/poetsync-inference.sock
+
+and start the API with POETSYNC_INFERENCE_SOCKET pointing at the same path.
+API workers then never load the model themselves. A supervisor process
+accepts requests on the Unix socket, queues them, and hands each one to an
+idle worker over that worker's own queue, so it always knows which request a
+worker holds. A worker that crashes, stops sending heartbeats (they come from
+a side thread, so they continue mid-generation) or overruns
+GENERATION_TIMEOUT is replaced after a short backoff, and the request it held
+fails at once. Each worker is pinned to its own slice of CPUs and torch
+threads. Finished images are written once, straight from the pipeline's
+array, into POSIX shared memory; the API worker maps the block by name and
+encodes the PNG from it. Progressive
+previews, when requested, are relayed as interim messages before the result.
+A request carrying a list of seeds is generated as one batch of variants and
+comes back as one shared-memory block per image.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import wait
+from typing import Callable, Optional
+
+import numpy as np
+
+DEFAULT_SOCKET = "/tmp/poetsync-inference.sock"
+HEARTBEAT_INTERVAL = 1.0
+# Heartbeats continue while a worker generates, so one silent this long is
+# frozen rather than busy
+WEDGE_TIMEOUT = 30.0
+# How long a caller waits for its image; a worker still on it after that is replaced
+GENERATION_TIMEOUT = 600.0
+RESTART_BACKOFF = 2.0
+
+_HEADER = struct.Struct("!I")
+
+
+# ---------- Wire protocol ----------
+
+def send_message(sock: socket.socket, message: dict):
+    payload = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def recv_message(sock: socket.socket) -> Optional[dict]:
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    payload = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    return json.loads(payload) if payload is not None else None
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = bytearray()
+    while len(chunks) < size:
+        chunk = sock.recv(size - len(chunks))
+        if not chunk:
+            return None
+        chunks.extend(chunk)
+    return bytes(chunks)
+
+
+# ---------- Shared-memory image handoff ----------
+
+def export_image(pixels: np.ndarray) -> dict:
+    """Write a float RGB array in [0, 1] into a fresh shared-memory block owned by the reader"""
+    height, width, _ = pixels.shape
+    nbytes = height * width * 3
+    block = shared_memory.SharedMemory(create=True, size=nbytes)
+    view = np.ndarray((height, width, 3), dtype=np.uint8, buffer=block.buf)
+    # Scaled in place and cast straight into the block, rounding as PIL conversion does
+    np.multiply(pixels, 255, out=pixels)
+    np.rint(pixels, out=pixels)
+    view[...] = pixels
+    del view
+    # The API worker unlinks the block once it has read it; stop this process's
+    # resource tracker from deleting it when the worker exits
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return {"shm": block.name, "size": (width, height), "nbytes": nbytes}
+
+
+def import_image(handle: dict, consume):
+    """Map a block written by export_image, pass a PIL view to consume, free it"""
+    from PIL import Image
+
+    block = shared_memory.SharedMemory(name=handle["shm"])
+    try:
+        view = block.buf[:handle["nbytes"]]
+        image = Image.frombuffer("RGB", tuple(handle["size"]), view, "raw", "RGB", 0, 1)
+        try:
+            return consume(image)
+        finally:
+            del image
+            view.release()
+    finally:
+        block.close()
+        block.unlink()
+
+
+def release_images(response: dict):
+    """Free the blocks of a response that will never be imported"""
+    handles = response.get("images") or ([response["image"]] if response.get("image") else [])
+    for handle in handles:
+        try:
+            block = shared_memory.SharedMemory(name=handle["shm"])
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+
+
+# ---------- Model worker process ----------
+
+def send_heartbeats(index: int, events, generator):
+    while True:
+        events.put(("heartbeat", index, generator.stats()))
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def worker_main(index: int, cpus: list, threads: int, tasks, events, model_id: Optional[str]):
+    import torch
+    from imagegen import DEFAULT_PROFILE, PROFILES, ImageGenerator
+
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    generator = ImageGenerator(model_id) if model_id else ImageGenerator()
+    generator.get_pipe(PROFILES[DEFAULT_PROFILE])
+    events.put(("ready", index, os.getpid()))
+    threading.Thread(target=send_heartbeats, args=(index, events, generator), daemon=True).start()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        on_preview = None
+        if task.get("previews"):
+            def on_preview(preview, task_id=task["id"]):
+                events.put(("preview", index, {"id": task_id, **preview}))
+        try:
+            if task.get("seeds"):
+                result = generator.generate_variants(
+                    task["prompt"],
+                    PROFILES[task["profile"]],
+                    task["seeds"],
+                    on_preview=on_preview,
+                    output_type="np",
+                )
+                images = [export_image(image) for image in result.pop("images")]
+                events.put(("done", index, {"id": task["id"], **result, "images": images}))
+                continue
+            result = generator.generate(
+                task["prompt"],
+                PROFILES[task["profile"]],
+                seed=task.get("seed"),
+                on_preview=on_preview,
+                output_type="np",
+            )
+            image = result.pop("image")
+            events.put(("done", index, {"id": task["id"], **result, "image": export_image(image)}))
+        except Exception as e:
+            events.put(("failed", index, {"id": task["id"], "detail": str(e)}))
+
+
+# ---------- Supervisor ----------
+
+class WorkerSlot:
+    def __init__(self, index: int, cpus: list, threads: int):
+        self.index = index
+        self.cpus = cpus
+        self.threads = threads
+        self.process = None
+        self.tasks = None
+        self.pid = None
+        self.ready = False
+        self.current_task = None
+        self.task_started = None
+        self.last_seen = time.monotonic()
+        self.restart_at = None
+        self.restarts = 0
+        self.stats = {}
+
+    def describe(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "alive": bool(self.process and self.process.is_alive()),
+            "ready": self.ready,
+            "busy": self.current_task is not None,
+            "restarting": self.restart_at is not None,
+            "cpus": self.cpus,
+            "threads": self.threads,
+            "restarts": self.restarts,
+            "seconds_since_heartbeat": round(time.monotonic() - self.last_seen, 1),
+            **self.stats,
+        }
+
+
+class InferenceSupervisor:
+    """Owns the worker processes and routes requests to them"""
+
+    def __init__(self, num_workers: int, threads_per_worker: Optional[int] = None, model_id: Optional[str] = None):
+        self.ctx = mp.get_context("spawn")
+        self.events = self.ctx.Queue()
+        self.model_id = model_id
+        # Requests not yet handed to a worker, and callers waiting on any request
+        self.backlog = deque()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        per_worker = max(1, len(cpus) // num_workers)
+        threads = threads_per_worker or per_worker
+        self.slots = []
+        for index in range(num_workers):
+            pinned = cpus[index * per_worker:(index + 1) * per_worker] if len(cpus) >= num_workers else []
+            self.slots.append(WorkerSlot(index, pinned, threads))
+
+    def start(self):
+        for slot in self.slots:
+            self.spawn(slot)
+        threading.Thread(target=self.read_events, daemon=True).start()
+        threading.Thread(target=self.monitor, daemon=True).start()
+
+    def spawn(self, slot: WorkerSlot):
+        slot.tasks = self.ctx.Queue()
+        slot.process = self.ctx.Process(
+            target=worker_main,
+            args=(slot.index, slot.cpus, slot.threads, slot.tasks, self.events, self.model_id),
+            daemon=True,
+        )
+        slot.process.start()
+        slot.pid = slot.process.pid
+        slot.ready = False
+        slot.current_task = None
+        slot.restart_at = None
+        slot.last_seen = time.monotonic()
+
+    def dispatch(self):
+        """Hand queued requests to idle workers; hold self.lock"""
+        idle = [slot for slot in self.slots if slot.ready and slot.current_task is None]
+        while idle and self.backlog:
+            request = self.backlog.popleft()
+            if request["id"] not in self.pending:
+                continue  # its caller gave up while it was queued
+            slot = idle.pop()
+            slot.current_task = request["id"]
+            slot.task_started = time.monotonic()
+            slot.tasks.put(request)
+
+    def read_events(self):
+        while True:
+            kind, index, payload = self.events.get()
+            slot = self.slots[index]
+            slot.last_seen = time.monotonic()
+            if kind == "ready":
+                with self.lock:
+                    # Ignore a replaced process that got its message out late
+                    if payload == slot.pid:
+                        slot.ready = True
+                        self.dispatch()
+            elif kind == "heartbeat":
+                slot.stats = payload
+            elif kind == "preview":
+                with self.lock:
+                    waiter = self.pending.get(payload["id"])
+                if waiter is not None:
+                    waiter.put(("preview", payload))
+            elif kind in ("done", "failed"):
+                with self.lock:
+                    # A late result from a replaced worker must not free its successor
+                    if slot.current_task == payload["id"]:
+                        slot.current_task = None
+                    self.dispatch()
+                self.resolve(payload["id"], {"ok": kind == "done", **payload})
+
+    def resolve(self, task_id: str, response: dict):
+        with self.lock:
+            waiter = self.pending.pop(task_id, None)
+        if waiter is None:
+            # The caller gave up; free the images it would have consumed
+            release_images(response)
+            return
+        waiter.put(("result", response))
+
+    def monitor(self):
+        while True:
+            running = [slot for slot in self.slots if slot.restart_at is None]
+            restarts = [slot.restart_at for slot in self.slots if slot.restart_at is not None]
+            timeout = HEARTBEAT_INTERVAL
+            if restarts:
+                timeout = max(0.0, min(timeout, min(restarts) - time.monotonic()))
+            # Wakes as soon as a worker process exits
+            wait([slot.process.sentinel for slot in running], timeout=timeout)
+            now = time.monotonic()
+            for slot in self.slots:
+                if slot.restart_at is not None:
+                    if now >= slot.restart_at:
+                        self.spawn(slot)
+                    continue
+                problem = self.diagnose(slot, now)
+                if problem:
+                    self.retire(slot, problem)
+
+    def diagnose(self, slot: WorkerSlot, now: float) -> Optional[str]:
+        """Why a worker must be replaced, or None if it is healthy"""
+        if not slot.process.is_alive():
+            return "exited"
+        if slot.ready and now - slot.last_seen > WEDGE_TIMEOUT:
+            return f"sent no heartbeat for {WEDGE_TIMEOUT:g}s"
+        if slot.current_task is not None and now - slot.task_started > GENERATION_TIMEOUT:
+            return f"did not finish within {GENERATION_TIMEOUT:g}s"
+        return None
+
+    def retire(self, slot: WorkerSlot, problem: str):
+        """Kill a failed worker, fail the request it held and schedule its restart"""
+        if slot.process.is_alive():
+            slot.process.kill()
+        with self.lock:
+            task_id, slot.current_task = slot.current_task, None
+            slot.ready = False
+        if task_id is not None:
+            self.resolve(task_id, {
+                "ok": False,
+                "id": task_id,
+                "detail": f"Inference worker {slot.index} {problem} while generating",
+            })
+        slot.process.join(timeout=5)
+        slot.restarts += 1
+        slot.restart_at = time.monotonic() + RESTART_BACKOFF
+
+    def submit(self, request: dict, timeout: float, on_preview: Optional[Callable[[dict], None]] = None) -> dict:
+        waiter = queue.Queue()
+        with self.lock:
+            # A reused id would hand the running request's result to this caller
+            if request["id"] in self.pending:
+                return {"ok": False, "id": request["id"], "detail": "A request with this id is already running"}
+            self.pending[request["id"]] = waiter
+            self.backlog.append(request)
+            self.dispatch()
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    kind, payload = waiter.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    return {"ok": False, "id": request["id"], "detail": "Timed out waiting for an inference worker"}
+                if kind == "result":
+                    return payload
+                if on_preview is not None:
+                    payload.pop("id", None)
+                    on_preview(payload)
+        finally:
+            # Unclaimed, a late result is freed by resolve and a queued request is skipped
+            with self.lock:
+                if self.pending.get(request["id"]) is waiter:
+                    del self.pending[request["id"]]
+
+    def health(self) -> dict:
+        workers = [slot.describe() for slot in self.slots]
+        return {
+            "ok": any(worker["ready"] and worker["alive"] for worker in workers),
+            "queued": len(self.backlog),
+            "workers": workers,
+        }
+
+    def make_server(self, socket_path: str) -> socketserver.ThreadingUnixStreamServer:
+        supervisor = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    message = recv_message(self.request)
+                    if message is None:
+                        return
+                    if message.get("op") == "health":
+                        send_message(self.request, supervisor.health())
+                    elif message.get("op") == "generate":
+                        relay = lambda preview: send_message(self.request, {"preview": preview})
+                        try:
+                            response = supervisor.submit(
+                                message,
+                                message.get("timeout", GENERATION_TIMEOUT),
+                                on_preview=relay if message.get("previews") else None,
+                            )
+                        except OSError:
+                            return  # the API worker went away during previews
+                        try:
+                            send_message(self.request, response)
+                        except OSError:
+                            # Only the API worker unlinks the images, and it is gone
+                            release_images(response)
+                            return
+                    else:
+                        send_message(self.request, {"ok": False, "detail": "Unknown operation"})
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        server.daemon_threads = True
+        return server
+
+    def serve(self, socket_path: str):
+        server = self.make_server(socket_path)
+        self.start()
+        print(f"Inference pool with {len(self.slots)} workers listening on {socket_path}")
+        server.serve_forever()
+
+
+# ---------- Client used by API workers ----------
+
+class InferenceClient:
+    """Drop-in replacement for ImageGenerator that calls the worker pool"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = GENERATION_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _call(self, message: dict, on_preview: Optional[Callable[[dict], None]] = None) -> dict:
+        # One persistent connection per API thread. A connection the pool closed
+        # since its last use fails while sending, and only then is the request
+        # resent: once it has been written the pool may already be running it.
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            sent = False
+            try:
+                if sock is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(self.timeout + 5)
+                    sock.connect(self.socket_path)
+                    self._local.sock = sock
+                send_message(sock, message)
+                sent = True
+                while True:
+                    response = recv_message(sock)
+                    if response is None:
+                        raise ConnectionError("Inference pool closed the connection")
+                    if "preview" not in response:
+                        return response
+                    if on_preview is not None:
+                        on_preview(response["preview"])
+            except BaseException as e:
+                # The stream may be mid-response, so the connection is not reused
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if sent or attempt or not isinstance(e, OSError):
+                    raise
+
+    def health(self) -> dict:
+        return self._call({"op": "health"})
+
+    def stats(self) -> dict:
+        return {"workers": self.health()["workers"]}
+
+    def render(
+        self,
+        prompt: str,
+        profile,
+        seed: Optional[int] = None,
+        on_preview: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        from imagegen import encode_png_base64
+
+        request_id = os.urandom(8).hex()
+        response = self._call({
+            "op": "generate",
+            "id": request_id,
+            "prompt": prompt,
+            "profile": profile.name,
+            "seed": seed,
+            "previews": on_preview is not None,
+            "timeout": self.timeout,
+        }, on_preview=on_preview)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("detail", "Inference failed"))
+        handle = response.pop("image")
+        response["image"] = import_image(handle, encode_png_base64)
+        for key in ("ok", "id"):
+            response.pop(key, None)
+        return response
+
+    def render_variants(
+        self,
+        prompt: str,
+        profile,
+        seeds: list,
+        on_preview: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        from imagegen import encode_png_base64
+
+        request_id = os.urandom(8).hex()
+        response = self._call({
+            "op": "generate",
+            "id": request_id,
+            "prompt": prompt,
+            "profile": profile.name,
+            "seeds": list(seeds),
+            "previews": on_preview is not None,
+            "timeout": self.timeout,
+        }, on_preview=on_preview)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("detail", "Inference failed"))
+        handles, seeds = response.pop("images"), response.pop("seeds")
+        # Read every block even if one fails, so none is left in /dev/shm
+        images, error = [], None
+        for handle in handles:
+            try:
+                images.append(import_image(handle, encode_png_base64))
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        response["variants"] = [{"seed": seed, "image": image} for seed, image in zip(seeds, images)]
+        for key in ("ok", "id"):
+            response.pop(key, None)
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the shared Stable Diffusion worker pool")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--socket", default=os.environ.get("POETSYNC_INFERENCE_SOCKET", DEFAULT_SOCKET))
+    parser.add_argument("--model", default=None, help="Model id or local path (defaults to imagegen.MODEL_ID)")
+    args = parser.parse_args()
+    InferenceSupervisor(args.workers, args.threads_per_worker, args.model).serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
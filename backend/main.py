@@ -1,22 +1,73 @@
 # backend/main.py
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 from pydantic import BaseModel
 from typing import List, Optional
 from uuid import uuid4
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, create_engine, Text, Boolean, ForeignKey
+from dataclasses import asdict
+from sqlalchemy import Column, String, DateTime, Text, Boolean, ForeignKey, Integer, Float, Index, inspect, text, event, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from diffusers import StableDiffusionPipeline
-import torch
-import base64
-from io import BytesIO
+from sqlalchemy.orm import sessionmaker, Session, relationship, deferred
+from sqlalchemy.orm.exc import StaleDataError
+from imagegen import PROFILES, DEFAULT_PROFILE, MAX_VARIANTS, load_image_generator
+from inference_workers import InferenceClient
+from scheduler import InferenceScheduler, QueueFull, ClientDisconnected
+from sharding import ShardMap, make_engine, sharded_sessionmaker, fetch_ordered
+from write_coalescer import WriteCoalescer, WriteTimeout, configure_durability
+from events import EventBus, SlowConsumer, validate_topics
+from engagement import EngagementCounters, RankingIndex, SORTS as RANKED_SORTS
+from facets import FacetIndex, MATCH_MODES, VISIBILITY
+from profiling import Profiler, ProfilingMiddleware
+from backups import BackupManager, SnapshotError, latency_impact, set_wal_mode
+from response_cache import CompressedResponseCache, IDENTITY
+from dedup import DuplicateIndex, same_text
+from prosody import ProsodyCache, content_hash
+import os
+import json
+import asyncio
+import atexit
+import hmac
+import random
 
 DATABASE_URL = "sqlite:///./pullrequests.db"
+# Path to a shardmap.json (see sharding.py) to spread poems and their pull
+# requests over several database files by author
+SHARD_MAP = os.environ.get("POETSYNC_SHARD_MAP")
+# full / normal / off, see write_coalescer.py
+WRITE_DURABILITY = os.environ.get("POETSYNC_WRITE_DURABILITY", "full")
+# How long the writer waits for more inserts before committing a batch
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("POETSYNC_GROUP_COMMIT_MS", "2"))
+# How often buffered view/like/PR counts are written out
+ENGAGEMENT_FLUSH_SECONDS = float(os.environ.get("POETSYNC_ENGAGEMENT_FLUSH_SECONDS", "5"))
+# Sent as X-Admin-Token to use the /api/admin routes and request profiling;
+# both are disabled when unset
+ADMIN_TOKEN = os.environ.get("POETSYNC_ADMIN_TOKEN")
+# Statements slower than this go to the slow-query log
+SLOW_QUERY_MS = float(os.environ.get("POETSYNC_SLOW_QUERY_MS", "50"))
+# Memory for precompressed poem, explore and pull request bodies
+RESPONSE_CACHE_MB = float(os.environ.get("POETSYNC_RESPONSE_CACHE_MB", "64"))
+# What to do when a new public poem or a PR copies another author's poem:
+# reject (409), flag (accept, and report the match) or off
+DUPLICATE_POLICY = os.environ.get("POETSYNC_DUPLICATE_POLICY", "flag")
+DUPLICATE_THRESHOLD = float(os.environ.get("POETSYNC_DUPLICATE_THRESHOLD", "0.85"))
+# Directory for online snapshots (see backups.py); unset disables them. Every
+# interval an incremental snapshot stores the WAL frames committed since the
+# last one, and every BACKUP_FULL_EVERY snapshots a new base copy starts a
+# chain; the newest BACKUP_KEEP_FULL chains are kept
+BACKUP_DIR = os.environ.get("POETSYNC_BACKUP_DIR")
+BACKUP_INTERVAL_MINUTES = float(os.environ.get("POETSYNC_BACKUP_INTERVAL_MINUTES", "15"))
+BACKUP_FULL_EVERY = int(os.environ.get("POETSYNC_BACKUP_FULL_EVERY", "96"))
+BACKUP_KEEP_FULL = int(os.environ.get("POETSYNC_BACKUP_KEEP_FULL", "7"))
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# A generous busy timeout lets concurrent writers queue on SQLite's write lock
+# instead of failing with "database is locked".
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
 
 app = FastAPI()
@@ -43,10 +94,29 @@ class PoemModel(Base):
     is_public = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
+    # Optimistic concurrency: every UPDATE checks and bumps this counter, so a
+    # merge computed against a stale copy of the poem fails instead of winning
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Derived from content whenever it is assigned, so list views never read the full text
+    excerpt = Column(Text)
+    line_count = Column(Integer)
+    # Prosody of the content (see prosody.py), also computed on assignment
+    content_hash = Column(String)
+    detected_form = Column(String)
+    prosody = deferred(Column(Text))
     
     # Relationship to pull requests
     pull_requests = relationship("PullRequestModel", back_populates="poem")
 
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = (
+        Index("ix_poems_public_created_at", "is_public", "created_at"),
+        Index("ix_poems_author_created_at", "author_id", "created_at"),
+        Index("ix_poems_detected_form_created_at", "detected_form", "created_at"),
+        # Newest edit for the explore cache key, read from the index alone
+        Index("ix_poems_updated_at", "updated_at"),
+    )
+
 class PullRequestModel(Base):
     __tablename__ = "pull_requests"
     id = Column(String, primary_key=True, index=True)
@@ -54,19 +124,286 @@ class PullRequestModel(Base):
     original_content = Column(Text)  # Store original content for comparison
     proposed_content = Column(Text)
     proposed_title = Column(String)  # Allow title changes too
+    original_title = Column(String)
     author_id = Column(String, nullable=False)
     author_name = Column(String, default="Anonymous")
-    status = Column(String, default="pending")  # pending, approved, rejected
+    status = Column(String, default="pending")  # pending, approved, rejected, withdrawn
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Set when the contributor refreshes the proposal
+    updated_at = Column(DateTime, nullable=True)
     reviewed_at = Column(DateTime, nullable=True)
     message = Column(Text)  # Message from PR author
     review_message = Column(Text)  # Message from reviewer
+    # Derived on assignment, like PoemModel.excerpt
+    proposed_excerpt = Column(Text)
+    proposed_line_count = Column(Integer)
+    original_line_count = Column(Integer)
+    # The poem's version when the PR was opened or last refreshed. Staleness is
+    # judged on the text itself (see pull_request_conflicts), since the version
+    # also moves on visibility, form and tone edits.
+    base_version = Column(Integer)
     
     # Relationship to poem
     poem = relationship("PoemModel", back_populates="pull_requests")
 
+    __table_args__ = (
+        # At most one pending PR per contributor and poem, enforced by the database
+        Index(
+            "uq_pull_requests_pending_author",
+            "poem_id",
+            "author_id",
+            unique=True,
+            sqlite_where=text("status = 'pending'"),
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+
+class PoemEngagementModel(Base):
+    """Views, likes and PRs received; separate from poems so counting never bumps a poem's version"""
+    __tablename__ = "poem_engagement"
+    poem_id = Column(String, ForeignKey("poems.id"), primary_key=True)
+    views = Column(Integer, nullable=False, default=0, server_default="0")
+    likes = Column(Integer, nullable=False, default=0, server_default="0")
+    pull_requests = Column(Integer, nullable=False, default=0, server_default="0")
+    # Log-space decayed score, see engagement.py
+    trending = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PoemLikeModel(Base):
+    """Who liked a poem: one row per user, so liking again or unliking twice changes nothing"""
+    __tablename__ = "poem_likes"
+    poem_id = Column(String, ForeignKey("poems.id"), primary_key=True)
+    user_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+EXCERPT_LINES = 3
+EXCERPT_CHARS = 200
+
+def summarize_text(content: Optional[str]):
+    """Return (excerpt, line_count): the first few non-empty lines, capped in length"""
+    if content is None:
+        return None, 0
+    lines = content.splitlines()
+    excerpt = "\n".join([line for line in lines if line.strip()][:EXCERPT_LINES])
+    if len(excerpt) > EXCERPT_CHARS:
+        excerpt = excerpt[:EXCERPT_CHARS - 1].rstrip() + "…"
+    return excerpt, len(lines)
+
+# Analyses by content hash, shared by writes and /api/analysis/prosody
+prosody_cache = ProsodyCache()
+
+def prosody_columns(content: Optional[str]) -> dict:
+    analysis = prosody_cache.analyze(content)
+    return {
+        "content_hash": analysis["content_hash"],
+        "detected_form": analysis["detected_form"],
+        "prosody": json.dumps(analysis),
+    }
+
+@event.listens_for(PoemModel.content, "set")
+def summarize_poem_content(target, value, oldvalue, initiator):
+    target.excerpt, target.line_count = summarize_text(value)
+    for name, column_value in prosody_columns(value).items():
+        setattr(target, name, column_value)
+
+@event.listens_for(PullRequestModel.proposed_content, "set")
+def summarize_proposed_content(target, value, oldvalue, initiator):
+    target.proposed_excerpt, target.proposed_line_count = summarize_text(value)
+
+@event.listens_for(PullRequestModel.original_content, "set")
+def count_original_lines(target, value, oldvalue, initiator):
+    target.original_line_count = summarize_text(value)[1]
+
+def upgrade_schema(bind):
+    """Add columns and indexes introduced after a database file was first created"""
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+            if table.name == PullRequestModel.__tablename__:
+                close_duplicate_pending(conn)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def close_duplicate_pending(conn):
+    """Keep the newest pending PR per contributor and poem, rejecting older ones
+
+    Databases from before uq_pull_requests_pending_author may hold several, and
+    the unique index cannot be created over them.
+    """
+    prs = PullRequestModel.__table__
+    seen = set()
+    stale = []
+    rows = conn.execute(
+        prs.select().with_only_columns(prs.c.id, prs.c.poem_id, prs.c.author_id)
+        .where(prs.c.status == "pending")
+        .order_by(prs.c.created_at.desc(), prs.c.id.desc())
+    )
+    for pr_id, poem_id, author_id in rows:
+        if (poem_id, author_id) in seen:
+            stale.append(pr_id)
+        seen.add((poem_id, author_id))
+    if stale:
+        conn.execute(prs.update().where(prs.c.id.in_(stale)).values(
+            status="rejected",
+            reviewed_at=datetime.utcnow(),
+            review_message="Superseded by a newer pull request from the same contributor.",
+        ))
+
+def backfill_summaries(bind):
+    """Fill excerpt/line-count and prosody columns for rows written before they existed"""
+    poems = PoemModel.__table__
+    prs = PullRequestModel.__table__
+    with bind.begin() as conn:
+        # Core updates, so backfilling does not bump poem versions
+        for poem_id, content in conn.execute(poems.select().with_only_columns(poems.c.id, poems.c.content).where(poems.c.line_count == None)):
+            excerpt, line_count = summarize_text(content)
+            conn.execute(poems.update().where(poems.c.id == poem_id).values(excerpt=excerpt, line_count=line_count))
+        for pr_id, original, proposed in conn.execute(prs.select().with_only_columns(prs.c.id, prs.c.original_content, prs.c.proposed_content).where(prs.c.proposed_line_count == None)):
+            excerpt, line_count = summarize_text(proposed)
+            conn.execute(prs.update().where(prs.c.id == pr_id).values(
+                proposed_excerpt=excerpt,
+                proposed_line_count=line_count,
+                original_line_count=summarize_text(original)[1]
+            ))
+        missing = conn.execute(poems.select().with_only_columns(poems.c.id, poems.c.content).where(poems.c.content_hash == None)).all()
+        for poem_id, content in missing:
+            conn.execute(poems.update().where(poems.c.id == poem_id).values(**prosody_columns(content)))
+
+if SHARD_MAP:
+    shard_map = ShardMap.load(SHARD_MAP)
+    shard_engines = shard_map.engines()
+    SessionLocal = sharded_sessionmaker(
+        shard_map, shard_engines, PoemModel, PullRequestModel, autoflush=False, expire_on_commit=False
+    )
+else:
+    shard_engines = {"0": engine}
+
 # Create tables
-Base.metadata.create_all(bind=engine)
+for shard_engine in shard_engines.values():
+    configure_durability(shard_engine, WRITE_DURABILITY)
+    if BACKUP_DIR:
+        # Base copies then run without blocking writers, and increments read the WAL
+        set_wal_mode(shard_engine)
+    Base.metadata.create_all(bind=shard_engine)
+    upgrade_schema(shard_engine)
+    backfill_summaries(shard_engine)
+
+# Poem and PR inserts from concurrent requests share one commit
+write_coalescer = WriteCoalescer(SessionLocal, window_ms=GROUP_COMMIT_WINDOW_MS)
+
+@app.exception_handler(WriteTimeout)
+def write_timeout_response(request: Request, e: WriteTimeout) -> JSONResponse:
+    # The row was withdrawn unwritten, so the client can safely retry
+    return JSONResponse(status_code=503, content={"detail": "The database is busy; try again"}, headers={"Retry-After": "1"})
+
+# Trending/popular order for explore, rebuilt from every shard at startup
+ranking_index = RankingIndex()
+engagement_counters = EngagementCounters(
+    PoemEngagementModel.__table__, shard_engines, ranking_index, flush_interval=ENGAGEMENT_FLUSH_SECONDS
+)
+engagement_counters.load()
+atexit.register(engagement_counters.close)
+
+# Form/tone/visibility bitsets for facet counts and filtered explore pages
+facet_index = FacetIndex()
+facet_index.load(shard_engines, PoemModel.__table__)
+
+# ---------- Near-duplicate detection ----------
+
+# MinHash/LSH signatures of every poem's content; see dedup.py
+duplicate_index = DuplicateIndex()
+
+def index_poem(poem: PoemModel):
+    duplicate_index.add(
+        poem.id, poem.content,
+        title=poem.title, author_id=poem.author_id, author_name=poem.author_name, is_public=bool(poem.is_public),
+    )
+
+def load_duplicate_index():
+    poems = PoemModel.__table__
+    statement = poems.select().with_only_columns(
+        poems.c.id, poems.c.content, poems.c.title, poems.c.author_id, poems.c.author_name, poems.c.is_public
+    )
+    for shard_engine in shard_engines.values():
+        with shard_engine.connect() as conn:
+            for poem in conn.execute(statement):
+                index_poem(poem)
+
+load_duplicate_index()
+
+def check_duplicate(content: str, author_id: str, exclude_poem_id: Optional[str] = None) -> Optional[dict]:
+    """The closest public poem by someone else above the threshold; raises 409 under the reject policy"""
+    if DUPLICATE_POLICY == "off":
+        return None
+    matches = duplicate_index.similar(
+        content,
+        threshold=DUPLICATE_THRESHOLD,
+        limit=1,
+        include=lambda poem_id, meta: meta["is_public"] and meta["author_id"] != author_id and poem_id != exclude_poem_id,
+    )
+    if not matches:
+        return None
+    match = matches[0]
+    if DUPLICATE_POLICY == "reject":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Too similar ({match['similarity']:.0%}) to \"{match['title']}\" by {match['author_name']} (poem {match['poem_id']})",
+        )
+    return match
+
+# ---------- Profiling ----------
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="A valid X-Admin-Token is required")
+
+# Request timings, slow queries and on-demand profiles; see profiling.py
+profiler = Profiler(slow_query_ms=SLOW_QUERY_MS)
+for shard_engine in shard_engines.values():
+    profiler.instrument(shard_engine)
+app.add_middleware(
+    ProfilingMiddleware,
+    profiler=profiler,
+    is_admin=lambda scope: is_admin_token(Headers(scope=scope).get("x-admin-token")),
+)
+
+# ---------- Backups ----------
+
+backup_manager = None
+if BACKUP_DIR:
+    backup_manager = BackupManager(
+        {
+            ("main" if not SHARD_MAP else f"shard-{shard_id}"): os.path.abspath(shard_engine.url.database)
+            for shard_id, shard_engine in shard_engines.items()
+        },
+        BACKUP_DIR,
+        full_every=BACKUP_FULL_EVERY,
+        keep_full=BACKUP_KEEP_FULL,
+    )
+    backup_manager.start(BACKUP_INTERVAL_MINUTES * 60)
+    atexit.register(backup_manager.close)
+
+def require_backups() -> BackupManager:
+    if backup_manager is None:
+        raise HTTPException(status_code=503, detail="Backups are not configured; set POETSYNC_BACKUP_DIR")
+    return backup_manager
+
+def record_engagement(poem: PoemModel, kind: str, n: int = 1):
+    shard_id = shard_map.shard_for_author(poem.author_id) if SHARD_MAP else "0"
+    engagement_counters.record(poem.id, shard_id, kind, n)
 
 # ---------- Pydantic Schemas ----------
 class Poem(BaseModel):
@@ -80,6 +417,16 @@ class Poem(BaseModel):
     is_public: bool = True
     created_at: datetime
     updated_at: datetime
+    version: int = 1
+    excerpt: Optional[str] = None
+    line_count: Optional[int] = None
+    detected_form: Optional[str] = None
+    # Only on sort=trending / sort=popular explore pages
+    views: Optional[int] = None
+    likes: Optional[int] = None
+    pull_requests_received: Optional[int] = None
+    popular_score: Optional[float] = None
+    trending_score: Optional[float] = None
 
     class Config:
         orm_mode = True
@@ -103,6 +450,13 @@ class PoemUpdate(BaseModel):
 class PoemRequest(BaseModel):
     title: str
     content: str
+    poem_id: Optional[str] = None  # The saved poem being illustrated; queues the request under its author
+    profile: Optional[str] = None  # preview, standard or high; see imagegen.PROFILES
+    seed: Optional[int] = None
+    # Several images in one batched run: a count, explicit seeds, or both
+    num_variants: Optional[int] = None
+    seeds: Optional[List[int]] = None
+    priority: Optional[str] = None  # interactive or batch; see PROFILE_PRIORITIES
 
 class PullRequest(BaseModel):
     id: str
@@ -110,20 +464,30 @@ class PullRequest(BaseModel):
     original_content: Optional[str] = None
     proposed_content: str
     proposed_title: Optional[str] = None
+    original_title: Optional[str] = None
     author_id: str
     author_name: str
     status: str
     created_at: datetime
+    updated_at: Optional[datetime] = None
     reviewed_at: Optional[datetime] = None
     message: Optional[str] = None
     review_message: Optional[str] = None
     # Include poem details for convenience
     poem_title: Optional[str] = None
     poem_author_name: Optional[str] = None
+    proposed_excerpt: Optional[str] = None
+    proposed_line_count: Optional[int] = None
+    original_line_count: Optional[int] = None
+    base_version: Optional[int] = None
 
     class Config:
         orm_mode = True
 
+class ProsodyRequest(BaseModel):
+    texts: List[str] = []
+    poem_ids: List[str] = []
+
 class PullRequestCreate(BaseModel):
     poem_id: str
     proposed_content: str
@@ -132,6 +496,11 @@ class PullRequestCreate(BaseModel):
     author_name: str = "Anonymous"
     message: Optional[str] = None
 
+class PullRequestRefresh(BaseModel):
+    proposed_content: str
+    proposed_title: Optional[str] = None
+    message: Optional[str] = None
+
 class PullRequestReview(BaseModel):
     review_message: Optional[str] = None
 
@@ -144,40 +513,398 @@ def get_db():
         db.close()
 
 # ---------- Load Stable Diffusion ----------
-try:
-    pipe = StableDiffusionPipeline.from_pretrained(
-        "CompVis/stable-diffusion-v1-4",
-        torch_dtype=torch.float16,
+# With POETSYNC_INFERENCE_SOCKET set, generation goes to the shared worker pool
+# (see inference_workers.py) and this API process never loads the model
+INFERENCE_SOCKET = os.environ.get("POETSYNC_INFERENCE_SOCKET")
+image_generator = InferenceClient(INFERENCE_SOCKET) if INFERENCE_SOCKET else load_image_generator()
 
-    ).to("cuda")
-except Exception as e:
-    print("❌ Failed to load Stable Diffusion pipeline:", e)
-    pipe = None
+# Bounded, per-user round-robin queue in front of the model
+inference_scheduler = InferenceScheduler(
+    concurrency=int(os.environ.get("POETSYNC_INFERENCE_CONCURRENCY", "1")),
+    max_queue=int(os.environ.get("POETSYNC_INFERENCE_MAX_QUEUE", "32")),
+    max_per_user=int(os.environ.get("POETSYNC_INFERENCE_MAX_PER_USER", "4")),
+)
+# Priorities a request may ask for, default first; only cheap previews may jump the queue
+PROFILE_PRIORITIES = {"preview": ("interactive", "batch")}
 
 # ---------- Routes ----------
 
 
-@app.post("/generate-image")
-def generate_image(data: PoemRequest):
-    if not pipe:
+@app.get("/generate-image/profiles")
+def get_generation_profiles():
+    """List the named generation profiles a request can pick from"""
+    return {"default": DEFAULT_PROFILE, "profiles": [asdict(profile) for profile in PROFILES.values()]}
+
+@app.get("/generate-image/stats")
+def get_generation_stats():
+    """Prompt-embedding cache metrics, per inference worker when using the pool"""
+    if not image_generator:
         raise HTTPException(status_code=500, detail="Model not loaded.")
     try:
-        cleaned_content = data.content.replace('\n', ' ')
-        prompt = f"{data.title}. {cleaned_content}"
-        image = pipe(prompt).images[0]
-
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        return {"image": base64_image}
+        return image_generator.stats()
+    except OSError as e:
+        raise HTTPException(status_code=503, detail=f"Inference pool unavailable: {e}")
+
+@app.get("/generate-image/health")
+def get_generation_health():
+    """Report whether image generation is available and, for the pool, each worker's state"""
+    if not image_generator:
+        raise HTTPException(status_code=503, detail="Model not loaded.")
+    if not INFERENCE_SOCKET:
+        return {"ok": True, "mode": "in-process"}
+    try:
+        health = image_generator.health()
+    except OSError as e:
+        raise HTTPException(status_code=503, detail=f"Inference pool unavailable: {e}")
+    if not health["ok"]:
+        raise HTTPException(status_code=503, detail=health)
+    return {"mode": "worker-pool", **health}
+
+@app.get("/generate-image/queue")
+def get_generation_queue():
+    """Queue length, wait-time and admission metrics for image generation"""
+    return inference_scheduler.stats()
+
+def prepare_generation(data: PoemRequest, request: Request, db: Session):
+    """Validate a generation request; returns (profile, priority, user, prompt)"""
+    if not image_generator:
+        raise HTTPException(status_code=500, detail="Model not loaded.")
+    profile = PROFILES.get(data.profile or DEFAULT_PROFILE)
+    if not profile:
+        raise HTTPException(status_code=400, detail=f"Unknown profile. Choose one of: {', '.join(PROFILES)}")
+    allowed = PROFILE_PRIORITIES.get(profile.name, ("batch",))
+    priority = data.priority or allowed[0]
+    if priority not in allowed:
+        raise HTTPException(status_code=400, detail=f"The {profile.name} profile allows priority: {', '.join(allowed)}")
+    user = generation_client(data, request, db)
+
+    cleaned_content = data.content.replace('\n', ' ')
+    prompt = f"{data.title}. {cleaned_content}"
+    return profile, priority, user, prompt
+
+def generation_client(data: PoemRequest, request: Request, db: Session) -> str:
+    """Who a generation request is queued under: the author of the poem it is for.
+
+    The author is looked up from the poem, never taken from the request body.
+    Without a saved poem the client address is used; run uvicorn with
+    --proxy-headers behind a proxy.
+    """
+    if data.poem_id:
+        poem = db.query(PoemModel.author_id).filter(PoemModel.id == data.poem_id).first()
+        if poem:
+            return f"author:{poem.author_id}"
+    return request.client.host if request.client else "anonymous"
+
+def variant_seeds(data: PoemRequest) -> Optional[List[int]]:
+    """Seeds for a multi-variant request, or None for a single image.
+
+    Without explicit seeds, a given seed is the first of consecutive ones and
+    otherwise they are random; either way they come back with the images.
+    """
+    if data.num_variants is None and data.seeds is None:
+        return None
+    count = data.num_variants if data.num_variants is not None else len(data.seeds)
+    if not 1 <= count <= MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"num_variants must be between 1 and {MAX_VARIANTS}")
+    if data.seeds is not None:
+        if len(data.seeds) != count:
+            raise HTTPException(status_code=400, detail="seeds must have num_variants entries")
+        if any(not 0 <= seed < 2 ** 63 for seed in data.seeds):
+            raise HTTPException(status_code=400, detail="seeds must be non-negative 63-bit integers")
+        return list(data.seeds)
+    if data.seed is not None:
+        return [data.seed + offset for offset in range(count)]
+    return [random.randrange(2 ** 32) for _ in range(count)]
+
+def generation_job(data: PoemRequest, profile, prompt: str, on_preview=None):
+    """The call a queued generation runs: one image, or a batch of variants"""
+    seeds = variant_seeds(data)
+    if seeds is None:
+        return lambda: image_generator.render(prompt, profile, seed=data.seed, on_preview=on_preview)
+    return lambda: image_generator.render_variants(prompt, profile, seeds, on_preview=on_preview)
+
+def queue_full_response(e: QueueFull) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"detail": e.detail}, headers={"Retry-After": str(e.retry_after)})
+
+@app.post("/generate-image")
+async def generate_image(data: PoemRequest, request: Request, db: Session = Depends(get_db)):
+    profile, priority, user, prompt = prepare_generation(data, request, db)
+    job = generation_job(data, profile, prompt)
+    try:
+        return await inference_scheduler.run(
+            user,
+            priority,
+            job,
+            is_disconnected=request.is_disconnected,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFull as e:
+        return queue_full_response(e)
+    except ClientDisconnected:
+        # Nobody is listening; 499 is the conventional "client closed request" code
+        return Response(status_code=499)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/generate-image/stream")
+async def generate_image_stream(data: PoemRequest, request: Request, db: Session = Depends(get_db)):
+    """Server-Sent Events: queued, then low-resolution previews every few steps, then result"""
+    profile, priority, user, prompt = prepare_generation(data, request, db)
+    loop = asyncio.get_running_loop()
+    previews = asyncio.Queue()
+
+    def on_preview(preview: dict):
+        # Called from the generating thread
+        loop.call_soon_threadsafe(previews.put_nowait, preview)
+
+    run = generation_job(data, profile, prompt, on_preview=on_preview)
+    try:
+        ticket = inference_scheduler.admit(user, priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFull as e:
+        return queue_full_response(e)
+
+    job = asyncio.ensure_future(inference_scheduler.execute(
+        ticket,
+        run,
+        is_disconnected=request.is_disconnected,
+    ))
+
+    async def events():
+        try:
+            yield sse_event("queued", {"profile": profile.name, "priority": priority})
+            while True:
+                next_preview = asyncio.ensure_future(previews.get())
+                done, _ = await asyncio.wait({next_preview, job}, return_when=asyncio.FIRST_COMPLETED)
+                if next_preview in done:
+                    yield sse_event("preview", next_preview.result())
+                    continue
+                next_preview.cancel()
+                break
+            try:
+                yield sse_event("result", job.result())
+            except ClientDisconnected:
+                return
+            except Exception as e:
+                yield sse_event("error", {"detail": str(e)})
+        finally:
+            # A generation already on the model runs to completion so the
+            # scheduler slot is released normally; just retrieve its outcome
+            if not job.done():
+                job.add_done_callback(lambda finished: finished.cancelled() or finished.exception())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ---------- Sparse fieldsets ----------
+
+# List routes accept ?fields=a,b,c or ?view=summary and select only those
+# columns, so large poem bodies are never read for list pages that do not show them
+POEM_FIELDS = {
+    name: getattr(PoemModel, name)
+    for name in (
+        "id", "title", "content", "excerpt", "line_count", "form", "detected_form", "tone",
+        "author_id", "author_name", "is_public", "created_at", "updated_at", "version",
+    )
+}
+POEM_SUMMARY_FIELDS = (
+    "id", "title", "excerpt", "line_count", "form", "detected_form", "tone",
+    "author_id", "author_name", "is_public", "created_at", "updated_at",
+)
+PULL_REQUEST_FIELDS = {
+    **{
+        name: getattr(PullRequestModel, name)
+        for name in (
+            "id", "poem_id", "original_content", "proposed_content", "proposed_title",
+            "proposed_excerpt", "proposed_line_count", "original_line_count",
+            "author_id", "author_name", "status", "created_at", "reviewed_at",
+            "message", "review_message",
+        )
+    },
+    "poem_title": PoemModel.title,
+    "poem_author_name": PoemModel.author_name,
+}
+PULL_REQUEST_SUMMARY_FIELDS = (
+    "id", "poem_id", "proposed_title", "proposed_excerpt", "proposed_line_count",
+    "original_line_count", "author_id", "author_name", "status", "created_at",
+    "reviewed_at", "poem_title", "poem_author_name",
+)
+
+def select_fields(available: dict, summary: tuple, fields: Optional[str], view: Optional[str]):
+    """Resolve fields=/view= to labelled columns, or None for the full representation"""
+    if fields:
+        names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        if "id" not in names:
+            names.insert(0, "id")
+    elif view is None or view == "full":
+        return None
+    elif view == "summary":
+        names = summary
+    else:
+        raise HTTPException(status_code=400, detail="Unknown view. Choose one of: full, summary")
+    return [available[name].label(name) for name in names]
+
+def sparse_response(rows: List[dict]) -> JSONResponse:
+    return JSONResponse(jsonable_encoder(rows))
+
+# ---------- Change events ----------
+
+# Published after each successful write; see events.py for the topics
+event_bus = EventBus(
+    history=int(os.environ.get("POETSYNC_EVENT_HISTORY", "1024")),
+    max_buffer=int(os.environ.get("POETSYNC_EVENT_BUFFER", "256")),
+)
+# SSE comment sent on idle streams so dead connections are noticed
+EVENT_KEEPALIVE_SECONDS = 15
+event_bus.add_listener(ranking_index.on_event)
+event_bus.add_listener(facet_index.on_event)
+
+def publish_poem_event(event_type: str, poem: PoemModel, was_public: bool = False):
+    """Publish to the poem's topic, and to explore if it is (or just stopped being) public"""
+    topics = {f"poem:{poem.id}"}
+    if poem.is_public or was_public:
+        topics.add("explore")
+    data = {name: getattr(poem, name) for name in POEM_SUMMARY_FIELDS}
+    data["version"] = poem.version
+    event_bus.publish(event_type, topics, jsonable_encoder(data))
+
+def publish_pull_request_event(event_type: str, pr: PullRequestModel, poem: PoemModel):
+    topics = {"pull-requests", f"poem:{poem.id}", f"author:{poem.author_id}", f"author:{pr.author_id}"}
+    data = {name: getattr(pr, name) for name in PULL_REQUEST_SUMMARY_FIELDS if hasattr(pr, name)}
+    data.update(poem_title=poem.title, poem_author_id=poem.author_id, poem_author_name=poem.author_name)
+    event_bus.publish(event_type, topics, jsonable_encoder(data))
+
+def parse_subscription(topics: Optional[str], last_event_id: Optional[str]):
+    try:
+        return validate_topics((topics or "").split(",")), int(last_event_id) if last_event_id else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/events")
+async def stream_events(request: Request, topics: Optional[str] = None, last_event_id: Optional[str] = None):
+    """Server-Sent Events for the given comma-separated topics"""
+    topic_set, resume_from = parse_subscription(topics, last_event_id or request.headers.get("last-event-id"))
+    subscription = event_bus.subscribe(topic_set, resume_from)
+
+    async def events():
+        try:
+            if subscription.reset:
+                yield sse_event("reset", {"last_event_id": event_bus.last_id}, event_bus.last_id)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.next(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(event.type, event.to_dict(), event.id)
+        except SlowConsumer:
+            # The client reconnects with Last-Event-ID and is replayed from history
+            yield sse_event("dropped", {"reason": "Subscriber fell too far behind"})
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/api/events/ws")
+async def websocket_events(websocket: WebSocket, topics: Optional[str] = None, last_event_id: Optional[str] = None):
+    """The same feed over a WebSocket; send {"subscribe": [...]} or {"unsubscribe": [...]} to change topics"""
+    await websocket.accept()
+    try:
+        topic_set, resume_from = parse_subscription(topics, last_event_id)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    subscription = event_bus.subscribe(topic_set, resume_from)
+
+    async def receive_commands():
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                if not isinstance(message, dict):
+                    raise ValueError("Send a JSON object with subscribe or unsubscribe")
+                if "subscribe" in message:
+                    subscription.topics = validate_topics(subscription.topics | set(message["subscribe"]))
+                if "unsubscribe" in message:
+                    subscription.topics = subscription.topics - set(message["unsubscribe"])
+            except (TypeError, ValueError) as e:
+                await websocket.send_json({"type": "error", "data": {"detail": str(e)}})
+                continue
+            await websocket.send_json({"type": "subscribed", "data": {"topics": sorted(subscription.topics)}})
+
+    commands = asyncio.create_task(receive_commands())
+    try:
+        if subscription.reset:
+            await websocket.send_json({"type": "reset", "data": {"last_event_id": event_bus.last_id}})
+        while True:
+            next_event = asyncio.create_task(subscription.next())
+            done, _ = await asyncio.wait({next_event, commands}, return_when=asyncio.FIRST_COMPLETED)
+            if commands in done:
+                next_event.cancel()
+                commands.result()  # re-raises the disconnect
+            await websocket.send_json(next_event.result().to_dict())
+    except SlowConsumer:
+        await websocket.close(code=1013, reason="Subscriber fell too far behind; reconnect with last_event_id")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        commands.cancel()
+        subscription.close()
+
+# ---------- Compressed response cache ----------
+
+# Read endpoints serve bodies compressed once per resource version; see response_cache.py
+response_cache = CompressedResponseCache(max_bytes=int(RESPONSE_CACHE_MB * 1024 * 1024))
+event_bus.add_listener(response_cache.on_event)
+
+def render_json(data) -> bytes:
+    return JSONResponse(jsonable_encoder(data)).body
+
+def cached_response(request: Request, resource: str, variant: str, version, render) -> Response:
+    body, encoding = response_cache.body(resource, variant, version, request.headers.get("accept-encoding"), render)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+def public_poems_version(db: Session) -> str:
+    """Explore's cache version: bumped by this process's explore events and by any newer edit.
+
+    A deletion on another worker is only seen once this one publishes an
+    explore event or restarts, as with the ranking and facet indexes.
+    """
+    # One row per shard when sharded; each is a single index lookup
+    rows = db.query(func.max(PoemModel.updated_at)).all()
+    latest = max((row[0] for row in rows if row[0] is not None), default=None)
+    return f"{response_cache.generation('explore')}:{latest}"
+
+@app.get("/api/events/stats")
+def get_event_stats():
+    return event_bus.stats()
+
 # ---------- POEM CRUD OPERATIONS ----------
 
 @app.post("/api/poems", response_model=dict)
 def create_poem(poem_data: PoemCreate, db: Session = Depends(get_db)):
     """Create a new poem and publish it to explore if public"""
+    duplicate = check_duplicate(poem_data.content, poem_data.author_id) if poem_data.is_public else None
     poem_id = str(uuid4())
     db_poem = PoemModel(
         id=poem_id,
@@ -191,34 +918,184 @@ def create_poem(poem_data: PoemCreate, db: Session = Depends(get_db)):
         created_at=datetime.utcnow(),
         updated_at=datetime.utcnow()
     )
-    db.add(db_poem)
-    db.commit()
-    db.refresh(db_poem)
+    write_coalescer.add(db_poem)
+    index_poem(db_poem)
+    publish_poem_event("poem.created", db_poem)
     
-    return {
+    response = {
         "message": "Poem created and published successfully",
         "id": db_poem.id,
         "is_public": db_poem.is_public
     }
+    if duplicate:
+        response["possible_duplicate"] = duplicate
+    return response
+
+EXPLORE_PAGE_SIZE = 20
+EXPLORE_MAX_PAGE_SIZE = 100
 
 @app.get("/api/poems/explore", response_model=List[Poem])
-def get_explore_poems(db: Session = Depends(get_db)):
-    """Get all public poems for the explore page"""
-    poems = db.query(PoemModel).filter(PoemModel.is_public == True).order_by(PoemModel.created_at.desc()).all()
-    return poems
+def get_explore_poems(
+    request: Request,
+    response: Response,
+    sort: str = "recent",
+    limit: int = EXPLORE_PAGE_SIZE,
+    offset: int = 0,
+    detected_form: Optional[str] = None,
+    form: Optional[str] = None,
+    tone: Optional[str] = None,
+    match: str = "all",
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get public poems for the explore page: all by recency, or a page by trending/popular.
+
+    form= and tone= take comma-separated values (any of them matches); the
+    facets are ANDed, or ORed with match=any. Filtered results are paged.
+    """
+    columns = select_fields(POEM_FIELDS, POEM_SUMMARY_FIELDS, fields, view)
+    filters = facet_filters(form, tone, match)
+    if detected_form and sort != "recent":
+        raise HTTPException(status_code=400, detail="detected_form can only be combined with sort=recent")
+    if detected_form and filters:
+        raise HTTPException(status_code=400, detail="detected_form cannot be combined with form or tone")
+    if filters:
+        filters["visibility"] = ["public"]
+    if sort in RANKED_SORTS:
+        include = facet_index.members(filters, match) if filters else None
+        return get_ranked_poems(response, sort, limit, offset, columns, db, include)
+    if sort != "recent":
+        raise HTTPException(status_code=400, detail="Unknown sort. Choose one of: recent, trending, popular")
+    if filters:
+        return get_faceted_poems(response, filters, match, limit, offset, columns, db)
+
+    def render():
+        query = db.query(*columns) if columns else db.query(PoemModel)
+        query = query.filter(PoemModel.is_public == True)
+        if detected_form:
+            # Served by ix_poems_detected_form_created_at
+            query = query.filter(PoemModel.detected_form == detected_form)
+        query = query.order_by(PoemModel.created_at.desc())
+        # With sharding this is a scatter-gather: each shard sorts, then a k-way merge
+        poems = fetch_ordered(query, PoemModel.created_at)
+        return render_json(poems if columns else [Poem.model_validate(poem, from_attributes=True) for poem in poems])
+
+    return cached_response(request, "explore", f"{fields}|{view}|{detected_form}", public_poems_version(db), render)
+
+def check_page(limit: int, offset: int):
+    if not 1 <= limit <= EXPLORE_MAX_PAGE_SIZE or offset < 0:
+        raise HTTPException(status_code=400, detail=f"limit must be 1-{EXPLORE_MAX_PAGE_SIZE} and offset at least 0")
+
+def load_poem_page(poem_ids: List[str], columns, db: Session, extra=None):
+    """Public poems by id, in the order given; extra(poem_id) adds fields to each"""
+    if not poem_ids:
+        return []
+    query = db.query(*columns) if columns else db.query(PoemModel)
+    rows = query.filter(PoemModel.id.in_(poem_ids), PoemModel.is_public == True).all()
+    if columns:
+        found = {row.id: dict(row._mapping) for row in rows}
+    else:
+        found = {poem.id: {name: getattr(poem, name) for name in POEM_FIELDS} for poem in rows}
+    # A poem deleted on another worker can linger in the in-memory indexes; skip it
+    page = [{**found[poem_id], **(extra(poem_id) if extra else {})} for poem_id in poem_ids if poem_id in found]
+    return sparse_response(page) if columns else page
+
+def get_ranked_poems(response: Response, sort: str, limit: int, offset: int, columns, db: Session, include: Optional[set] = None):
+    """One page of the ranking index, loaded by id and returned in ranked order"""
+    check_page(limit, offset)
+    poem_ids, total = ranking_index.page(sort, offset, limit, include)
+    response.headers["X-Total-Count"] = str(total)
+    return load_poem_page(poem_ids, columns, db, ranking_index.stats)
+
+def get_faceted_poems(response: Response, filters: dict, match: str, limit: int, offset: int, columns, db: Session):
+    """One page of the poems matching facet filters, newest first"""
+    check_page(limit, offset)
+    poem_ids, total = facet_index.page(filters, match, offset, limit)
+    response.headers["X-Total-Count"] = str(total)
+    return load_poem_page(poem_ids, columns, db)
+
+def facet_filters(form: Optional[str], tone: Optional[str], match: str, visibility: Optional[str] = None) -> dict:
+    """Parse comma-separated facet parameters into {facet: [values]}, leaving out empty ones"""
+    if match not in MATCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown match. Choose one of: {', '.join(MATCH_MODES)}")
+    filters = {}
+    for facet, value in (("form", form), ("tone", tone), ("visibility", visibility)):
+        values = list(dict.fromkeys(part.strip() for part in (value or "").split(",") if part.strip()))
+        if values:
+            filters[facet] = values
+    if any(value not in VISIBILITY for value in filters.get("visibility", ())):
+        raise HTTPException(status_code=400, detail=f"Unknown visibility. Choose from: {', '.join(VISIBILITY)}")
+    return filters
+
+@app.get("/api/poems/facets")
+def get_poem_facets(form: Optional[str] = None, tone: Optional[str] = None, visibility: str = "public", match: str = "all"):
+    """Matching poem count and per-value counts for form, tone and visibility"""
+    return facet_index.counts(facet_filters(form, tone, match, visibility), match)
 
 @app.get("/api/poems/user/{user_id}", response_model=List[Poem])
-def get_user_poems(user_id: str, db: Session = Depends(get_db)):
+def get_user_poems(user_id: str, fields: Optional[str] = None, view: Optional[str] = None, db: Session = Depends(get_db)):
     """Get all poems for a specific user (their library)"""
-    poems = db.query(PoemModel).filter(PoemModel.author_id == user_id).order_by(PoemModel.created_at.desc()).all()
-    return poems
+    columns = select_fields(POEM_FIELDS, POEM_SUMMARY_FIELDS, fields, view)
+    query = db.query(*columns) if columns else db.query(PoemModel)
+    query = query.filter(PoemModel.author_id == user_id).order_by(PoemModel.created_at.desc())
+    poems = fetch_ordered(query, PoemModel.created_at)
+    return sparse_response(poems) if columns else poems
 
 @app.get("/api/poems/{poem_id}", response_model=Poem)
-def get_poem(poem_id: str, db: Session = Depends(get_db)):
+def get_poem(poem_id: str, request: Request, db: Session = Depends(get_db)):
+    poem = db.query(PoemModel).filter(PoemModel.id == poem_id).first()
+    if not poem:
+        raise HTTPException(status_code=404, detail="Poem not found")
+    record_engagement(poem, "views")
+    return cached_response(
+        request, f"poem:{poem.id}", "", poem.version,
+        lambda: render_json(Poem.model_validate(poem, from_attributes=True)),
+    )
+
+@app.post("/api/poems/{poem_id}/like")
+def like_poem(poem_id: str, user_id: str, db: Session = Depends(get_db)):
+    """Like a poem as user_id; liking it again is a no-op"""
+    poem = db.query(PoemModel).filter(PoemModel.id == poem_id).first()
+    if not poem:
+        raise HTTPException(status_code=404, detail="Poem not found")
+    db.add(PoemLikeModel(poem_id=poem_id, user_id=user_id))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return {"message": "Poem already liked", "liked": True}
+    record_engagement(poem, "likes")
+    return {"message": "Poem liked", "liked": True}
+
+@app.delete("/api/poems/{poem_id}/like")
+def unlike_poem(poem_id: str, user_id: str, db: Session = Depends(get_db)):
+    """Remove user_id's like; only a like that exists lowers the count"""
+    poem = db.query(PoemModel).filter(PoemModel.id == poem_id).first()
+    if not poem:
+        raise HTTPException(status_code=404, detail="Poem not found")
+    removed = db.query(PoemLikeModel).filter(
+        PoemLikeModel.poem_id == poem_id, PoemLikeModel.user_id == user_id
+    ).delete()
+    db.commit()
+    if removed:
+        record_engagement(poem, "likes", -1)
+    return {"message": "Like removed" if removed else "Poem was not liked", "liked": False}
+
+@app.get("/api/poems/{poem_id}/duplicates")
+def get_poem_duplicates(poem_id: str, threshold: float = 0.5, limit: int = 20, db: Session = Depends(get_db)):
+    """Public poems whose content is at least threshold similar to this one"""
+    if not 0.3 <= threshold <= 1 or not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="threshold must be 0.3-1 and limit 1-100")
     poem = db.query(PoemModel).filter(PoemModel.id == poem_id).first()
     if not poem:
         raise HTTPException(status_code=404, detail="Poem not found")
-    return poem
+    matches = duplicate_index.duplicates_of(poem_id, threshold, limit, include=lambda _, meta: meta["is_public"])
+    if matches is None:
+        # Written by another worker since startup
+        index_poem(poem)
+        matches = duplicate_index.duplicates_of(poem_id, threshold, limit, include=lambda _, meta: meta["is_public"]) or []
+    return {"poem_id": poem_id, "threshold": threshold, "duplicates": matches}
 
 @app.put("/api/poems/{poem_id}")
 def update_poem(poem_id: str, poem_data: PoemUpdate, current_user_id: str, db: Session = Depends(get_db)):
@@ -230,6 +1107,14 @@ def update_poem(poem_id: str, poem_data: PoemUpdate, current_user_id: str, db: S
     # Check if current user is the author
     if poem.author_id != current_user_id:
         raise HTTPException(status_code=403, detail="You can only edit your own poems")
+    was_public = poem.is_public
+    
+    # New public text gets the same duplicate check as a new poem, before anything changes
+    content = poem_data.content if poem_data.content is not None else poem.content
+    is_public = poem_data.is_public if poem_data.is_public is not None else poem.is_public
+    duplicate = None
+    if is_public and (content != poem.content or not was_public):
+        duplicate = check_duplicate(content, poem.author_id, exclude_poem_id=poem.id)
     
     # Update only provided fields
     if poem_data.title is not None:
@@ -244,8 +1129,21 @@ def update_poem(poem_id: str, poem_data: PoemUpdate, current_user_id: str, db: S
         poem.is_public = poem_data.is_public
     
     poem.updated_at = datetime.utcnow()
-    db.commit()
-    return {"message": "Poem updated successfully"}
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Poem was changed by another update. Reload it and try again.")
+    if poem_data.content is not None:
+        index_poem(poem)
+    else:
+        # Same text, same signature: only what matches report changes
+        duplicate_index.update_meta(poem.id, title=poem.title, is_public=bool(poem.is_public))
+    publish_poem_event("poem.updated", poem, was_public)
+    response = {"message": "Poem updated successfully"}
+    if duplicate:
+        response["possible_duplicate"] = duplicate
+    return response
 
 @app.delete("/api/poems/{poem_id}")
 def delete_poem(poem_id: str, current_user_id: str, db: Session = Depends(get_db)):
@@ -260,8 +1158,13 @@ def delete_poem(poem_id: str, current_user_id: str, db: Session = Depends(get_db
     
     # Delete related pull requests first
     db.query(PullRequestModel).filter(PullRequestModel.poem_id == poem_id).delete()
+    db.query(PoemEngagementModel).filter(PoemEngagementModel.poem_id == poem_id).delete()
+    db.query(PoemLikeModel).filter(PoemLikeModel.poem_id == poem_id).delete()
     db.delete(poem)
     db.commit()
+    engagement_counters.discard(poem_id)
+    duplicate_index.remove(poem_id)
+    publish_poem_event("poem.deleted", poem)
     return {"message": "Poem deleted successfully"}
 
 # ---------- PULL REQUEST OPERATIONS ----------
@@ -282,21 +1185,20 @@ def create_pull_request(pr_data: PullRequestCreate, db: Session = Depends(get_db
     if poem.author_id == pr_data.author_id:
         raise HTTPException(status_code=400, detail="You cannot create a pull request for your own poem. Edit it directly instead.")
     
-    # Check if there's already a pending PR from this user for this poem
-    existing_pr = db.query(PullRequestModel).filter(
-        PullRequestModel.poem_id == pr_data.poem_id,
-        PullRequestModel.author_id == pr_data.author_id,
-        PullRequestModel.status == "pending"
-    ).first()
+    if same_text(pr_data.proposed_content, poem.content) and pr_data.proposed_title in (None, "", poem.title):
+        raise HTTPException(status_code=400, detail="Pull request does not change the poem")
+    # Content pasted from another author's poem
+    duplicate = check_duplicate(pr_data.proposed_content, pr_data.author_id, exclude_poem_id=poem.id)
     
-    if existing_pr:
-        raise HTTPException(status_code=400, detail="You already have a pending pull request for this poem")
-
-    # Create the pull request
+    # Create the pull request. The partial unique index on pending
+    # (poem_id, author_id) rejects duplicates atomically, even when two
+    # submissions race past each other.
     new_pr = PullRequestModel(
         id=str(uuid4()),
         poem_id=pr_data.poem_id,
         original_content=poem.content,  # Store original for comparison
+        original_title=poem.title,
+        base_version=poem.version,
         proposed_content=pr_data.proposed_content,
         proposed_title=pr_data.proposed_title or poem.title,
         author_id=pr_data.author_id,
@@ -305,26 +1207,38 @@ def create_pull_request(pr_data: PullRequestCreate, db: Session = Depends(get_db
         message=pr_data.message,
         created_at=datetime.utcnow()
     )
-    db.add(new_pr)
-    db.commit()
-    db.refresh(new_pr)
+    # Hand the pooled connection back first: the writer needs one to commit
+    db.close()
+    try:
+        write_coalescer.add(new_pr)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="You already have a pending pull request for this poem")
+    publish_pull_request_event("pull_request.created", new_pr, poem)
+    record_engagement(poem, "pull_requests")
     
-    return {
+    response = {
         "message": "Pull request submitted successfully",
         "id": new_pr.id,
         "poem_title": poem.title,
         "poem_author": poem.author_name
     }
+    if duplicate:
+        response["possible_duplicate"] = duplicate
+    return response
 
 @app.get("/api/pull-requests", response_model=List[PullRequest])
 def get_pull_requests(
     status: Optional[str] = None, 
     poem_author_id: Optional[str] = None,
     pr_author_id: Optional[str] = None,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """Get pull requests with optional filtering"""
-    query = db.query(PullRequestModel).join(PoemModel)
+    columns = select_fields(PULL_REQUEST_FIELDS, PULL_REQUEST_SUMMARY_FIELDS, fields, view)
+    query = db.query(*columns) if columns else db.query(PullRequestModel)
+    query = query.select_from(PullRequestModel).join(PoemModel, PullRequestModel.poem_id == PoemModel.id)
     
     if status:
         query = query.filter(PullRequestModel.status == status)
@@ -337,7 +1251,10 @@ def get_pull_requests(
         # PRs created by this user
         query = query.filter(PullRequestModel.author_id == pr_author_id)
     
-    prs = query.order_by(PullRequestModel.created_at.desc()).all()
+    query = query.order_by(PullRequestModel.created_at.desc())
+    prs = fetch_ordered(query, PullRequestModel.created_at)
+    if columns:
+        return sparse_response(prs)
     
     # Add poem details to each PR
     result = []
@@ -348,6 +1265,9 @@ def get_pull_requests(
             "original_content": pr.original_content,
             "proposed_content": pr.proposed_content,
             "proposed_title": pr.proposed_title,
+            "proposed_excerpt": pr.proposed_excerpt,
+            "proposed_line_count": pr.proposed_line_count,
+            "original_line_count": pr.original_line_count,
             "author_id": pr.author_id,
             "author_name": pr.author_name,
             "status": pr.status,
@@ -390,29 +1310,66 @@ def get_poem_pull_requests(poem_id: str, db: Session = Depends(get_db)):
     return result
 
 @app.get("/api/pull-requests/{pr_id}", response_model=PullRequest)
-def get_pull_request(pr_id: str, db: Session = Depends(get_db)):
+def get_pull_request(pr_id: str, request: Request, db: Session = Depends(get_db)):
     """Get a specific pull request with full details"""
     pr = db.query(PullRequestModel).filter(PullRequestModel.id == pr_id).first()
     if not pr:
         raise HTTPException(status_code=404, detail="Pull request not found")
     
+    # Reviews change status and reviewed_at, refreshes updated_at; the poem's version covers its title
+    version = f"{pr.status}:{pr.reviewed_at}:{pr.updated_at}:{pr.poem.version if pr.poem else 0}"
+    return cached_response(request, f"pull-request:{pr.id}", "", version, lambda: render_json(pull_request_detail(pr)))
+
+def pull_request_detail(pr: PullRequestModel) -> dict:
     return {
         "id": pr.id,
         "poem_id": pr.poem_id,
         "original_content": pr.original_content,
         "proposed_content": pr.proposed_content,
         "proposed_title": pr.proposed_title,
+        "original_title": pr.original_title,
         "author_id": pr.author_id,
         "author_name": pr.author_name,
         "status": pr.status,
         "created_at": pr.created_at,
+        "updated_at": pr.updated_at,
         "reviewed_at": pr.reviewed_at,
         "message": pr.message,
         "review_message": pr.review_message,
+        "base_version": pr.base_version,
         "poem_title": pr.poem.title if pr.poem else None,
         "poem_author_name": pr.poem.author_name if pr.poem else None
     }
 
+def transition_pull_request(db: Session, pr_id: str, new_status: str, review_message: Optional[str]) -> bool:
+    """Move a pending PR to new_status with a single conditional UPDATE.
+
+    Returns False when the PR was no longer pending, which happens when another
+    reviewer got there first.
+    """
+    updated = db.query(PullRequestModel).filter(
+        PullRequestModel.id == pr_id,
+        PullRequestModel.status == "pending"
+    ).update({
+        PullRequestModel.status: new_status,
+        PullRequestModel.reviewed_at: datetime.utcnow(),
+        PullRequestModel.review_message: review_message
+    }, synchronize_session="fetch")
+    return updated == 1
+
+def changes_title(pr: PullRequestModel) -> bool:
+    # PRs opened before original_title existed compare against the poem, as they always did
+    return pr.original_title is None or pr.proposed_title not in (None, pr.original_title)
+
+def pull_request_conflicts(pr: PullRequestModel, poem: PoemModel) -> bool:
+    """Whether the poem's content, or a title the PR changes, moved on since the PR was opened
+
+    Edits to visibility, form or tone leave the PR approvable.
+    """
+    if poem.content != pr.original_content:
+        return True
+    return pr.original_title is not None and changes_title(pr) and poem.title != pr.original_title
+
 @app.post("/api/pull-requests/{pr_id}/approve")
 def approve_pull_request(pr_id: str, reviewer_id: str, review_data: PullRequestReview, db: Session = Depends(get_db)):
     """Approve a pull request and merge changes - only by poem author"""
@@ -432,18 +1389,33 @@ def approve_pull_request(pr_id: str, reviewer_id: str, review_data: PullRequestR
     if poem.author_id != reviewer_id:
         raise HTTPException(status_code=403, detail="Only the poem author can approve pull requests")
 
+    if pull_request_conflicts(pr, poem):
+        raise HTTPException(
+            status_code=409,
+            detail="The poem was edited after this pull request was opened. Ask the contributor to refresh or withdraw it, or reject it.",
+        )
+
+    # Claim the PR with a conditional transition; a concurrent reviewer that
+    # already moved it out of "pending" makes this a no-op
+    if not transition_pull_request(db, pr_id, "approved", review_data.review_message):
+        db.rollback()
+        current_status = db.query(PullRequestModel.status).filter(PullRequestModel.id == pr_id).scalar()
+        raise HTTPException(status_code=400, detail=f"Pull request is already {current_status}")
+
     # Update poem with proposed changes
     poem.content = pr.proposed_content
-    if pr.proposed_title and pr.proposed_title != poem.title:
+    if pr.proposed_title and pr.proposed_title != poem.title and changes_title(pr):
         poem.title = pr.proposed_title
     poem.updated_at = datetime.utcnow()
     
-    # Update pull request status
-    pr.status = "approved"
-    pr.reviewed_at = datetime.utcnow()
-    pr.review_message = review_data.review_message
-    
-    db.commit()
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Poem was changed by another update. Reload it and review the pull request again.")
+    index_poem(poem)
+    publish_pull_request_event("pull_request.approved", pr, poem)
+    publish_poem_event("poem.updated", poem)
     
     return {
         "message": "Pull request approved and changes merged successfully",
@@ -470,18 +1442,93 @@ def reject_pull_request(pr_id: str, reviewer_id: str, review_data: PullRequestRe
     if poem.author_id != reviewer_id:
         raise HTTPException(status_code=403, detail="Only the poem author can reject pull requests")
 
-    # Update pull request status
-    pr.status = "rejected"
-    pr.reviewed_at = datetime.utcnow()
-    pr.review_message = review_data.review_message
+    # Update pull request status only if it is still pending
+    if not transition_pull_request(db, pr_id, "rejected", review_data.review_message):
+        db.rollback()
+        current_status = db.query(PullRequestModel.status).filter(PullRequestModel.id == pr_id).scalar()
+        raise HTTPException(status_code=400, detail=f"Pull request is already {current_status}")
     
     db.commit()
+    publish_pull_request_event("pull_request.rejected", pr, poem)
     
     return {
         "message": "Pull request rejected",
         "review_message": pr.review_message
     }
 
+@app.put("/api/pull-requests/{pr_id}")
+def refresh_pull_request(pr_id: str, author_id: str, refresh: PullRequestRefresh, db: Session = Depends(get_db)):
+    """Replace a pending PR's proposal and rebase it on the poem as it is now - only by PR author"""
+    pr = db.query(PullRequestModel).filter(PullRequestModel.id == pr_id).first()
+    if not pr:
+        raise HTTPException(status_code=404, detail="Pull request not found")
+    
+    if pr.author_id != author_id:
+        raise HTTPException(status_code=403, detail="Only the pull request author can refresh it")
+    
+    if pr.status != "pending":
+        raise HTTPException(status_code=400, detail=f"Pull request is already {pr.status}")
+
+    poem = db.query(PoemModel).filter(PoemModel.id == pr.poem_id).first()
+    if not poem:
+        raise HTTPException(status_code=404, detail="Associated poem not found")
+    
+    if same_text(refresh.proposed_content, poem.content) and refresh.proposed_title in (None, "", poem.title):
+        raise HTTPException(status_code=400, detail="Pull request does not change the poem")
+    duplicate = check_duplicate(refresh.proposed_content, author_id, exclude_poem_id=poem.id)
+
+    # Conditional on still being pending, so a review that lands first wins
+    proposed_excerpt, proposed_line_count = summarize_text(refresh.proposed_content)
+    updated = db.query(PullRequestModel).filter(
+        PullRequestModel.id == pr_id,
+        PullRequestModel.status == "pending"
+    ).update({
+        PullRequestModel.original_content: poem.content,
+        PullRequestModel.original_line_count: summarize_text(poem.content)[1],
+        PullRequestModel.original_title: poem.title,
+        PullRequestModel.base_version: poem.version,
+        PullRequestModel.proposed_content: refresh.proposed_content,
+        PullRequestModel.proposed_excerpt: proposed_excerpt,
+        PullRequestModel.proposed_line_count: proposed_line_count,
+        PullRequestModel.proposed_title: refresh.proposed_title or poem.title,
+        PullRequestModel.message: pr.message if refresh.message is None else refresh.message,
+        PullRequestModel.updated_at: datetime.utcnow(),
+    }, synchronize_session="fetch")
+    if updated != 1:
+        db.rollback()
+        current_status = db.query(PullRequestModel.status).filter(PullRequestModel.id == pr_id).scalar()
+        raise HTTPException(status_code=400, detail=f"Pull request is already {current_status}")
+    db.commit()
+    publish_pull_request_event("pull_request.updated", pr, poem)
+    
+    response = {"message": "Pull request refreshed", "id": pr.id, "base_version": pr.base_version}
+    if duplicate:
+        response["possible_duplicate"] = duplicate
+    return response
+
+@app.post("/api/pull-requests/{pr_id}/withdraw")
+def withdraw_pull_request(pr_id: str, author_id: str, db: Session = Depends(get_db)):
+    """Withdraw a pending pull request - only by PR author"""
+    pr = db.query(PullRequestModel).filter(PullRequestModel.id == pr_id).first()
+    if not pr:
+        raise HTTPException(status_code=404, detail="Pull request not found")
+    
+    if pr.author_id != author_id:
+        raise HTTPException(status_code=403, detail="Only the pull request author can withdraw it")
+
+    # Leaving "pending" also frees the contributor to open a new one
+    if not transition_pull_request(db, pr_id, "withdrawn", None):
+        db.rollback()
+        current_status = db.query(PullRequestModel.status).filter(PullRequestModel.id == pr_id).scalar()
+        raise HTTPException(status_code=400, detail=f"Pull request is already {current_status}")
+    
+    db.commit()
+    poem = db.query(PoemModel).filter(PoemModel.id == pr.poem_id).first()
+    if poem:
+        publish_pull_request_event("pull_request.withdrawn", pr, poem)
+    
+    return {"message": "Pull request withdrawn"}
+
 # ---------- STATISTICS ENDPOINTS ----------
 
 @app.get("/api/stats/poems/{user_id}")
@@ -508,6 +1555,118 @@ def get_user_poem_stats(user_id: str, db: Session = Depends(get_db)):
         "pull_requests_created": prs_created
     }
 
+@app.get("/api/stats/writes")
+def get_write_stats():
+    """Group-commit batch sizes and commit latency"""
+    return {"durability": WRITE_DURABILITY, **write_coalescer.stats()}
+
+@app.get("/api/stats/response-cache")
+def get_response_cache_stats():
+    """Hit rate and compression work of the compressed response cache"""
+    return response_cache.stats()
+
+@app.get("/api/stats/duplicates")
+def get_duplicate_index_stats():
+    """Size of the near-duplicate index and its lookup latency"""
+    return {"policy": DUPLICATE_POLICY, "threshold": DUPLICATE_THRESHOLD, **duplicate_index.stats()}
+
+@app.get("/api/stats/engagement")
+def get_engagement_stats():
+    """Buffered engagement counters and ranking index size"""
+    return engagement_counters.stats()
+
+@app.get("/api/stats/facets")
+def get_facet_stats():
+    """Facet bitmap index size and query latency"""
+    return facet_index.stats()
+
+@app.get("/api/stats/prosody")
+def get_prosody_cache_stats():
+    """Size and hit rate of the prosody analysis cache"""
+    return prosody_cache.stats()
+
+# ---------- Analysis ----------
+
+PROSODY_BATCH_LIMIT = 50
+PROSODY_MAX_CHARS = 20000
+
+@app.post("/api/analysis/prosody")
+def analyze_prosody(request_data: ProsodyRequest, db: Session = Depends(get_db)):
+    """Syllables, stress, rhyme scheme, meter and likely form for texts and/or public poems"""
+    if not request_data.texts and not request_data.poem_ids:
+        raise HTTPException(status_code=400, detail="Send texts or poem_ids")
+    if len(request_data.texts) + len(request_data.poem_ids) > PROSODY_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PROSODY_BATCH_LIMIT} texts and poems per request")
+    if any(len(text) > PROSODY_MAX_CHARS for text in request_data.texts):
+        raise HTTPException(status_code=400, detail=f"Texts are limited to {PROSODY_MAX_CHARS} characters")
+
+    results = [prosody_cache.analyze(text) for text in request_data.texts]
+    stored = {}
+    if request_data.poem_ids:
+        rows = db.query(PoemModel.id, PoemModel.content, PoemModel.content_hash, PoemModel.prosody).filter(
+            PoemModel.id.in_(request_data.poem_ids), PoemModel.is_public == True
+        ).all()
+        stored = {row.id: row for row in rows}
+    for poem_id in request_data.poem_ids:
+        row = stored.get(poem_id)
+        if row is None:
+            results.append({"poem_id": poem_id, "error": "Poem not found"})
+            continue
+        # Computed when the content was written; recomputed only if the row predates it
+        if row.prosody and row.content_hash == content_hash(row.content):
+            analysis = json.loads(row.prosody)
+        else:
+            analysis = prosody_cache.analyze(row.content)
+        results.append({"poem_id": poem_id, **analysis})
+    return {"results": results}
+
+# ---------- Admin ----------
+
+@app.get("/api/admin/slow-requests", dependencies=[Depends(require_admin)])
+def get_slow_requests(limit: int = 20, route: Optional[str] = None):
+    """The slowest of the most recent requests, optionally for one route template"""
+    return profiler.slowest_requests(limit, route)
+
+@app.get("/api/admin/slow-queries", dependencies=[Depends(require_admin)])
+def get_slow_queries(limit: int = 50):
+    """Most recent statements over POETSYNC_SLOW_QUERY_MS, newest first"""
+    return {"threshold_ms": profiler.slow_query_ms, "queries": profiler.recent_slow_queries(limit)}
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """A captured request profile as folded stacks, ready for a flame graph"""
+    profile = profiler.profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found or no longer kept")
+    metadata, folded = profile
+    return Response(
+        folded,
+        media_type="text/plain",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"',
+            "X-Profile-Route": f"{metadata['method']} {metadata['route']}",
+            "X-Profile-Duration-Ms": str(metadata["duration_ms"]),
+            "X-Profile-Samples": str(metadata["samples"]),
+        },
+    )
+
+@app.get("/api/admin/backups", dependencies=[Depends(require_admin)])
+def get_backups():
+    """Snapshots per database, their durations, and request latency while they ran"""
+    manager = require_backups()
+    return {**manager.stats(), "latency": latency_impact(profiler.request_timings(), manager.windows)}
+
+@app.post("/api/admin/backups", dependencies=[Depends(require_admin)])
+def create_backup(kind: str = "auto"):
+    """Snapshot every database now: kind is auto, full or incremental (WAL frames since the last snapshot)"""
+    manager = require_backups()
+    try:
+        return {"snapshots": manager.snapshot_all(kind)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SnapshotError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Legacy endpoints for backward compatibility
 @app.post("/poems")
 def create_poem_legacy(poem: Poem, db: Session = Depends(get_db)):
@@ -518,6 +1677,8 @@ def create_poem_legacy(poem: Poem, db: Session = Depends(get_db)):
         id=poem.id, 
         title=poem.title,
         content=poem.content,
+        form=poem.form,
+        tone=poem.tone,
         author_id=poem.author_id,
         author_name=poem.author_name,
         is_public=poem.is_public
@@ -525,6 +1686,8 @@ def create_poem_legacy(poem: Poem, db: Session = Depends(get_db)):
     db.add(db_poem)
     db.commit()
     db.refresh(db_poem)
+    index_poem(db_poem)
+    publish_poem_event("poem.created", db_poem)
     return {"message": "Poem created successfully"}
 
 @app.get("/poems", response_model=List[Poem])
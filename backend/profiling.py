@@ -0,0 +1,255 @@
+# backend/profiling.py
+"""Opt-in request profiling, a slow-query log and the slowest recent requests.
+
+Everything here is read through admin endpoints and, apart from the cheap
+per-request timings, only runs when asked:
+
+- Request profiles. An admin request carrying `X-Profile: 1` (or `?_profile=1`)
+  is sampled while it runs. The response gets an `X-Profile-Id` header and
+  the profile is downloaded afterwards in folded-stack format (one
+  `frame;frame;frame count` line per stack, the input flamegraph tools take).
+  Sync endpoints run on threadpool threads, so a cProfile enabled around the
+  ASGI call would only see the event loop. Instead a sampler thread reads
+  every thread's stack and keeps the ones that pass through the routed
+  endpoint's frame. Concurrent requests to the same endpoint are sampled
+  together, so profile a route while it is otherwise quiet.
+- Slow-query log. Cursor events time every statement on every engine;
+  statements over the threshold are kept with their SQL, the shape (types,
+  never values) of their parameters and the route that ran them.
+- Slowest requests. Timings for the last N requests (excluding event
+  streams) are kept in a ring buffer, and the admin endpoint sorts them.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+from sqlalchemy import event
+
+# A statement queued by the write coalescer or flushed in the background
+# runs outside any request
+BACKGROUND = "(background)"
+
+
+class RequestRecord:
+    __slots__ = ("scope", "started", "duration_ms", "status", "queries", "query_ms", "profile_id", "streaming")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.started = time.time()
+        self.duration_ms = 0.0
+        self.status = None
+        self.queries = 0
+        self.query_ms = 0.0
+        self.profile_id = None
+        self.streaming = False
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("path", "")
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.scope.get("method"),
+            "route": self.route,
+            "path": self.scope.get("path"),
+            "status": self.status,
+            "duration_ms": round(self.duration_ms, 2),
+            "db_queries": self.queries,
+            "db_ms": round(self.query_ms, 2),
+            "started_at": self.started,
+            "profile_id": self.profile_id,
+        }
+
+
+current_request: ContextVar[Optional[RequestRecord]] = ContextVar("current_request", default=None)
+
+
+def parameter_shape(parameters, executemany: bool = False):
+    """Parameter types without their values, e.g. ["str", "int"] or "12 x ['str']" """
+    if executemany and parameters:
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class StackSampler(threading.Thread):
+    """Count stacks of whichever threads are inside the request's endpoint"""
+
+    def __init__(self, scope: dict, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.scope = scope
+        self.interval = interval
+        self.samples = Counter()
+        self.ticks = 0
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.ticks += 1
+            endpoint = self.scope.get("endpoint")
+            code = getattr(endpoint, "__code__", None)
+            if code is None:
+                continue  # Not routed yet
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    if frame.f_code is code:
+                        self.samples[";".join(reversed(stack))] += 1
+                        break
+                    frame = frame.f_back
+
+    def stop(self) -> Counter:
+        self.stopping.set()
+        self.join()
+        return self.samples
+
+
+class Profiler:
+    def __init__(
+        self,
+        slow_query_ms: float = 50.0,
+        slow_query_log: int = 200,
+        request_log: int = 1000,
+        profiles: int = 20,
+        sample_interval_ms: float = 1.0,
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.sample_interval = sample_interval_ms / 1000
+        self.lock = threading.Lock()
+        self.slow_queries = deque(maxlen=slow_query_log)
+        self.requests = deque(maxlen=request_log)
+        # profile_id -> (metadata, folded stacks); oldest dropped first
+        self.profiles: Dict[str, tuple] = {}
+        self.max_profiles = profiles
+
+    # ---------- Slow-query log ----------
+
+    def instrument(self, engine):
+        """Time every statement run on engine"""
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._profiling_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._profiling_started) * 1000
+        record = current_request.get()
+        if record is not None:
+            record.queries += 1
+            record.query_ms += elapsed_ms
+        if elapsed_ms < self.slow_query_ms:
+            return
+        entry = {
+            "sql": statement,
+            "parameters": parameter_shape(parameters, executemany),
+            "duration_ms": round(elapsed_ms, 2),
+            "route": f"{record.scope.get('method')} {record.route}" if record else BACKGROUND,
+            "database": str(conn.engine.url.database),
+            "at": time.time(),
+        }
+        with self.lock:
+            self.slow_queries.append(entry)
+
+    # ---------- Requests ----------
+
+    def finish(self, record: RequestRecord, samples: Optional[Counter] = None):
+        if samples is not None:
+            metadata = {**record.to_dict(), "samples": sum(samples.values())}
+            folded = "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+            with self.lock:
+                self.profiles[record.profile_id] = (metadata, folded)
+                while len(self.profiles) > self.max_profiles:
+                    self.profiles.pop(next(iter(self.profiles)))
+        if not record.streaming:
+            with self.lock:
+                self.requests.append(record)
+
+    def slowest_requests(self, limit: int = 20, route: Optional[str] = None) -> List[dict]:
+        with self.lock:
+            records = [record for record in self.requests if route is None or record.route == route]
+        records.sort(key=lambda record: record.duration_ms, reverse=True)
+        return [record.to_dict() for record in records[:limit]]
+
+    def request_timings(self) -> List[tuple]:
+        """(started_at, duration_ms) of the requests in the ring buffer"""
+        with self.lock:
+            return [(record.started, record.duration_ms) for record in self.requests]
+
+    def recent_slow_queries(self, limit: int = 50) -> List[dict]:
+        with self.lock:
+            return list(self.slow_queries)[-limit:][::-1]
+
+    def profile(self, profile_id: str) -> Optional[tuple]:
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+
+def profiling_requested(scope: dict) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile" and value not in (b"", b"0", b"false"):
+            return True
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("_profile", ["0"])[0] not in ("", "0", "false")
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: time every request and sample the ones that ask for it.
+
+    is_admin(scope) decides whether a profiling request is honoured; others
+    get a 403 instead of silently running unprofiled.
+    """
+
+    def __init__(self, app, profiler: Profiler, is_admin):
+        self.app = app
+        self.profiler = profiler
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        record = RequestRecord(scope)
+        sampler = None
+        if profiling_requested(scope):
+            if not self.is_admin(scope):
+                await send({"type": "http.response.start", "status": 403, "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body", "body": b'{"detail":"Profiling requires a valid X-Admin-Token"}'})
+                return
+            record.profile_id = uuid4().hex
+            sampler = StackSampler(scope, self.profiler.sample_interval)
+            sampler.start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record.status = message["status"]
+                headers = list(message.get("headers", []))
+                for name, value in headers:
+                    if name.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        record.streaming = True
+                if record.profile_id:
+                    headers.append((b"x-profile-id", record.profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_request.set(record)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record.duration_ms = (time.perf_counter() - started) * 1000
+            current_request.reset(token)
+            self.profiler.finish(record, sampler.stop() if sampler else None)
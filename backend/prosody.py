@@ -0,0 +1,334 @@
+# backend/prosody.py
+"""Syllables, stress, rhyme scheme and likely form of a poem.
+
+Pronunciations come from CMUdict through nltk. The corpus is read once per
+process into a compact table, word -> (stress digits, rhyme-key id), with
+the rhyme keys (the phonemes from the last stressed vowel on, e.g. "AY T"
+for night/light) interned in one list. If the corpus is not installed
+(`python -m nltk.downloader cmudict`), or for words it lacks, a spelling
+heuristic is used: vowel groups for syllables, stress on the first syllable
+(the second after a common unstressed prefix) and the letters from the last
+vowel group as the rhyme key. Every analysis reports which source it used
+and how many words the dictionary covered.
+
+Meter is scored per line against iambic, trochaic, anapestic and dactylic
+feet, with function words unstressed and other one-syllable words allowed
+either stress. Forms are scored from
+line counts, syllable counts, rhyme scheme, refrains and repeated endings;
+below FORM_THRESHOLD a poem is free verse.
+
+Analyses are pure functions of the text, so they are cached by the content's
+SHA-256.
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+FORMS = ("sonnet", "haiku", "tanka", "limerick", "villanelle", "ghazal", "free-verse")
+# Minimum score for a fixed form; otherwise free verse
+FORM_THRESHOLD = 0.6
+FEET = {"iambic": "01", "trochaic": "10", "anapestic": "001", "dactylic": "100"}
+LINE_LENGTHS = {1: "monometer", 2: "dimeter", 3: "trimeter", 4: "tetrameter", 5: "pentameter", 6: "hexameter", 7: "heptameter"}
+# Below this agreement a poem's meter is reported as irregular
+METER_THRESHOLD = 0.75
+# A triple foot must beat a duple one by this much; wildcard monosyllables
+# otherwise let long lines fit anything
+TRIPLE_FOOT_MARGIN = 0.05
+# Unstressed in running verse whatever the dictionary says; other
+# monosyllables may take either stress
+FUNCTION_WORDS = frozenset("""
+    a an the and but or nor for so yet of to in on at by from with as into upon
+    is am are was were be been has had have do does did shall will would should can could may might
+    i me my thy thee he him his she her it its we us our you your they them their
+    that this who whom which what than if when while where
+""".split())
+# Unknown words starting with these are stressed on the second syllable
+UNSTRESSED_PREFIXES = ("a", "be", "com", "con", "de", "dis", "ex", "for", "in", "pre", "re", "un")
+# Spellings of the same final vowel sound, for the heuristic rhyme key
+VOWEL_SOUNDS = {"ew": "oo", "ue": "oo", "oe": "oo", "u": "oo", "ay": "ey", "ei": "ey", "ea": "ee", "ie": "ee", "igh": "y"}
+WORD = re.compile(r"[a-z]+(?:'[a-z]+)*")
+VOWELS = re.compile(r"[aeiouy]+")
+
+
+class Pronunciations:
+    """CMUdict as word -> (stress digits, rhyme key), loaded on first use"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.table: Optional[Dict[str, Tuple[str, int]]] = None
+        self.rhyme_keys: List[str] = []
+        self.source = None
+
+    def load(self):
+        with self.lock:
+            if self.table is not None:
+                return
+            table, key_ids = {}, {}
+            try:
+                from nltk.corpus import cmudict
+                entries = cmudict.entries()
+                for word, phones in entries:
+                    if word in table:
+                        continue  # Keep the first (most common) pronunciation
+                    stress = "".join(phone[-1] for phone in phones if phone[-1].isdigit())
+                    key = rhyme_key(phones)
+                    table[word] = (stress, key_ids.setdefault(key, len(key_ids)))
+                self.source = "cmudict"
+            except LookupError:
+                self.source = "heuristic"
+            self.rhyme_keys = list(key_ids)
+            self.table = table
+
+    def lookup(self, word: str) -> Tuple[str, str, bool]:
+        """(stress digits, rhyme key, found in the dictionary)"""
+        if self.table is None:
+            self.load()
+        entry = self.table.get(word)
+        if entry is not None:
+            return entry[0], self.rhyme_keys[entry[1]], True
+        return heuristic_stress(word), heuristic_rhyme(word), False
+
+
+def rhyme_key(phones: List[str]) -> str:
+    vowels = [index for index, phone in enumerate(phones) if phone[-1].isdigit()]
+    if not vowels:
+        return " ".join(phones)
+    stressed = [index for index in vowels if phones[index][-1] in "12"]
+    start = stressed[-1] if stressed else vowels[-1]
+    return " ".join(phone.rstrip("012") for phone in phones[start:])
+
+
+def heuristic_syllables(word: str) -> int:
+    word = word.replace("'", "")
+    count = len(VOWELS.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee", "ye")) and count > 1:
+        count -= 1  # Silent e: stone, became
+    elif word.endswith(("es", "ed")) and not word.endswith(("tes", "des", "ted", "ded", "ses", "zes", "ces", "ges")) and count > 1:
+        count -= 1  # Silent ending: stones, walked
+    return max(1, count)
+
+
+def heuristic_stress(word: str) -> str:
+    syllables = heuristic_syllables(word)
+    if syllables > 1 and word.startswith(UNSTRESSED_PREFIXES) and not word.endswith("ly"):
+        return "01" + "0" * (syllables - 2)
+    return "1" + "0" * (syllables - 1)
+
+
+def heuristic_rhyme(word: str) -> str:
+    word = word.replace("'", "")
+    if word.endswith("e") and len(word) > 3 and not word.endswith(("ee", "ye", "ue", "oe", "ie")):
+        # Rhyme "stone" with "alone" from the o, not the final e
+        groups = list(VOWELS.finditer(word[:-1]))
+        return word[groups[-1].start():] if groups else word
+    groups = list(VOWELS.finditer(word))
+    ending = word[groups[-1].start():] if groups else word
+    return VOWEL_SOUNDS.get(ending, ending)
+
+
+PRONUNCIATIONS = Pronunciations()
+
+
+def content_hash(content: Optional[str]) -> str:
+    return hashlib.sha256((content or "").encode()).hexdigest()
+
+
+# ---------- Lines ----------
+
+def analyze_line(text: str) -> dict:
+    words = WORD.findall(text.lower())
+    stresses, found = [], 0
+    rhyme = None
+    for word in words:
+        stress, key, known = PRONUNCIATIONS.lookup(word)
+        found += known
+        if word in FUNCTION_WORDS:
+            stresses.append("0" * len(stress))
+        elif len(stress) == 1:
+            stresses.append("x")
+        else:
+            stresses.append(stress.replace("2", "x"))
+        rhyme = key
+    return {
+        "text": text,
+        "syllables": sum(len(stress) for stress in stresses),
+        "stress": "".join(stresses),
+        "rhyme": rhyme,
+        "last_word": words[-1] if words else None,
+        "known_words": found,
+        "words": len(words),
+    }
+
+
+def meter_agreement(stress: str, foot: str) -> float:
+    if not stress:
+        return 0.0
+    expected = (foot * (len(stress) // len(foot) + 1))[:len(stress)]
+    return sum(actual in ("x", wanted) for actual, wanted in zip(stress, expected)) / len(stress)
+
+
+def detect_meter(lines: List[dict]) -> dict:
+    scored = [line for line in lines if line["syllables"] >= 2]
+    if not scored:
+        return {"name": "irregular", "foot": None, "feet_per_line": None, "agreement": 0.0}
+    agreement = {
+        foot: sum(meter_agreement(line["stress"], pattern) for line in scored) / len(scored)
+        for foot, pattern in FEET.items()
+    }
+    foot = max(agreement, key=lambda name: agreement[name] - (TRIPLE_FOOT_MARGIN if len(FEET[name]) == 3 else 0))
+    feet = round(median(line["syllables"] for line in scored) / len(FEET[foot]))
+    name = f"{foot} {LINE_LENGTHS.get(feet, f'{feet}-foot')}" if agreement[foot] >= METER_THRESHOLD else "irregular"
+    return {"name": name, "foot": foot, "feet_per_line": feet, "agreement": round(agreement[foot], 3)}
+
+
+def rhyme_letters(lines: List[dict]) -> List[str]:
+    letters, seen = [], {}
+    for line in lines:
+        key = line["rhyme"]
+        if key is None:
+            letters.append("-")
+            continue
+        if key not in seen:
+            seen[key] = chr(ord("A") + len(seen) % 26)
+        letters.append(seen[key])
+    return letters
+
+
+# ---------- Forms ----------
+
+def scheme_agreement(letters: List[str], expected: str) -> float:
+    """Share of line pairs the expected scheme says rhyme that actually do"""
+    pairs = hits = 0
+    for i, want in enumerate(expected):
+        for j in range(i + 1, len(expected)):
+            if expected[j] == want:
+                pairs += 1
+                hits += letters[i] == letters[j] and letters[i] != "-"
+    return hits / pairs if pairs else 0.0
+
+
+def syllable_fit(lines: List[dict], targets: List[int]) -> float:
+    deviation = sum(abs(line["syllables"] - target) for line, target in zip(lines, targets))
+    return max(0.0, 1 - 0.15 * deviation)
+
+
+def normalized(text: str) -> str:
+    return " ".join(WORD.findall(text.lower()))
+
+
+def score_forms(lines: List[dict], letters: List[str]) -> Dict[str, float]:
+    count = len(lines)
+    scores = {}
+    if count == 3:
+        scores["haiku"] = syllable_fit(lines, [5, 7, 5])
+    if count == 5:
+        scores["tanka"] = syllable_fit(lines, [5, 7, 5, 7, 7])
+        long_lines = [lines[i]["syllables"] for i in (0, 1, 4)]
+        short_lines = [lines[i]["syllables"] for i in (2, 3)]
+        shape = 1.0 if min(long_lines) > max(short_lines) else 0.0
+        scores["limerick"] = 0.6 * scheme_agreement(letters, "AABBA") + 0.4 * shape
+    if count == 14:
+        decasyllabic = sum(9 <= line["syllables"] <= 11 for line in lines) / count
+        scheme = max(
+            scheme_agreement(letters, "ABABCDCDEFEFGG"),  # Shakespearean
+            scheme_agreement(letters, "ABBAABBACDECDE"),  # Petrarchan
+            scheme_agreement(letters, "ABBAABBACDCDCD"),
+            scheme_agreement(letters, "ABABBCBCCDCDEE"),  # Spenserian
+        )
+        scores["sonnet"] = 0.4 + 0.3 * decasyllabic + 0.3 * scheme
+    if count == 19:
+        text = [normalized(line["text"]) for line in lines]
+        refrains = [text[i] == text[0] for i in (5, 11, 17)] + [text[i] == text[2] for i in (8, 14, 18)]
+        scores["villanelle"] = 0.3 + 0.5 * sum(refrains) / len(refrains) + 0.2 * scheme_agreement(letters, "ABAABAABAABAABAABAA")
+    if count >= 6 and count % 2 == 0:
+        # Couplets whose second lines share a refrain word (radif)
+        endings = [lines[i]["last_word"] for i in range(1, count, 2)]
+        common = Counter(endings).most_common(1)[0][1] if endings else 0
+        scores["ghazal"] = 0.3 + 0.7 * common / len(endings) if common > 1 else 0.0
+    return {form: round(score, 3) for form, score in scores.items()}
+
+
+def analyze(content: Optional[str]) -> dict:
+    """Full prosody of a poem: per-line syllables and stress, rhyme scheme, meter and form"""
+    stanzas, current = [], []
+    for raw in (content or "").splitlines():
+        if raw.strip():
+            current.append(raw.strip())
+        elif current:
+            stanzas.append(current)
+            current = []
+    if current:
+        stanzas.append(current)
+
+    lines = [analyze_line(text) for stanza in stanzas for text in stanza]
+    letters = rhyme_letters(lines)
+    scheme, position = [], 0
+    for stanza in stanzas:
+        scheme.append("".join(letters[position:position + len(stanza)]))
+        position += len(stanza)
+
+    scores = score_forms(lines, letters)
+    best = max(scores, key=scores.get) if scores else None
+    detected = best if best and scores[best] >= FORM_THRESHOLD else "free-verse"
+    words = sum(line["words"] for line in lines)
+    return {
+        "content_hash": content_hash(content),
+        "lines": [
+            {"text": line["text"], "syllables": line["syllables"], "stress": line["stress"], "rhyme": letter}
+            for line, letter in zip(lines, letters)
+        ],
+        "line_count": len(lines),
+        "stanzas": [len(stanza) for stanza in stanzas],
+        "rhyme_scheme": " ".join(scheme),
+        "meter": detect_meter(lines),
+        "form_scores": scores,
+        "detected_form": detected if lines else None,
+        "pronunciations": PRONUNCIATIONS.source,
+        "dictionary_coverage": round(sum(line["known_words"] for line in lines) / words, 3) if words else None,
+    }
+
+
+class ProsodyCache:
+    """Analyses by content hash, least recently used dropped first"""
+
+    def __init__(self, size: int = 2048):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def analyze(self, content: Optional[str]) -> dict:
+        key = content_hash(content)
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+        result = analyze(content)
+        with self.lock:
+            self.misses += 1
+        self.put(result)
+        return result
+
+    def put(self, result: dict):
+        """Cache an analysis under its content hash"""
+        with self.lock:
+            self.entries[result["content_hash"]] = result
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,170 @@
+# backend/response_cache.py
+"""Compressed response bodies, cached per resource version.
+
+Poems and pull-request diffs are text and compress 3-5x, but compressing in
+middleware would redo the work on every request. Read endpoints instead ask
+this cache for the body of (resource, variant) at a version they read from
+the database. On a miss the JSON is rendered once, and each encoding a
+client asks for (Brotli, zstd or gzip, by Accept-Encoding) is compressed
+once and kept until the version changes:
+
+    poem:{id}              PoemModel.version
+    pull-request:{id}      status, review time and the poem's version
+    explore                this process's explore generation and newest poem update
+
+Poem and pull-request versions come from the database, so a write made by
+another worker is never served stale. Explore would need an aggregate over
+every public poem for that, so it is keyed instead on a generation counter
+that each explore event seen by this process bumps, plus an indexed
+max(updated_at) that catches other workers' creates and edits. Writes seen by
+this process also drop the old entries at once instead of waiting for them to
+age out of the LRU, which is bounded by total bytes.
+"""
+import gzip
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import brotli
+import pyzstd
+
+IDENTITY = "identity"
+# Server preference when a client accepts several equally
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    "br": lambda body: brotli.compress(body, quality=8),
+    "zstd": lambda body: pyzstd.compress(body, 10),
+    "gzip": lambda body: gzip.compress(body, compresslevel=6, mtime=0),
+}
+# Below this, headers outweigh what compression saves
+MIN_COMPRESS_BYTES = 512
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> str:
+    """Pick the best supported encoding from an Accept-Encoding header"""
+    if not accept_encoding:
+        return IDENTITY
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = IDENTITY, 0.0
+    for encoding in COMPRESSORS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressedResponseCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # (resource, variant, version, encoding) -> body, least recently used first
+        self.entries: "OrderedDict[Tuple[str, str, str, str], bytes]" = OrderedDict()
+        self.by_resource: Dict[str, Set[tuple]] = {}
+        # resource -> how many times it was invalidated; a version for resources
+        # too costly to version from the database
+        self.generations: Dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.compressions = 0
+        self.compress_ms = 0.0
+        self.evictions = 0
+
+    def lookup(self, key: tuple) -> Optional[bytes]:
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def store(self, key: tuple, body: bytes):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.by_resource.setdefault(key[0], set()).add(key)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes and self.entries:
+                old_key, old_body = self.entries.popitem(last=False)
+                self.forget(old_key, old_body)
+                self.evictions += 1
+
+    def forget(self, key: tuple, body: bytes):
+        self.bytes -= len(body)
+        keys = self.by_resource.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_resource[key[0]]
+
+    def body(self, resource: str, variant: str, version, accept_encoding: Optional[str], render: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """Return (body, encoding) for this version, rendering and compressing only on a miss"""
+        version = str(version)
+        encoding = choose_encoding(accept_encoding)
+        body = self.lookup((resource, variant, version, encoding))
+        if body is not None:
+            self.hits += 1
+            return body, encoding
+        self.misses += 1
+
+        plain = self.lookup((resource, variant, version, IDENTITY))
+        if plain is None:
+            plain = render()
+            self.renders += 1
+            self.store((resource, variant, version, IDENTITY), plain)
+        if encoding == IDENTITY or len(plain) < MIN_COMPRESS_BYTES:
+            return plain, IDENTITY
+
+        started = time.perf_counter()
+        body = COMPRESSORS[encoding](plain)
+        self.compress_ms += (time.perf_counter() - started) * 1000
+        self.compressions += 1
+        self.store((resource, variant, version, encoding), body)
+        return body, encoding
+
+    def invalidate(self, resource: str):
+        """Drop every cached variant and version of a resource"""
+        with self.lock:
+            self.generations[resource] = self.generations.get(resource, 0) + 1
+            for key in list(self.by_resource.get(resource, ())):
+                self.forget(key, self.entries.pop(key))
+
+    def generation(self, resource: str) -> int:
+        with self.lock:
+            return self.generations.get(resource, 0)
+
+    def on_event(self, event):
+        """Event bus listener: drop entries for whatever a write touched"""
+        if event.type.startswith("poem."):
+            self.invalidate(f"poem:{event.data['id']}")
+            if "explore" in event.topics:
+                self.invalidate("explore")
+        elif event.type.startswith("pull_request."):
+            self.invalidate(f"pull-request:{event.data['id']}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "renders": self.renders,
+                "compressions": self.compressions,
+                "compress_ms": round(self.compress_ms, 2),
+                "evictions": self.evictions,
+                "encodings": [*COMPRESSORS, IDENTITY],
+            }
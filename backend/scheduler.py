@@ -0,0 +1,210 @@
+# backend/scheduler.py
+"""Admission control and fair scheduling for image generation.
+
+Requests wait in a bounded queue split into priority classes. Within a class
+each user has their own FIFO and users are served round-robin, so one client
+submitting a burst cannot starve everyone else. When the queue (or a user's
+share of it) is full the caller gets QueueFull with a Retry-After estimate
+derived from recent service times. Queued requests whose client disconnects
+are dropped before they reach the model.
+
+The scheduler lives on the API process's event loop; with several API workers
+each admits independently and the inference pool bounds total concurrency.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+# Served strictly in this order
+PRIORITIES = ("interactive", "batch")
+# How often a queued request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+WAIT_SAMPLES = 256
+
+
+class QueueFull(Exception):
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class Ticket:
+    __slots__ = ("user", "priority", "enqueued_at", "future")
+
+    def __init__(self, user: str, priority: str):
+        self.user = user
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class InferenceScheduler:
+    def __init__(self, concurrency: int = 1, max_queue: int = 32, max_per_user: int = 4):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        # priority -> user -> FIFO of tickets; dict order is the round-robin order
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self.queued = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.wait_times = deque(maxlen=WAIT_SAMPLES)
+        self.service_times = deque(maxlen=WAIT_SAMPLES)
+
+    # ---------- Admission ----------
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the recent mean service time"""
+        mean_service = sum(self.service_times) / len(self.service_times) if self.service_times else 10.0
+        backlog = self.queued + self.running
+        return max(1, math.ceil(mean_service * backlog / self.concurrency))
+
+    def queued_for(self, user: str) -> int:
+        return sum(len(users.get(user, ())) for users in self.queues.values())
+
+    def admit(self, user: str, priority: str) -> Ticket:
+        if priority not in self.queues:
+            raise ValueError(f"Unknown priority. Choose one of: {', '.join(PRIORITIES)}")
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull("Image generation queue is full", self.retry_after())
+        if self.queued_for(user) >= self.max_per_user:
+            self.rejected += 1
+            raise QueueFull("Too many image generations queued for this user", self.retry_after())
+
+        ticket = Ticket(user, priority)
+        self.queues[priority].setdefault(user, deque()).append(ticket)
+        self.queued += 1
+        self.admitted += 1
+        self.dispatch()
+        return ticket
+
+    # ---------- Dispatch ----------
+
+    def next_ticket(self) -> Optional[Ticket]:
+        for priority in PRIORITIES:
+            users = self.queues[priority]
+            if not users:
+                continue
+            user, tickets = next(iter(users.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            return ticket
+        return None
+
+    def dispatch(self):
+        while self.running < self.concurrency:
+            ticket = self.next_ticket()
+            if ticket is None:
+                return
+            self.queued -= 1
+            self.running += 1
+            self.wait_times.append(time.monotonic() - ticket.enqueued_at)
+            ticket.future.set_result(True)
+
+    def release(self, service_time: Optional[float] = None):
+        self.running -= 1
+        if service_time is not None:
+            self.service_times.append(service_time)
+            self.completed += 1
+        self.dispatch()
+
+    def cancel(self, ticket: Ticket):
+        tickets = self.queues[ticket.priority].get(ticket.user)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self.queues[ticket.priority][ticket.user]
+            self.queued -= 1
+        elif ticket.future.done():
+            # Granted a slot in the same tick the client went away
+            self.release()
+        self.cancelled += 1
+
+    # ---------- Entry point ----------
+
+    async def run(
+        self,
+        user: str,
+        priority: str,
+        func: Callable,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ):
+        """Queue func for user, wait for a fair turn, then run it in the threadpool"""
+        return await self.execute(self.admit(user, priority), func, is_disconnected)
+
+    async def execute(
+        self,
+        ticket: Ticket,
+        func: Callable,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ):
+        """Wait for an admitted ticket's turn, then run func in the threadpool"""
+        while not ticket.future.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.future), DISCONNECT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    self.cancel(ticket)
+                    raise ClientDisconnected()
+            except asyncio.CancelledError:
+                self.cancel(ticket)
+                raise
+
+        started = time.monotonic()
+        try:
+            result = await run_in_threadpool(func)
+        except BaseException:
+            self.release()
+            raise
+        self.release(time.monotonic() - started)
+        return result
+
+    # ---------- Metrics ----------
+
+    def stats(self) -> dict:
+        waits = sorted(self.wait_times)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(fraction * len(waits)))] * 1000, 1)
+
+        return {
+            "queued": self.queued,
+            "queued_by_priority": {
+                priority: sum(len(tickets) for tickets in users.values())
+                for priority, users in self.queues.items()
+            },
+            "waiting_users": len({user for users in self.queues.values() for user in users}),
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "max_per_user": self.max_per_user,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "completed": self.completed,
+            "wait_ms": {
+                "mean": round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(waits[-1] * 1000, 1) if waits else None,
+            },
+            "retry_after_s": self.retry_after(),
+        }
@@ -0,0 +1,332 @@
+# backend/sharding.py
+"""Horizontal sharding of poems and pull requests by author.
+
+Each poem lives in one of N SQLite files, picked by hashing its author_id
+into a fixed number of buckets and looking the bucket up in a shard map.
+Pull requests and engagement counters live in the same file as the poem
+they target, so every write an endpoint makes (a poem, its PRs, a merge)
+touches a single shard and needs no cross-shard transaction.
+
+The shard map is a JSON file:
+
+    {"buckets": 64, "shards": ["shards/poems-0.db", ...], "assignment": [0, 1, ...]}
+
+`assignment[bucket]` is an index into `shards`, with paths relative to the
+map file. Queries that pin an author (`PoemModel.author_id == ...`) go to
+that author's shard; everything else fans out to every shard. count() sums
+across shards, but a fanned-out ordered list has to be merged: use
+`fetch_ordered`.
+
+Moving to a different number of shards is an offline copy into new files:
+
+    python sharding.py reshard --source pullrequests.db --shards 4 --out shards/
+    python sharding.py reshard --source shards/shardmap.json --shards 8 --out shards8/
+
+then point POETSYNC_SHARD_MAP at the new map and restart.
+"""
+import argparse
+import heapq
+import json
+import os
+import sqlite3
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.ext.horizontal_shard import ShardedQuery, ShardedSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BindParameter, BooleanClauseList
+
+DEFAULT_BUCKETS = 64
+# Tables routed by author; other tables in a source file are not copied
+SHARDED_TABLES = ("poems", "pull_requests", "poem_engagement", "poem_likes")
+# Tables whose rows follow their poem_id's poem
+POEM_CHILD_TABLES = ("pull_requests", "poem_engagement", "poem_likes")
+
+
+def make_engine(url: str):
+    return create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+
+
+def bucket_for_author(author_id: str, buckets: int) -> int:
+    # crc32 rather than hash(): it must be stable across processes and restarts
+    return zlib.crc32(author_id.encode("utf-8")) % buckets
+
+
+class ShardMap:
+    def __init__(self, shards: List[str], assignment: List[int], path: Optional[str] = None):
+        if not shards:
+            raise ValueError("A shard map needs at least one shard")
+        if any(not 0 <= index < len(shards) for index in assignment):
+            raise ValueError("Shard map assigns a bucket to a shard that does not exist")
+        self.shards = shards
+        self.assignment = assignment
+        self.path = path
+
+    @property
+    def buckets(self) -> int:
+        return len(self.assignment)
+
+    @property
+    def shard_ids(self) -> List[str]:
+        return [str(index) for index in range(len(self.shards))]
+
+    @classmethod
+    def create(cls, shards: List[str], buckets: int = DEFAULT_BUCKETS) -> "ShardMap":
+        # bucket % N: going from N to 2N shards keeps half the buckets in place
+        return cls(shards, [bucket % len(shards) for bucket in range(buckets)])
+
+    @classmethod
+    def load(cls, path: str) -> "ShardMap":
+        with open(path) as f:
+            data = json.load(f)
+        if len(data["assignment"]) != data["buckets"]:
+            raise ValueError(f"{path}: assignment must list exactly {data['buckets']} buckets")
+        return cls(data["shards"], data["assignment"], path=path)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"buckets": self.buckets, "shards": self.shards, "assignment": self.assignment}, f, indent=2)
+        self.path = path
+
+    def shard_path(self, shard_id: str) -> str:
+        path = self.shards[int(shard_id)]
+        if self.path and not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(self.path)), path)
+        return path
+
+    def shard_for_author(self, author_id: str) -> str:
+        return str(self.assignment[bucket_for_author(author_id, self.buckets)])
+
+    def engines(self) -> Dict[str, object]:
+        return {shard_id: make_engine(f"sqlite:///{self.shard_path(shard_id)}") for shard_id in self.shard_ids}
+
+
+# ---------- Session routing ----------
+
+def author_ids_in(statement, table_name: str) -> Optional[set]:
+    """Author ids a statement is pinned to, or None if it may touch any author.
+
+    Only equality tests in the top-level AND of a WHERE clause count; the
+    subquery Query.count() wraps around the original statement is looked into.
+    """
+    authors = set()
+
+    def collect(clause):
+        if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+            for child in clause.clauses:
+                collect(child)
+        elif (
+            getattr(clause, "operator", None) is operators.eq
+            and getattr(clause.left, "key", None) == "author_id"
+            and getattr(getattr(clause.left, "table", None), "name", None) == table_name
+            and isinstance(clause.right, BindParameter)
+        ):
+            authors.add(clause.right.effective_value)
+
+    def visit_select(select):
+        if getattr(select, "whereclause", None) is not None:
+            collect(select.whereclause)
+
+    visit_select(statement)
+    visitors.traverse(statement, {}, {"select": visit_select})
+    return authors or None
+
+
+class CountingShardedQuery(ShardedQuery):
+    """ShardedQuery whose count() adds up the per-shard counts.
+
+    A fanned-out SELECT count(*) otherwise returns one row per shard.
+    """
+
+    def count(self) -> int:
+        if "_sa_shard_id" in self._execution_options:
+            return super().count()
+        shard_ids = self.session.info["shards_for"](self.statement)
+        return sum(self.set_shard(shard_id).count() for shard_id in shard_ids)
+
+
+def sharded_sessionmaker(shard_map: ShardMap, engines: Dict[str, object], poem_model, pull_request_model, **kwargs):
+    """A sessionmaker whose sessions route poems by author and PRs with their poem"""
+    poem_table = poem_model.__tablename__
+
+    def shard_for_poem(session, poem_id: str) -> str:
+        for obj in session.new:
+            if isinstance(obj, poem_model) and obj.id == poem_id:
+                return shard_map.shard_for_author(obj.author_id)
+        for shard_id in shard_map.shard_ids:
+            if session.identity_key(poem_model, poem_id, identity_token=shard_id) in session.identity_map:
+                return shard_id
+        # Not loaded in this session: ask each shard directly
+        for shard_id, bind in engines.items():
+            with bind.connect() as conn:
+                author = conn.exec_driver_sql(f"SELECT author_id FROM {poem_table} WHERE id = ?", (poem_id,)).scalar()
+            if author is not None:
+                return shard_map.shard_for_author(author)
+        raise ValueError(f"Poem {poem_id} not found on any shard")
+
+    def shard_chooser(mapper, instance, clause=None, **kw):
+        if instance is None:
+            # Mapper-level binds (e.g. a bare session.connection()) use the first shard
+            return shard_map.shard_ids[0]
+        if isinstance(instance, poem_model):
+            return shard_map.shard_for_author(instance.author_id)
+        if isinstance(instance, pull_request_model):
+            poem = instance.__dict__.get("poem")
+            if poem is not None:
+                return inspect(poem).identity_token or shard_map.shard_for_author(poem.author_id)
+            return shard_for_poem(inspect(instance).session, instance.poem_id)
+        if hasattr(instance, "poem_id"):
+            return shard_for_poem(inspect(instance).session, instance.poem_id)
+        raise ValueError(f"No sharding rule for {type(instance).__name__}")
+
+    def identity_chooser(mapper, primary_key, *, lazy_loaded_from=None, **kw):
+        # A PR's poem (and a poem's PRs) always share the parent's shard
+        if lazy_loaded_from is not None and lazy_loaded_from.identity_token is not None:
+            return [lazy_loaded_from.identity_token]
+        return shard_map.shard_ids
+
+    def shards_for(statement) -> List[str]:
+        authors = author_ids_in(statement, poem_table)
+        if authors is None:
+            return shard_map.shard_ids
+        return sorted({shard_map.shard_for_author(author) for author in authors})
+
+    def execute_chooser(context):
+        return shards_for(context.statement)
+
+    return sessionmaker(
+        class_=ShardedSession,
+        query_cls=CountingShardedQuery,
+        shards=engines,
+        shard_chooser=shard_chooser,
+        identity_chooser=identity_chooser,
+        execute_chooser=execute_chooser,
+        info={"shards_for": shards_for},
+        **kwargs,
+    )
+
+
+# ---------- Scatter-gather ----------
+
+def fetch_ordered(query, order_column, descending: bool = True) -> list:
+    """Run an ordered query; on a sharded session, k-way merge the per-shard results.
+
+    Each shard already returns its rows sorted by order_column, so the merge
+    is a single heapq.merge pass. Entity queries return objects and column
+    queries return dicts, sharded or not.
+    """
+    descriptions = query.column_descriptions
+    entity_query = len(descriptions) == 1 and isinstance(descriptions[0]["expr"], type)
+
+    if not isinstance(query.session, ShardedSession):
+        rows = query.all()
+        return rows if entity_query else [dict(row._mapping) for row in rows]
+
+    keyed = query.add_columns(order_column.label("_shard_sort_key"))
+    shard_ids = query.session.info["shards_for"](query.statement)
+    per_shard = [keyed.set_shard(shard_id).all() for shard_id in shard_ids]
+    merged = heapq.merge(*per_shard, key=lambda row: row[-1], reverse=descending)
+    if entity_query:
+        return [row[0] for row in merged]
+    return [{key: value for key, value in row._mapping.items() if key != "_shard_sort_key"} for row in merged]
+
+
+# ---------- Offline resharding ----------
+
+def open_source(source: str) -> ShardMap:
+    """A shard map file, or a plain database file treated as a single shard"""
+    if source.endswith(".json"):
+        return ShardMap.load(source)
+    return ShardMap.create([os.path.abspath(source)], buckets=1)
+
+
+def reshard(source: ShardMap, shards: int, out_dir: str, buckets: int = DEFAULT_BUCKETS) -> dict:
+    """Copy every poem and PR from source into a fresh set of shard files.
+
+    Source files are only read, so the old layout stays usable until the new
+    map is deployed. Returns per-shard row counts.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    target = ShardMap.create([f"poems-{index}.db" for index in range(shards)], buckets=buckets)
+    map_path = os.path.join(out_dir, "shardmap.json")
+    target.path = map_path
+    for shard_id in target.shard_ids:
+        if os.path.exists(target.shard_path(shard_id)):
+            raise FileExistsError(f"{target.shard_path(shard_id)} already exists; reshard into an empty directory")
+
+    sources = [sqlite3.connect(source.shard_path(shard_id)) for shard_id in source.shard_ids]
+    targets = {shard_id: sqlite3.connect(target.shard_path(shard_id)) for shard_id in target.shard_ids}
+
+    # Same DDL as the source (including partial indexes), minus any other tables
+    schema = sources[0].execute(
+        f"SELECT sql FROM sqlite_master WHERE tbl_name IN ({', '.join('?' * len(SHARDED_TABLES))}) AND sql IS NOT NULL ORDER BY type DESC",
+        SHARDED_TABLES,
+    ).fetchall()
+    for conn in targets.values():
+        for (ddl,) in schema:
+            conn.execute(ddl)
+
+    counts = {shard_id: {table: 0 for table in SHARDED_TABLES} for shard_id in target.shard_ids}
+    for src in sources:
+        columns = {
+            table: [row[1] for row in src.execute(f"PRAGMA table_info({table})")]
+            for table in SHARDED_TABLES
+        }
+        author_of_poem = {}
+        for row in src.execute(f"SELECT {', '.join(columns['poems'])} FROM poems"):
+            record = dict(zip(columns["poems"], row))
+            shard_id = target.shard_for_author(record["author_id"])
+            author_of_poem[record["id"]] = record["author_id"]
+            targets[shard_id].execute(
+                f"INSERT INTO poems ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})",
+                tuple(record.values()),
+            )
+            counts[shard_id]["poems"] += 1
+        for table in POEM_CHILD_TABLES:
+            if not columns[table]:
+                # Older source without this table
+                continue
+            for row in src.execute(f"SELECT {', '.join(columns[table])} FROM {table}"):
+                record = dict(zip(columns[table], row))
+                author = author_of_poem.get(record["poem_id"])
+                if author is None:
+                    print(f"⚠️ Skipping {table} row {record.get('id', record['poem_id'])}: its poem {record['poem_id']} does not exist")
+                    continue
+                shard_id = target.shard_for_author(author)
+                targets[shard_id].execute(
+                    f"INSERT INTO {table} ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})",
+                    tuple(record.values()),
+                )
+                counts[shard_id][table] += 1
+
+    for conn in targets.values():
+        conn.commit()
+        conn.close()
+    for src in sources:
+        src.close()
+    target.save(map_path)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    reshard_parser = commands.add_parser("reshard", help="Copy a database or shard set into N new shard files")
+    reshard_parser.add_argument("--source", required=True, help="shardmap.json, or a single .db file")
+    reshard_parser.add_argument("--shards", type=int, required=True)
+    reshard_parser.add_argument("--out", required=True, help="Empty directory for the new files and shardmap.json")
+    reshard_parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS)
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    counts = reshard(open_source(args.source), args.shards, args.out, args.buckets)
+    for shard_id, tables in counts.items():
+        print(f"shard {shard_id}: {tables['poems']} poems, {tables['pull_requests']} pull requests")
+    print(f"✅ Wrote {os.path.join(args.out, 'shardmap.json')} in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
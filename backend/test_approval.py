@@ -1,6 +1,7 @@
 # backend/test_approval.py
 from fastapi.testclient import TestClient
 from main import app, get_db, Base, engine
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from main import PullRequestModel, PoemModel
 import uuid
@@ -21,6 +22,84 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+class StubTokenizer:
+    model_max_length = 77
+    
+    def __call__(self, prompt, **kwargs):
+        import torch
+        from types import SimpleNamespace
+        ids = [ord(char) for char in prompt[:77]] + [0] * (77 - len(prompt[:77]))
+        return SimpleNamespace(input_ids=torch.tensor([ids]), attention_mask=None)
+
+class StubTextEncoder:
+    """Counts forward passes, so tests can tell cached prompt encodings from fresh ones"""
+    
+    def __init__(self):
+        import torch
+        from types import SimpleNamespace
+        self.config = SimpleNamespace(use_attention_mask=False)
+        self.dtype = torch.float32
+        self.calls = 0
+    
+    def __call__(self, input_ids, attention_mask=None):
+        import torch
+        self.calls += 1
+        return (torch.zeros(1, 77, 8),)
+
+class StubPipeline:
+    """Stands in for StableDiffusionPipeline: records each call and returns one small image per seed"""
+    
+    def __init__(self, max_images=None):
+        from diffusers import PNDMScheduler
+        self.scheduler = PNDMScheduler()
+        self.tokenizer = StubTokenizer()
+        self.text_encoder = StubTextEncoder()
+        self.device = "cpu"
+        self.attention_slicing = None
+        self.max_images = max_images
+        # Raised from every call when set
+        self.error = None
+        self.calls = []
+    
+    def enable_attention_slicing(self):
+        self.attention_slicing = True
+    
+    def disable_attention_slicing(self):
+        self.attention_slicing = False
+    
+    def __call__(self, num_images_per_prompt=1, generator=None, callback=None, output_type="pil", **settings):
+        import torch
+        from types import SimpleNamespace
+        from PIL import Image
+        generators = generator if isinstance(generator, list) else [generator] * num_images_per_prompt
+        seeds = [g.initial_seed() if g is not None else None for g in generators]
+        self.calls.append({
+            "scheduler": type(self.scheduler).__name__,
+            "attention_slicing": self.attention_slicing,
+            "num_threads": torch.get_num_threads(),
+            "seeds": seeds,
+            **settings,
+        })
+        if self.error is not None:
+            raise self.error
+        if self.max_images and num_images_per_prompt > self.max_images:
+            raise RuntimeError("CPU out of memory")
+        if callback is not None:
+            for step in range(settings["num_inference_steps"]):
+                callback(step, 0, torch.zeros(1, 4, 8, 8))
+        return SimpleNamespace(images=[Image.new("RGB", (8, 8), ((seed or 0) % 256, 0, 0)) for seed in seeds])
+
+def stub_generator(pipe):
+    """An ImageGenerator whose pipeline is already loaded, as pipe"""
+    import torch
+    from imagegen import ImageGenerator, PROFILES
+    generator = ImageGenerator("stub", device="cpu")
+    for profile in PROFILES.values():
+        key = generator.pipe_key(profile)
+        generator._pipes[key] = pipe
+        generator._negative_embeds[key] = torch.zeros(1, 77, 8)
+    return generator
+
 def test_create_poem_and_pull_request_workflow():
     """Test the complete workflow: create poem -> create PR -> approve/reject"""
     db: Session = next(override_get_db())
@@ -142,6 +221,95 @@ def test_reject_pull_request():
     poem = response.json()
     assert poem["content"] == "Original content"
 
+def test_approving_stale_pull_request_conflicts():
+    """Test that a PR opened before the author's own edit cannot overwrite it"""
+    author_id = "stale_author"
+    poem_id = client.post("/api/poems", json={
+        "title": "Moving Target",
+        "content": "The first draft",
+        "author_id": author_id,
+        "author_name": "Stale Author",
+        "is_public": True
+    }).json()["id"]
+    pr_id = client.post("/api/pull-requests", json={
+        "poem_id": poem_id,
+        "proposed_content": "A contributor's rewrite of the first draft",
+        "author_id": "stale_contributor",
+        "author_name": "Stale Contributor"
+    }).json()["id"]
+    assert client.get(f"/api/pull-requests/{pr_id}").json()["base_version"] == 1
+    
+    client.put(f"/api/poems/{poem_id}?current_user_id={author_id}", json={"content": "The author's second draft"})
+    response = client.post(f"/api/pull-requests/{pr_id}/approve?reviewer_id={author_id}", json={})
+    assert response.status_code == 409
+    assert client.get(f"/api/poems/{poem_id}").json()["content"] == "The author's second draft"
+    # Still pending, so it can be rejected or superseded
+    assert client.get(f"/api/pull-requests/{pr_id}").json()["status"] == "pending"
+    
+    # Only its author can refresh it, which rebases it on the current text
+    refresh = {"proposed_content": "A contributor's rewrite of the second draft"}
+    assert client.put(f"/api/pull-requests/{pr_id}?author_id=someone_else", json=refresh).status_code == 403
+    response = client.put(f"/api/pull-requests/{pr_id}?author_id=stale_contributor", json=refresh)
+    assert response.status_code == 200
+    refreshed = client.get(f"/api/pull-requests/{pr_id}").json()
+    assert refreshed["original_content"] == "The author's second draft"
+    assert refreshed["proposed_content"] == refresh["proposed_content"] and refreshed["updated_at"] is not None
+    response = client.post(f"/api/pull-requests/{pr_id}/approve?reviewer_id={author_id}", json={})
+    assert response.status_code == 200
+    assert client.get(f"/api/poems/{poem_id}").json()["content"] == refresh["proposed_content"]
+    assert client.put(f"/api/pull-requests/{pr_id}?author_id=stale_contributor", json=refresh).status_code == 400
+
+def test_metadata_edits_keep_pull_requests_approvable():
+    """Test that visibility and tone edits do not make a pending PR stale, and that a stale one can be withdrawn"""
+    author_id = "metadata_author"
+    poem_id = client.post("/api/poems", json={
+        "title": "Shifting Light",
+        "content": "Morning on the water",
+        "author_id": author_id,
+        "author_name": "Metadata Author",
+        "is_public": True
+    }).json()["id"]
+    pr_id = client.post("/api/pull-requests", json={
+        "poem_id": poem_id,
+        "proposed_content": "Morning light on the water",
+        "author_id": "metadata_contributor",
+        "author_name": "Metadata Contributor"
+    }).json()["id"]
+    
+    client.put(f"/api/poems/{poem_id}?current_user_id={author_id}", json={"is_public": False})
+    client.put(f"/api/poems/{poem_id}?current_user_id={author_id}", json={"is_public": True, "tone": "contemplative"})
+    # A title edit does not conflict with a PR that leaves the title alone, and is kept on approval
+    client.put(f"/api/poems/{poem_id}?current_user_id={author_id}", json={"title": "Shifting Light, Revised"})
+    response = client.post(f"/api/pull-requests/{pr_id}/approve?reviewer_id={author_id}", json={})
+    assert response.status_code == 200
+    poem = client.get(f"/api/poems/{poem_id}").json()
+    assert poem["content"] == "Morning light on the water"
+    assert poem["title"] == "Shifting Light, Revised"
+    
+    # A PR renaming the poem conflicts once the author renames it too
+    pr_id = client.post("/api/pull-requests", json={
+        "poem_id": poem_id,
+        "proposed_content": "Morning light on the water",
+        "proposed_title": "Harbour Light",
+        "author_id": "metadata_contributor",
+        "author_name": "Metadata Contributor"
+    }).json()["id"]
+    client.put(f"/api/poems/{poem_id}?current_user_id={author_id}", json={"title": "Shifting Light, Final"})
+    assert client.post(f"/api/pull-requests/{pr_id}/approve?reviewer_id={author_id}", json={}).status_code == 409
+    
+    # Withdrawing it frees the contributor to open another
+    assert client.post(f"/api/pull-requests/{pr_id}/withdraw?author_id={author_id}").status_code == 403
+    assert client.post(f"/api/pull-requests/{pr_id}/withdraw?author_id=metadata_contributor").status_code == 200
+    assert client.get(f"/api/pull-requests/{pr_id}").json()["status"] == "withdrawn"
+    assert client.post(f"/api/pull-requests/{pr_id}/withdraw?author_id=metadata_contributor").status_code == 400
+    response = client.post("/api/pull-requests", json={
+        "poem_id": poem_id,
+        "proposed_content": "Morning light on the harbour",
+        "author_id": "metadata_contributor",
+        "author_name": "Metadata Contributor"
+    })
+    assert response.status_code == 200
+
 def test_cannot_create_pr_for_own_poem():
     """Test that users cannot create PRs for their own poems"""
     db: Session = next(override_get_db())
@@ -451,6 +619,39 @@ def test_duplicate_pending_pr_prevention():
     assert response.status_code == 400
     assert "already have a pending pull request" in response.json()["detail"]
 
+def test_upgrade_closes_duplicate_pending_prs():
+    """Test that upgrading a database with duplicate pending PRs keeps the newest and builds the unique index"""
+    import tempfile
+    from datetime import timedelta
+    from sqlalchemy import create_engine
+    from main import upgrade_schema
+    
+    old_engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/old.db")
+    Base.metadata.create_all(bind=old_engine)
+    started = datetime.utcnow()
+    with old_engine.begin() as conn:
+        # A database from before the index existed
+        conn.execute(text("DROP INDEX uq_pull_requests_pending_author"))
+        poem = PoemModel.__table__
+        conn.execute(poem.insert().values(
+            id="old-poem", title="Old", content="Line", author_id="author", author_name="Author",
+            is_public=True, created_at=started, updated_at=started, version=1
+        ))
+        for i in range(3):
+            conn.execute(PullRequestModel.__table__.insert().values(
+                id=f"old-pr-{i}", poem_id="old-poem", original_content="Line", proposed_content=f"Edit {i}",
+                author_id="contributor", author_name="Contributor", status="pending",
+                created_at=started + timedelta(seconds=i)
+            ))
+    
+    upgrade_schema(old_engine)
+    with old_engine.connect() as conn:
+        statuses = dict(conn.execute(text("SELECT id, status FROM pull_requests")).all())
+        index = conn.execute(text("SELECT name FROM sqlite_master WHERE name = 'uq_pull_requests_pending_author'")).scalar()
+    assert statuses == {"old-pr-0": "rejected", "old-pr-1": "rejected", "old-pr-2": "pending"}
+    assert index == "uq_pull_requests_pending_author"
+    old_engine.dispose()
+
 def test_private_poem_pr_prevention():
     """Test that PRs cannot be created for private poems"""
     db: Session = next(override_get_db())
@@ -484,6 +685,1276 @@ def test_private_poem_pr_prevention():
     assert response.status_code == 403
     assert "Cannot create pull request for private poem" in response.json()["detail"]
 
+def test_concurrent_pull_request_creation_and_approval():
+    """Stress test: parallel submissions and reviewers must not double-apply"""
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+
+    db: Session = next(override_get_db())
+    workers = 16
+
+    author_id = "stressauthor"
+    poem = PoemModel(
+        id=str(uuid.uuid4()),
+        title="Contended Poem",
+        content="Original content",
+        author_id=author_id,
+        author_name="Stress Author",
+        is_public=True,
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow()
+    )
+    db.add(poem)
+    db.commit()
+
+    def run_in_parallel(call):
+        barrier = threading.Barrier(workers)
+
+        def worker(i):
+            barrier.wait()
+            return call(i, TestClient(app))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return [response.status_code for response in pool.map(worker, range(workers))]
+
+    # 1. The same contributor submits many times at once: exactly one PR lands
+    def submit_duplicate(i, worker_client):
+        return worker_client.post("/api/pull-requests", json={
+            "poem_id": poem.id,
+            "proposed_content": f"Racing change {i}",
+            "author_id": "racer",
+            "author_name": "Racer"
+        })
+
+    codes = run_in_parallel(submit_duplicate)
+    assert codes.count(200) == 1
+    assert codes.count(400) == workers - 1
+    pending = db.query(PullRequestModel).filter(
+        PullRequestModel.poem_id == poem.id,
+        PullRequestModel.status == "pending"
+    ).count()
+    assert pending == 1
+
+    # 2. Many reviewers approve the same PR at once: it is merged exactly once
+    pr_id = db.query(PullRequestModel.id).filter(PullRequestModel.poem_id == poem.id).scalar()
+
+    def approve_same(i, worker_client):
+        return worker_client.post(f"/api/pull-requests/{pr_id}/approve?reviewer_id={author_id}", json={})
+
+    codes = run_in_parallel(approve_same)
+    assert codes.count(200) == 1
+    assert all(code in (200, 400, 409) for code in codes)
+    db.expire_all()
+    assert db.query(PoemModel.version).filter(PoemModel.id == poem.id).scalar() == 2
+
+    # 3. Different PRs for the same poem approved at once: every success bumps
+    # the version exactly once and no merge is silently lost
+    pr_ids = []
+    for i in range(workers):
+        response = client.post("/api/pull-requests", json={
+            "poem_id": poem.id,
+            "proposed_content": f"Contributor change {i}",
+            "author_id": f"contributor-{i}",
+            "author_name": f"Contributor {i}"
+        })
+        assert response.status_code == 200
+        pr_ids.append(response.json()["id"])
+
+    def approve_distinct(i, worker_client):
+        return worker_client.post(f"/api/pull-requests/{pr_ids[i]}/approve?reviewer_id={author_id}", json={})
+
+    codes = run_in_parallel(approve_distinct)
+    assert all(code in (200, 409) for code in codes)
+    merged = codes.count(200)
+    assert merged >= 1
+    db.expire_all()
+    assert db.query(PoemModel.version).filter(PoemModel.id == poem.id).scalar() == 2 + merged
+    approved = db.query(PullRequestModel).filter(
+        PullRequestModel.id.in_(pr_ids),
+        PullRequestModel.status == "approved"
+    ).count()
+    assert approved == merged
+
+def test_summary_views_and_sparse_fields():
+    """Test that list routes can project summaries and selected fields"""
+    author_id = "summary_author"
+    content = "\n".join(f"Line {i}" for i in range(1, 7))
+    poem = client.post("/api/poems", json={
+        "title": "Long Poem",
+        "content": content,
+        "author_id": author_id,
+        "author_name": "Summary Author",
+        "is_public": True
+    }).json()
+    client.post("/api/pull-requests", json={
+        "poem_id": poem["id"],
+        "proposed_content": content + "\nLine 7",
+        "author_id": "summary_contributor",
+        "author_name": "Contributor"
+    })
+    
+    # Summary view carries the excerpt and line count instead of the content
+    response = client.get(f"/api/poems/user/{author_id}?view=summary")
+    assert response.status_code == 200
+    summary = response.json()[0]
+    assert "content" not in summary
+    assert summary["excerpt"] == "Line 1\nLine 2\nLine 3"
+    assert summary["line_count"] == 6
+    
+    # Sparse fieldsets always include the id
+    response = client.get("/api/poems/explore?fields=title,line_count")
+    assert response.status_code == 200
+    assert set(response.json()[0]) == {"id", "title", "line_count"}
+    
+    response = client.get("/api/poems/explore?fields=title,bogus")
+    assert response.status_code == 400
+    
+    response = client.get("/api/pull-requests?pr_author_id=summary_contributor&view=summary")
+    assert response.status_code == 200
+    pr = response.json()[0]
+    assert "proposed_content" not in pr
+    assert pr["proposed_line_count"] == 7
+    assert pr["original_line_count"] == 6
+    assert pr["poem_title"] == "Long Poem"
+    
+    # Single-item routes stay full
+    full = client.get(f"/api/poems/{poem['id']}").json()
+    assert full["content"] == content
+
+def test_trending_and_popular_explore():
+    """Test that engagement counts rank explore and are flushed in batches"""
+    from main import engagement_counters, record_engagement, PoemEngagementModel
+    author_id = "ranking_author"
+    quiet, liked = [
+        client.post("/api/poems", json={
+            "title": title,
+            "content": "Ranked lines",
+            "author_id": author_id,
+            "author_name": "Ranking Author",
+            "is_public": True
+        }).json()["id"]
+        for title in ("Quiet Poem", "Liked Poem")
+    ]
+    
+    # Each user counts once, however often they like or unlike
+    for reader in ("reader_a", "reader_b", "reader_c", "reader_a"):
+        assert client.post(f"/api/poems/{liked}/like?user_id={reader}").status_code == 200
+    for _ in range(2):
+        assert client.delete(f"/api/poems/{liked}/like?user_id=reader_c").json()["liked"] is False
+    assert client.delete(f"/api/poems/{liked}/like?user_id=never_liked").status_code == 200
+    assert client.post(f"/api/poems/{liked}/like").status_code == 422
+    client.get(f"/api/poems/{liked}")
+    client.post("/api/pull-requests", json={
+        "poem_id": liked,
+        "proposed_content": "Ranked lines, revised",
+        "author_id": "ranking_contributor",
+        "author_name": "Contributor"
+    })
+    
+    for sort in ("popular", "trending"):
+        response = client.get(f"/api/poems/explore?sort={sort}&limit=100")
+        assert response.status_code == 200
+        assert int(response.headers["x-total-count"]) >= 2
+        ids = [poem["id"] for poem in response.json()]
+        assert ids.index(liked) < ids.index(quiet)
+    
+    ranked = {poem["id"]: poem for poem in client.get("/api/poems/explore?sort=popular&limit=100&view=summary").json()}
+    assert "content" not in ranked[liked]
+    assert (ranked[liked]["views"], ranked[liked]["likes"], ranked[liked]["pull_requests_received"]) == (1, 2, 1)
+    assert ranked[liked]["popular_score"] == 1 + 2 * 5 + 10
+    
+    # Counters reach the database on flush, without bumping the poem's version
+    engagement_counters.flush()
+    db = next(override_get_db())
+    row = db.query(PoemEngagementModel).filter(PoemEngagementModel.poem_id == liked).first()
+    assert (row.views, row.likes, row.pull_requests) == (1, 2, 1)
+    assert client.get(f"/api/poems/{liked}").json()["version"] == 1
+    db.close()
+    
+    # Private poems leave the ranking
+    client.put(f"/api/poems/{liked}?current_user_id={author_id}", json={"is_public": False})
+    ids = [poem["id"] for poem in client.get("/api/poems/explore?sort=trending&limit=100").json()]
+    assert liked not in ids and quiet in ids
+    
+    # Counts never go below zero, in the index or stored
+    db = next(override_get_db())
+    quiet_poem = db.query(PoemModel).filter(PoemModel.id == quiet).first()
+    for _ in range(3):
+        client.delete(f"/api/poems/{quiet}/like?user_id=reader_a")
+        record_engagement(quiet_poem, "likes", -1)
+    assert engagement_counters.ranking.stats(quiet)["likes"] == 0
+    engagement_counters.flush()
+    assert db.query(PoemEngagementModel.likes).filter(PoemEngagementModel.poem_id == quiet).scalar() == 0
+    client.post(f"/api/poems/{quiet}/like?user_id=reader_a")
+    assert engagement_counters.ranking.stats(quiet)["likes"] == 1
+    
+    # Deltas still pending when their poem is deleted are not written back as orphans
+    client.get(f"/api/poems/{quiet}")
+    pending = dict(engagement_counters.pending)
+    client.delete(f"/api/poems/{quiet}?current_user_id={author_id}")
+    engagement_counters.pending.update(pending)
+    engagement_counters.flush()
+    db.expire_all()
+    assert db.query(PoemEngagementModel).filter(PoemEngagementModel.poem_id == quiet).first() is None
+    db.close()
+    
+    assert client.get("/api/poems/explore?sort=bogus").status_code == 400
+    assert client.get("/api/poems/explore?sort=popular&limit=0").status_code == 400
+
+def test_request_profiling_and_slow_logs():
+    """Test admin-gated request profiles and the slow request/query logs"""
+    import main
+    saved = main.ADMIN_TOKEN, main.profiler.slow_query_ms
+    main.ADMIN_TOKEN, main.profiler.slow_query_ms = "test-admin-token", 0
+    admin = {"X-Admin-Token": "test-admin-token"}
+    try:
+        assert client.get("/api/poems/explore?_profile=1").status_code == 403
+        assert client.get("/api/admin/slow-requests").status_code == 403
+        
+        response = client.get("/api/poems/explore", headers={**admin, "X-Profile": "1"})
+        assert response.status_code == 200
+        profile_id = response.headers["x-profile-id"]
+        profile = client.get(f"/api/admin/profiles/{profile_id}", headers=admin)
+        assert profile.status_code == 200
+        assert "attachment" in profile.headers["content-disposition"]
+        assert profile.headers["x-profile-route"] == "GET /api/poems/explore"
+        assert client.get("/api/admin/profiles/missing", headers=admin).status_code == 404
+        
+        slowest = client.get("/api/admin/slow-requests?route=/api/poems/explore", headers=admin).json()
+        assert slowest and slowest[0]["route"] == "/api/poems/explore"
+        assert slowest[0]["db_queries"] >= 1
+        
+        queries = client.get("/api/admin/slow-queries?limit=5", headers=admin).json()["queries"]
+        explore = [query for query in queries if query["route"] == "GET /api/poems/explore"]
+        assert explore and "FROM poems" in explore[0]["sql"]
+    finally:
+        main.ADMIN_TOKEN, main.profiler.slow_query_ms = saved
+
+def test_compressed_response_cache():
+    """Test that reads are served compressed, cached per version and refreshed on writes"""
+    import json
+    import pyzstd
+    from main import response_cache
+    author_id = "cache_author"
+    content = "\n".join(f"A long and very compressible line of verse, number {i}" for i in range(60))
+    poem_id = client.post("/api/poems", json={
+        "title": "Compressible",
+        "content": content,
+        "author_id": author_id,
+        "author_name": "Cache Author",
+        "is_public": True
+    }).json()["id"]
+    
+    before = response_cache.stats()
+    response = client.get(f"/api/poems/{poem_id}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["content"] == content
+    assert int(response.headers["content-length"]) < len(content)
+    client.get(f"/api/poems/{poem_id}", headers={"Accept-Encoding": "gzip"})
+    after = response_cache.stats()
+    assert after["compressions"] == before["compressions"] + 1
+    assert after["hits"] == before["hits"] + 1
+    
+    # Preference order and q-values pick the encoding
+    with client.stream("GET", f"/api/poems/{poem_id}", headers={"Accept-Encoding": "gzip;q=0.5, zstd"}) as raw:
+        assert raw.headers["content-encoding"] == "zstd"
+        assert json.loads(pyzstd.decompress(b"".join(raw.iter_raw()))) == response.json()
+    response = client.get(f"/api/poems/{poem_id}", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    
+    # A write bumps the version, so the next read is fresh
+    client.put(f"/api/poems/{poem_id}?current_user_id={author_id}", json={"title": "Recompressed"})
+    assert client.get(f"/api/poems/{poem_id}", headers={"Accept-Encoding": "br"}).json()["title"] == "Recompressed"
+    explore = client.get("/api/poems/explore", headers={"Accept-Encoding": "gzip"})
+    assert explore.headers["content-encoding"] == "gzip"
+    assert any(poem["title"] == "Recompressed" for poem in explore.json())
+    
+    # An edit made by another worker publishes no local event but moves max(updated_at)
+    db: Session = next(override_get_db())
+    db.query(PoemModel).filter(PoemModel.id == poem_id).update({"title": "Edited Elsewhere", "updated_at": datetime.utcnow()})
+    db.commit()
+    db.close()
+    assert any(poem["title"] == "Edited Elsewhere" for poem in client.get("/api/poems/explore").json())
+    
+    generation = response_cache.generation("explore")
+    client.delete(f"/api/poems/{poem_id}?current_user_id={author_id}")
+    assert response_cache.generation("explore") == generation + 1
+    assert all(poem["id"] != poem_id for poem in client.get("/api/poems/explore").json())
+
+def test_near_duplicate_detection():
+    """Test that copied poems and no-op pull requests are caught at submit time"""
+    import main
+    original = "\n".join([
+        "The lighthouse keeper counts the waves at night",
+        "and writes their names in salt upon the glass",
+        "each one a letter from a drowned and patient sea",
+        "that no one else has ever learned to read",
+    ])
+    source = client.post("/api/poems", json={
+        "title": "Lighthouse",
+        "content": original,
+        "author_id": "dup_original",
+        "author_name": "Original Author",
+        "is_public": True
+    }).json()
+    assert "possible_duplicate" not in source
+    
+    # A lightly edited copy by someone else is flagged with its similarity
+    copy = original.upper().replace("TO READ", "to read, again")
+    flagged = client.post("/api/poems", json={
+        "title": "Not a Lighthouse",
+        "content": copy,
+        "author_id": "dup_copier",
+        "author_name": "Copier",
+        "is_public": True
+    }).json()
+    assert flagged["possible_duplicate"]["poem_id"] == source["id"]
+    assert flagged["possible_duplicate"]["similarity"] >= 0.85
+    
+    duplicates = client.get(f"/api/poems/{source['id']}/duplicates").json()["duplicates"]
+    assert [match["poem_id"] for match in duplicates] == [flagged["id"]]
+    
+    saved = main.DUPLICATE_POLICY
+    main.DUPLICATE_POLICY = "reject"
+    try:
+        response = client.post("/api/poems", json={
+            "title": "Copy Again",
+            "content": copy,
+            "author_id": "dup_copier_2",
+            "is_public": True
+        })
+        assert response.status_code == 409
+    finally:
+        main.DUPLICATE_POLICY = saved
+    
+    # Whitespace-only pull requests change nothing
+    response = client.post("/api/pull-requests", json={
+        "poem_id": source["id"],
+        "proposed_content": "  " + original.replace("\n", "\n\n") + "\n",
+        "author_id": "dup_contributor",
+        "author_name": "Contributor"
+    })
+    assert response.status_code == 400
+    
+    # Deleted and private poems drop out of the results; a title edit shows in matches
+    client.put(f"/api/poems/{flagged['id']}?current_user_id=dup_copier", json={"is_public": False})
+    assert client.get(f"/api/poems/{source['id']}/duplicates").json()["duplicates"] == []
+    client.put(f"/api/poems/{flagged['id']}?current_user_id=dup_copier", json={"is_public": True, "title": "Renamed Copy"})
+    duplicates = client.get(f"/api/poems/{source['id']}/duplicates").json()["duplicates"]
+    assert [match["title"] for match in duplicates] == ["Renamed Copy"]
+    client.delete(f"/api/poems/{flagged['id']}?current_user_id=dup_copier")
+    assert client.get(f"/api/poems/{source['id']}/duplicates").json()["duplicates"] == []
+    assert client.get("/api/poems/missing/duplicates").status_code == 404
+
+def test_prosody_analysis_and_detected_form():
+    """Test that prosody is computed at write time and served in batches"""
+    haiku = "An old silent pond\nA frog jumps into the pond\nSplash! Silence again"
+    poem = client.post("/api/poems", json={
+        "title": "Old Pond",
+        "content": haiku,
+        "form": "free-verse",
+        "author_id": "prosody_author",
+        "author_name": "Prosody Author",
+        "is_public": True
+    }).json()
+    
+    # The detected form is stored next to the user's own label
+    stored = client.get(f"/api/poems/{poem['id']}").json()
+    assert stored["form"] == "free-verse"
+    assert stored["detected_form"] == "haiku"
+    ids = [p["id"] for p in client.get("/api/poems/explore?detected_form=haiku&fields=detected_form").json()]
+    assert poem["id"] in ids
+    assert poem["id"] not in [p["id"] for p in client.get("/api/poems/explore?detected_form=sonnet").json()]
+    
+    response = client.post("/api/analysis/prosody", json={
+        "texts": ["The night is bright\nThe stars alight\nThe moon in flight"],
+        "poem_ids": [poem["id"], "missing"]
+    })
+    assert response.status_code == 200
+    text, stored_poem, missing = response.json()["results"]
+    assert text["rhyme_scheme"] == "AAA"
+    assert [line["syllables"] for line in stored_poem["lines"]] == [5, 7, 5]
+    assert stored_poem["poem_id"] == poem["id"] and stored_poem["detected_form"] == "haiku"
+    assert missing["error"] == "Poem not found"
+    
+    # Analysing the same text again is served from the cache
+    before = client.get("/api/stats/prosody").json()
+    client.post("/api/analysis/prosody", json={"texts": ["Still water\nwill matter"] * 2})
+    after = client.get("/api/stats/prosody").json()
+    assert after["hits"] - before["hits"] >= 1 and 0 < after["hit_rate"] <= 1
+    
+    assert client.post("/api/analysis/prosody", json={}).status_code == 400
+    assert client.post("/api/analysis/prosody", json={"texts": ["x"] * 51}).status_code == 400
+
+def test_faceted_explore_and_counts():
+    """Test facet counts and filtered explore pages, kept current by create, update and delete"""
+    author_id = "facet_author"
+    tone = f"facet-test-{uuid.uuid4().hex[:8]}"
+    created = {}
+    for name, form, is_public in (("a", "ghazal", True), ("b", "haiku", True), ("c", "ghazal", False)):
+        created[name] = client.post("/api/poems", json={
+            "title": f"Facet {name}",
+            "content": f"Facet poem {name} {tone}",
+            "form": form,
+            "tone": tone,
+            "author_id": author_id,
+            "author_name": "Facet Author",
+            "is_public": is_public
+        }).json()["id"]
+    
+    counts = client.get(f"/api/poems/facets?tone={tone}").json()
+    assert counts["total"] == 2
+    assert counts["facets"]["form"]["ghazal"] == 1 and counts["facets"]["form"]["haiku"] == 1
+    assert counts["facets"]["form"]["sonnet"] == 0
+    # A facet's counts ignore its own filter
+    assert counts["facets"]["visibility"] == {"public": 2, "private": 1}
+    narrowed = client.get(f"/api/poems/facets?tone={tone}&form=ghazal").json()
+    assert narrowed["total"] == 1 and narrowed["facets"]["form"]["haiku"] == 1
+    assert client.get(f"/api/poems/facets?tone={tone}&visibility=public,private").json()["total"] == 3
+    
+    response = client.get(f"/api/poems/explore?tone={tone}")
+    assert [poem["id"] for poem in response.json()] == [created["b"], created["a"]]
+    assert response.headers["x-total-count"] == "2"
+    assert [poem["id"] for poem in client.get(f"/api/poems/explore?tone={tone}&form=ghazal&view=summary").json()] == [created["a"]]
+    either = [poem["id"] for poem in client.get(f"/api/poems/explore?tone={tone}&form=sonnet&match=any&limit=100").json()]
+    assert created["a"] in either and created["b"] in either and created["c"] not in either
+    assert {poem["id"] for poem in client.get(f"/api/poems/explore?sort=trending&tone={tone}").json()} == {created["a"], created["b"]}
+    
+    client.put(f"/api/poems/{created['a']}?current_user_id={author_id}", json={"is_public": False})
+    client.delete(f"/api/poems/{created['b']}?current_user_id={author_id}")
+    assert client.get(f"/api/poems/explore?tone={tone}").json() == []
+    assert client.get(f"/api/poems/facets?tone={tone}").json()["facets"]["visibility"] == {"public": 0, "private": 2}
+    
+    # The legacy endpoint publishes poem.created too
+    legacy_id = str(uuid.uuid4())
+    client.post("/poems", json={
+        "id": legacy_id, "title": "Facet legacy", "content": f"Legacy facet poem {tone}",
+        "form": "haiku", "tone": tone, "author_id": author_id, "author_name": "Facet Author",
+        "is_public": True, "created_at": datetime.utcnow().isoformat(), "updated_at": datetime.utcnow().isoformat()
+    })
+    assert [poem["id"] for poem in client.get(f"/api/poems/explore?tone={tone}").json()] == [legacy_id]
+    
+    assert client.get("/api/poems/facets?match=some").status_code == 400
+    assert client.get("/api/poems/facets?visibility=hidden").status_code == 400
+    assert client.get("/api/poems/explore?form=haiku&detected_form=haiku").status_code == 400
+
+def test_online_backup_and_restore():
+    """Test admin snapshots of rollback-journal databases and that each restores to its own point in time"""
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    import main
+    from backups import BackupManager
+    saved = main.ADMIN_TOKEN, main.backup_manager
+    admin = {"X-Admin-Token": "test-admin-token"}
+    directory = tempfile.mkdtemp()
+    main.ADMIN_TOKEN = "test-admin-token"
+    main.backup_manager = BackupManager(
+        {f"db-{shard_id}": os.path.abspath(shard_engine.url.database) for shard_id, shard_engine in main.shard_engines.items()},
+        os.path.join(directory, "snapshots"),
+    )
+    try:
+        assert client.post("/api/admin/backups").status_code == 403
+        full = client.post("/api/admin/backups?kind=full", headers=admin).json()["snapshots"]
+        assert all(snapshot["kind"] == "full" for snapshot in full)
+        
+        poem = client.post("/api/poems", json={
+            "title": "After the Backup",
+            "content": "Written once the snapshot was taken",
+            "author_id": "backup_author",
+            "author_name": "Backup Author",
+            "is_public": True
+        }).json()
+        # Without WAL mode there are no frames to ship, so auto takes a base copy
+        incremental = client.post("/api/admin/backups", headers=admin).json()["snapshots"]
+        assert all(snapshot["kind"] == "full" and "WAL" in snapshot["reason"] for snapshot in incremental)
+        assert client.post("/api/admin/backups?kind=weekly", headers=admin).status_code == 400
+        
+        report = client.get("/api/admin/backups", headers=admin).json()
+        assert all(source["snapshots"] == 2 for source in report["sources"].values())
+        assert "during_backup" in report["latency"]
+        
+        def poem_restored(source: str, snapshot_id: str) -> bool:
+            path = os.path.join(directory, f"{source}-{snapshot_id}.db")
+            main.backup_manager.restore(source, path, snapshot_id)
+            conn = sqlite3.connect(path)
+            try:
+                return conn.execute("SELECT count(*) FROM poems WHERE id = ?", (poem["id"],)).fetchone()[0] == 1
+            finally:
+                conn.close()
+        
+        assert not any(poem_restored(snapshot["source"], snapshot["id"]) for snapshot in full)
+        assert any(poem_restored(snapshot["source"], snapshot["id"]) for snapshot in incremental)
+    finally:
+        main.backup_manager.close()
+        main.ADMIN_TOKEN, main.backup_manager = saved
+        shutil.rmtree(directory)
+
+def test_sharded_storage_routes_by_author():
+    """Test that sharded sessions keep a poem and its PRs together and merge feeds"""
+    import tempfile
+    from datetime import timedelta
+    from sharding import ShardMap, sharded_sessionmaker, fetch_ordered
+    
+    shard_map = ShardMap.create(["poems-0.db", "poems-1.db", "poems-2.db"], buckets=16)
+    shard_map.save(f"{tempfile.mkdtemp()}/shardmap.json")
+    engines = shard_map.engines()
+    for shard_engine in engines.values():
+        Base.metadata.create_all(bind=shard_engine)
+    db = sharded_sessionmaker(shard_map, engines, PoemModel, PullRequestModel, expire_on_commit=False)()
+    
+    started = datetime.utcnow()
+    authors = [f"shard_author_{i}" for i in range(8)]
+    for i, author in enumerate(authors):
+        poem = PoemModel(
+            id=str(uuid.uuid4()), title=f"Poem {i}", content="Line", author_id=author,
+            author_name=author, is_public=True, created_at=started + timedelta(seconds=i),
+            updated_at=started
+        )
+        db.add(poem)
+        db.add(PullRequestModel(
+            id=str(uuid.uuid4()), poem_id=poem.id, original_content="Line",
+            proposed_content="Line, edited", author_id="shard_contributor",
+            author_name="Contributor", created_at=started
+        ))
+    db.commit()
+    
+    # Each poem and its PR sit on the author's shard
+    for author in authors:
+        shard_id = shard_map.shard_for_author(author)
+        with engines[shard_id].connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM poems WHERE author_id = :a"), {"a": author}).scalar() == 1
+            assert conn.execute(text(
+                "SELECT count(*) FROM pull_requests JOIN poems ON poems.id = pull_requests.poem_id WHERE poems.author_id = :a"
+            ), {"a": author}).scalar() == 1
+    
+    # Fanned-out reads: k-way merged lists and summed counts
+    feed = fetch_ordered(db.query(PoemModel).order_by(PoemModel.created_at.desc()), PoemModel.created_at)
+    assert [poem.title for poem in feed] == [f"Poem {i}" for i in reversed(range(8))]
+    assert db.query(PullRequestModel).filter(PullRequestModel.author_id == "shard_contributor").count() == 8
+    db.close()
+
+def test_change_events_over_websocket():
+    """Test that writes are pushed to topic subscribers and can be resumed"""
+    with client.websocket_connect("/api/events/ws?topics=explore") as ws:
+        poem_id = client.post("/api/poems", json={
+            "title": "Live Poem",
+            "content": "Pushed, not polled",
+            "author_id": "live_author",
+            "author_name": "Live Author",
+            "is_public": True
+        }).json()["id"]
+        created = ws.receive_json()
+        assert created["type"] == "poem.created"
+        assert created["data"]["id"] == poem_id
+        
+        # Going private is still announced on explore, so feeds can drop it
+        client.put(f"/api/poems/{poem_id}?current_user_id=live_author", json={"is_public": False})
+        updated = ws.receive_json()
+        assert updated["type"] == "poem.updated"
+        assert updated["data"]["is_public"] is False
+    
+    # Reconnecting with the last seen id replays what was missed
+    with client.websocket_connect(f"/api/events/ws?topics=explore&last_event_id={created['id']}") as ws:
+        assert ws.receive_json()["id"] == updated["id"]
+    
+    # An id older than the history asks the client to re-fetch
+    with client.websocket_connect("/api/events/ws?topics=explore&last_event_id=1") as ws:
+        assert ws.receive_json()["type"] == "reset"
+
+def test_slow_event_subscriber_is_dropped():
+    """Test that a subscriber whose buffer fills up is cut off"""
+    import asyncio
+    from events import EventBus, SlowConsumer
+    
+    async def scenario():
+        bus = EventBus(history=16, max_buffer=2)
+        subscription = bus.subscribe({"explore"})
+        for i in range(3):
+            bus.publish("poem.created", {"explore"}, {"n": i})
+        bus.publish("poem.created", {"poem:other"}, {})  # not subscribed
+        await asyncio.sleep(0)
+        try:
+            await subscription.next()
+        except SlowConsumer:
+            return bus.stats()
+        raise AssertionError("Slow subscriber was not dropped")
+    
+    stats = asyncio.run(scenario())
+    assert stats["dropped_subscribers"] == 1
+    assert stats["published"] == 4
+
+def test_generation_priority_and_fairness_key():
+    """Test that priority is limited by profile and requests queue under the poem's author"""
+    import main
+    from fastapi import HTTPException
+    from starlette.requests import Request
+    from main import PoemRequest, prepare_generation
+    
+    poem = client.post("/api/poems", json={
+        "title": "Queued Verse",
+        "content": "Waiting for its picture",
+        "author_id": "queue_author",
+        "author_name": "Queue Author",
+        "is_public": True
+    }).json()
+    first = Request({"type": "http", "client": ("203.0.113.7", 5000), "headers": []})
+    second = Request({"type": "http", "client": ("198.51.100.2", 5000), "headers": []})
+    sessions = override_get_db()
+    db = next(sessions)
+    saved = main.image_generator
+    main.image_generator = object()
+    try:
+        _, priority, user, _ = prepare_generation(PoemRequest(title="T", content="C", profile="preview"), first, db)
+        assert (priority, user) == ("interactive", "203.0.113.7")
+        # The same author from two addresses is one user to the queue
+        keys = {
+            prepare_generation(PoemRequest(title="T", content="C", poem_id=poem["id"]), request, db)[2]
+            for request in (first, second)
+        }
+        assert keys == {"author:queue_author"}
+        # A client-chosen user_id or an unknown poem falls back to the address
+        _, _, user, _ = prepare_generation(PoemRequest.model_validate({"title": "T", "content": "C", "user_id": "someone-else"}), first, db)
+        assert user == "203.0.113.7"
+        _, _, user, _ = prepare_generation(PoemRequest(title="T", content="C", poem_id="no-such-poem"), second, db)
+        assert user == "198.51.100.2"
+        _, priority, _, _ = prepare_generation(PoemRequest(title="T", content="C", profile="high"), first, db)
+        assert priority == "batch"
+        try:
+            prepare_generation(PoemRequest(title="T", content="C", profile="high", priority="interactive"), first, db)
+            raise AssertionError("Interactive priority was allowed for the high profile")
+        except HTTPException as e:
+            assert e.status_code == 400
+    finally:
+        main.image_generator = saved
+        sessions.close()
+
+def test_write_coalescer_batches_retries_and_withdraws():
+    """Test group commit batching, per-row retry of a failed batch and withdrawal on timeout"""
+    import threading
+    from write_coalescer import WriteCoalescer, WriteTimeout
+    
+    entered, gate = threading.Event(), threading.Event()
+    commits = []
+    
+    class RecordingSession:
+        def add_all(self, objects):
+            self.objects = list(objects)
+        def commit(self):
+            entered.set()
+            gate.wait()
+            if "bad" in self.objects:
+                raise ValueError("bad row")
+            commits.append(self.objects)
+        def rollback(self):
+            pass
+        def close(self):
+            pass
+    
+    coalescer = WriteCoalescer(RecordingSession, window_ms=0)
+    try:
+        first = coalescer.submit("first")
+        entered.wait(5)
+        # Queued while the writer is busy, so they share the next commit
+        queued = [coalescer.submit(row) for row in ("a", "bad", "b")]
+        try:
+            coalescer.add("late", timeout=0.01)
+            raise AssertionError("add did not time out")
+        except WriteTimeout:
+            pass
+        gate.set()
+        assert first.result(5) == "first"
+        assert queued[0].result(5) == "a" and queued[2].result(5) == "b"
+        assert isinstance(queued[1].exception(5), ValueError)
+    finally:
+        gate.set()
+        coalescer.close()
+    # The failed batch of three was retried row by row; the withdrawn row was never written
+    assert commits == [["first"], ["a"], ["b"]]
+    stats = coalescer.stats()
+    assert (stats["writes"], stats["failed"], stats["withdrawn"]) == (3, 1, 1)
+
+def test_inference_supervisor_fails_and_restarts_dead_workers():
+    """Test that a dead or silent worker fails the request it held at once and is restarted later"""
+    import queue
+    import threading
+    import time
+    import inference_workers
+    from inference_workers import InferenceSupervisor
+    
+    class FakeProcess:
+        def __init__(self):
+            self.alive = True
+            self.pid = 4242
+            self.sentinel = None
+        def is_alive(self):
+            return self.alive
+        def kill(self):
+            self.alive = False
+        def join(self, timeout=None):
+            pass
+    
+    supervisor = InferenceSupervisor(2)
+    spawned = []
+    def spawn(slot):
+        slot.process, slot.tasks = FakeProcess(), queue.Queue()
+        slot.ready, slot.current_task, slot.restart_at = True, None, None
+        slot.last_seen = time.monotonic()
+        spawned.append(slot.index)
+    supervisor.spawn = spawn
+    for slot in supervisor.slots:
+        supervisor.spawn(slot)
+    
+    # Requests go to idle workers only; the third waits in the backlog
+    results = {}
+    def submit(task_id):
+        results[task_id] = supervisor.submit({"id": task_id}, timeout=5)
+    callers = [threading.Thread(target=submit, args=(task_id,)) for task_id in ("a", "b", "c")]
+    for caller in callers:
+        caller.start()
+        time.sleep(0.05)
+    held = {slot.current_task: slot for slot in supervisor.slots}
+    assert set(held) == {"a", "b"} and [request["id"] for request in supervisor.backlog] == ["c"]
+    
+    # A crash fails the request it held, even one the worker never reported starting
+    now = time.monotonic()
+    crashed = held["a"]
+    crashed.process.alive = False
+    assert supervisor.diagnose(crashed, now) == "exited"
+    supervisor.retire(crashed, "exited")
+    callers[0].join(1)
+    assert results["a"]["ok"] is False and "exited" in results["a"]["detail"]
+    assert crashed.restart_at is not None and crashed.restarts == 1
+    
+    # A worker without heartbeats is wedged well before the generation timeout
+    silent = held["b"]
+    assert supervisor.diagnose(silent, now + inference_workers.WEDGE_TIMEOUT + 1) is not None
+    assert inference_workers.WEDGE_TIMEOUT < inference_workers.GENERATION_TIMEOUT
+    silent.last_seen = now + inference_workers.GENERATION_TIMEOUT
+    assert "did not finish" in supervisor.diagnose(silent, now + inference_workers.GENERATION_TIMEOUT + 1)
+    
+    # The restart is scheduled rather than slept through; the queued request then runs
+    crashed.restart_at = time.monotonic()
+    spawn(crashed)
+    with supervisor.lock:
+        supervisor.dispatch()
+    assert crashed.current_task == "c"
+    supervisor.resolve("c", {"ok": True, "id": "c"})
+    supervisor.resolve("b", {"ok": True, "id": "b"})
+    for caller in callers:
+        caller.join(1)
+    assert results["c"]["ok"] and results["b"]["ok"]
+    assert spawned == [0, 1, crashed.index]
+
+def test_generation_profile_selection():
+    """Test that each named profile drives the pipeline with its own settings"""
+    import torch
+    import main
+    import imagegen
+    from imagegen import ImageGenerator, PROFILES, CPU_THREADS, BATCH_THREADS
+    
+    pipe = StubPipeline()
+    generator = stub_generator(pipe)
+    threads = torch.get_num_threads()
+    for name in ("preview", "standard", "high"):
+        generator.generate("A poem", PROFILES[name], seed=1)
+    preview, standard, high = pipe.calls
+    assert torch.get_num_threads() == threads
+    assert (preview["num_threads"], standard["num_threads"], high["num_threads"]) == (CPU_THREADS, BATCH_THREADS, BATCH_THREADS)
+    assert (preview["height"], preview["num_inference_steps"], preview["attention_slicing"]) == (384, 8, True)
+    assert preview["scheduler"] == standard["scheduler"] == "DPMSolverMultistepScheduler"
+    assert (standard["height"], standard["num_inference_steps"], standard["attention_slicing"]) == (512, 20, False)
+    assert (high["scheduler"], high["num_inference_steps"], high["guidance_scale"]) == ("PNDMScheduler", 50, 7.5)
+    # Each profile takes the first of its dtypes the device runs natively
+    saved_flags = imagegen.cpu_flags
+    try:
+        imagegen.cpu_flags = lambda: frozenset({"avx2"})
+        assert {generator.resolve_dtype(profile) for profile in PROFILES.values()} == {torch.float32}
+        imagegen.cpu_flags = lambda: frozenset({"avx2", "amx_bf16"})
+        assert generator.resolve_dtype(PROFILES["preview"]) == generator.resolve_dtype(PROFILES["standard"]) == torch.bfloat16
+        assert generator.resolve_dtype(PROFILES["high"]) == torch.float32
+    finally:
+        imagegen.cpu_flags = saved_flags
+    assert ImageGenerator("stub", device="cuda").resolve_dtype(PROFILES["high"]) == torch.float16
+    
+    listed = client.get("/generate-image/profiles").json()
+    assert listed["default"] == "standard"
+    assert [profile["name"] for profile in listed["profiles"]] == ["preview", "standard", "high"]
+    
+    saved = main.image_generator
+    main.image_generator = generator
+    try:
+        assert client.post("/generate-image", json={"title": "T", "content": "C", "profile": "ultra"}).status_code == 400
+        response = client.post("/generate-image", json={"title": "T", "content": "C", "profile": "preview", "seed": 3})
+        assert response.status_code == 200
+        assert response.json()["profile"] == "preview" and response.json()["settings"]["height"] == 384
+        assert client.post("/generate-image", json={"title": "T", "content": "C"}).json()["profile"] == "standard"
+    finally:
+        main.image_generator = saved
+
+def test_prompt_embedding_cache_lru():
+    """Test that prompt encodings are reused across seeds and profiles and evicted least recently used first"""
+    import torch
+    from imagegen import PromptEmbeddingCache, PROFILES
+    
+    entry = torch.zeros(1, 77, 8)
+    size = entry.element_size() * entry.nelement()
+    cache = PromptEmbeddingCache(max_bytes=2 * size)
+    cache.put("a", entry)
+    cache.put("b", entry)
+    assert cache.get("a") is entry  # "a" is now the most recently used
+    cache.put("c", entry)
+    assert cache.get("b") is None and cache.get("a") is entry and cache.get("c") is entry
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 2 * size, 1)
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (3, 1, 0.75)
+    cache.put("huge", torch.zeros(3, 77, 8))
+    assert cache.get("huge") is None
+    
+    # Regenerating with another seed or profile skips the text encoder
+    pipe = StubPipeline()
+    generator = stub_generator(pipe)
+    generator.generate("A poem about rain", PROFILES["standard"], seed=1)
+    generator.generate("A poem about rain", PROFILES["standard"], seed=2)
+    generator.generate("A poem about rain", PROFILES["preview"], seed=3)
+    assert pipe.text_encoder.calls == 1
+    generator.generate("A poem about snow", PROFILES["standard"], seed=1)
+    assert pipe.text_encoder.calls == 2
+    assert generator.stats()["prompt_cache"]["hits"] == 2
+
+def test_inference_scheduler_fairness_and_admission():
+    """Test round-robin order across users, priority classes, queue limits with Retry-After, and cancellation"""
+    import asyncio
+    import main
+    from scheduler import InferenceScheduler, QueueFull, ClientDisconnected
+    
+    async def scenario():
+        scheduler = InferenceScheduler(concurrency=1, max_queue=8, max_per_user=3)
+        assert scheduler.admit("holder", "batch").future.done()
+        
+        # A burst from one user does not starve the others; interactive goes first
+        requests = [("a", "batch"), ("a", "batch"), ("a", "batch"), ("b", "batch"), ("b", "batch"), ("c", "batch"), ("d", "interactive")]
+        tickets = [scheduler.admit(user, priority) for user, priority in requests]
+        try:
+            scheduler.admit("a", "batch")
+            raise AssertionError("A fourth request from one user was admitted")
+        except QueueFull as e:
+            assert e.retry_after >= 1
+        order = []
+        for _ in tickets:
+            scheduler.release(0.1)
+            granted = [ticket for ticket in tickets if ticket.future.done() and ticket not in order]
+            assert len(granted) == 1
+            order.extend(granted)
+        assert [ticket.user for ticket in order] == ["d", "a", "b", "c", "a", "b", "a"]
+        
+        # A queued request whose client goes away is dropped before it runs
+        waiting = scheduler.admit("e", "batch")
+        ran = []
+        async def gone():
+            return True
+        try:
+            await scheduler.execute(waiting, lambda: ran.append(True), is_disconnected=gone)
+            raise AssertionError("A disconnected request ran")
+        except ClientDisconnected:
+            pass
+        assert not ran and scheduler.stats()["queued"] == 0 and scheduler.stats()["cancelled"] == 1
+        scheduler.release(0.1)
+        assert scheduler.stats()["running"] == 0
+    
+    asyncio.run(scenario())
+    
+    saved = main.inference_scheduler, main.image_generator
+    main.inference_scheduler = InferenceScheduler(max_queue=0)
+    main.image_generator = stub_generator(StubPipeline())
+    try:
+        for route in ("/generate-image", "/generate-image/stream"):
+            response = client.post(route, json={"title": "T", "content": "C"})
+            assert response.status_code == 429
+            assert int(response.headers["retry-after"]) >= 1
+    finally:
+        main.inference_scheduler, main.image_generator = saved
+
+def test_streamed_generation_previews():
+    """Test that the streaming route sends queued, throttled previews and then the result"""
+    import base64
+    import io
+    import json
+    import main
+    from PIL import Image
+    
+    saved = main.image_generator
+    main.image_generator = stub_generator(StubPipeline())
+    try:
+        with client.stream("POST", "/generate-image/stream", json={"title": "T", "content": "C", "profile": "preview", "seed": 5}) as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = "".join(response.iter_text())
+    finally:
+        main.image_generator = saved
+    
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "queued" and kinds[-1] == "result"
+    assert events[0][1] == {"profile": "preview", "priority": "interactive"}
+    
+    # Steps run faster than PREVIEW_MIN_INTERVAL here, so only the first preview is sent
+    previews = [data for kind, data in events if kind == "preview"]
+    assert len(previews) == 1 and previews[0]["total"] == 8 and previews[0]["step"] < 8
+    preview = Image.open(io.BytesIO(base64.b64decode(previews[0]["image"])))
+    assert preview.format == "JPEG" and max(preview.size) == 128
+    assert events[-1][1]["profile"] == "preview" and events[-1][1]["image"]
+
+def test_variant_seeds_and_out_of_memory_halving():
+    """Test variant seed selection and that a batch running out of memory is halved and retried"""
+    import main
+    from fastapi import HTTPException
+    from imagegen import PROFILES
+    from main import PoemRequest, variant_seeds
+    
+    def seeds(**fields):
+        return variant_seeds(PoemRequest(title="T", content="C", **fields))
+    
+    assert seeds() is None
+    assert seeds(num_variants=3, seed=10) == [10, 11, 12]
+    assert seeds(seeds=[7, 3]) == [7, 3]
+    assert len(seeds(num_variants=4)) == 4
+    for invalid in ({"num_variants": 9}, {"num_variants": 0}, {"num_variants": 2, "seeds": [1]}, {"seeds": [-1]}):
+        try:
+            seeds(**invalid)
+            raise AssertionError(f"{invalid} was accepted")
+        except HTTPException as e:
+            assert e.status_code == 400
+    
+    # Four fit by the memory estimate, but the pipeline runs out above two
+    pipe = StubPipeline(max_images=2)
+    generator = stub_generator(pipe)
+    generator.max_batch = lambda profile: 4
+    result = generator.generate_variants("A poem", PROFILES["preview"], [1, 2, 3, 4, 5])
+    assert result["batches"] == [2, 2, 1] and result["seeds"] == [1, 2, 3, 4, 5]
+    assert [call["seeds"] for call in pipe.calls] == [[1, 2, 3, 4], [1, 2], [3, 4], [5]]
+    assert [image.getpixel((0, 0))[0] for image in result["images"]] == [1, 2, 3, 4, 5]
+    assert pipe.text_encoder.calls == 1
+    
+    # Other failures are not retried
+    pipe.calls.clear()
+    pipe.error = RuntimeError("scheduler exploded")
+    try:
+        generator.generate_variants("A poem", PROFILES["preview"], [1, 2])
+        raise AssertionError("A failing pipeline call did not raise")
+    except RuntimeError as e:
+        assert "exploded" in str(e) and len(pipe.calls) == 1
+    
+    saved = main.image_generator
+    main.image_generator = stub_generator(StubPipeline())
+    try:
+        response = client.post("/generate-image", json={"title": "T", "content": "C", "num_variants": 3, "seed": 10})
+        assert response.status_code == 200
+        assert [variant["seed"] for variant in response.json()["variants"]] == [10, 11, 12]
+    finally:
+        main.image_generator = saved
+
+def test_sharded_endpoints_merge_across_shards():
+    """Test explore order, counts and pull request lookups through the API over two shard files"""
+    import tempfile
+    from datetime import timedelta
+    from sharding import ShardMap, sharded_sessionmaker
+    
+    shard_map = ShardMap.create(["poems-0.db", "poems-1.db"], buckets=8)
+    shard_map.save(f"{tempfile.mkdtemp()}/shardmap.json")
+    engines = shard_map.engines()
+    for shard_engine in engines.values():
+        Base.metadata.create_all(bind=shard_engine)
+    ShardedSession = sharded_sessionmaker(shard_map, engines, PoemModel, PullRequestModel, expire_on_commit=False)
+    
+    started = datetime.utcnow()
+    authors = [f"sharded_api_author_{i}" for i in range(6)]
+    assert {shard_map.shard_for_author(author) for author in authors} == set(engines)
+    db = ShardedSession()
+    poems, prs = [], []
+    for i, author in enumerate(authors):
+        poem = PoemModel(
+            id=str(uuid.uuid4()), title=f"Sharded {i}", content="Line", author_id=author, author_name=author,
+            is_public=i != 5, created_at=started + timedelta(seconds=i), updated_at=started
+        )
+        pr = PullRequestModel(
+            id=str(uuid.uuid4()), poem_id=poem.id, original_content="Line", proposed_content="Line, edited",
+            author_id="sharded_api_contributor", author_name="Contributor", created_at=started + timedelta(seconds=10 - i)
+        )
+        db.add_all([poem, pr])
+        poems.append(poem)
+        prs.append(pr)
+    db.commit()
+    db.close()
+    
+    def sharded_db():
+        session = ShardedSession()
+        try:
+            yield session
+        finally:
+            session.close()
+    
+    app.dependency_overrides[get_db] = sharded_db
+    try:
+        # Newest first, k-way merged from both shards; the private poem is left out
+        explore = client.get("/api/poems/explore").json()
+        assert [poem["title"] for poem in explore] == [f"Sharded {i}" for i in (4, 3, 2, 1, 0)]
+        summary = client.get("/api/poems/explore?fields=title,created_at").json()
+        assert [poem["title"] for poem in summary] == [poem["title"] for poem in explore]
+        
+        # Counts add up the per-shard counts
+        stats = client.get("/api/stats/poems/sharded_api_contributor").json()
+        assert stats["pull_requests_created"] == 6
+        assert client.get(f"/api/stats/poems/{authors[5]}").json() == {
+            "total_poems": 1, "public_poems": 0, "pull_requests_received": 1,
+            "pending_reviews": 1, "pull_requests_created": 0,
+        }
+        
+        listed = client.get("/api/pull-requests?pr_author_id=sharded_api_contributor").json()
+        assert [pr["id"] for pr in listed] == [pr.id for pr in prs]
+        # Single PRs and poems are found on whichever shard holds them
+        for poem, pr in zip(poems, prs):
+            response = client.get(f"/api/pull-requests/{pr.id}")
+            assert response.status_code == 200 and response.json()["poem_title"] == poem.title
+            assert client.get(f"/api/poems/{poem.id}").json()["author_id"] == poem.author_id
+        received = client.get(f"/api/pull-requests?poem_author_id={authors[2]}").json()
+        assert [pr["id"] for pr in received] == [prs[2].id]
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+    
+    for shard_id, shard_engine in engines.items():
+        with shard_engine.connect() as conn:
+            stored = conn.execute(text("SELECT author_id FROM poems")).scalars().all()
+        assert stored and all(shard_map.shard_for_author(author) == shard_id for author in stored)
+
+def test_inference_client_resends_only_unsent_requests():
+    """Test that the client retries a stale connection but never resends a request the pool received"""
+    import socket
+    import tempfile
+    import threading
+    import time
+    from inference_workers import InferenceClient, recv_message, send_message
+    
+    socket_path = f"{tempfile.mkdtemp()}/pool.sock"
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    received = []
+    
+    def serve():
+        connections = 0
+        while True:
+            conn, _ = listener.accept()
+            connections += 1
+            try:
+                while True:
+                    message = recv_message(conn)
+                    if message is None:
+                        break
+                    received.append((connections, message.get("id", message["op"])))
+                    if message.get("id") == "dropped":
+                        break  # the pool dies mid-request
+                    if message.get("id") == "previewed":
+                        send_message(conn, {"preview": {"step": 1}})
+                    send_message(conn, {"ok": True, "id": message.get("id")})
+                    if message["op"] == "health":
+                        break  # the pool restarts between calls
+            except OSError:
+                pass  # the client hung up
+            conn.close()
+    threading.Thread(target=serve, daemon=True).start()
+    
+    client = InferenceClient(socket_path, timeout=5)
+    assert client._call({"op": "health"})["ok"]
+    time.sleep(0.1)
+    # The connection went stale while idle, so the send fails and is retried on a new one
+    assert client._call({"op": "generate", "id": "first"})["id"] == "first"
+    
+    # Once written, a request is not resent however the call fails
+    try:
+        client._call({"op": "generate", "id": "dropped"})
+        assert False, "a dropped connection should raise"
+    except ConnectionError:
+        pass
+    def failing_preview(preview):
+        raise OSError("the browser went away")
+    try:
+        client._call({"op": "generate", "id": "previewed"}, on_preview=failing_preview)
+        assert False, "the preview callback's error should surface"
+    except OSError:
+        pass
+    time.sleep(0.1)
+    assert received == [(1, "health"), (2, "first"), (2, "dropped"), (3, "previewed")]
+    listener.close()
+
+def test_inference_pool_frees_images_nobody_reads():
+    """Test that the pool unlinks a result's shared memory when the API worker is gone, and rejects reused ids"""
+    import queue
+    import socket
+    import tempfile
+    import threading
+    import time
+    import numpy as np
+    from multiprocessing import shared_memory
+    from inference_workers import InferenceSupervisor, export_image, send_message
+    
+    supervisor = InferenceSupervisor(1)
+    slot = supervisor.slots[0]
+    slot.process, slot.tasks, slot.ready = None, queue.Queue(), True
+    socket_path = f"{tempfile.mkdtemp()}/pool.sock"
+    server = supervisor.make_server(socket_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    def running(task_id):
+        for _ in range(100):
+            with supervisor.lock:
+                if slot.current_task == task_id:
+                    return True
+            time.sleep(0.01)
+        return False
+    
+    # The API worker sends a request and disconnects while it runs
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    send_message(sock, {"op": "generate", "id": "abandoned", "timeout": 5})
+    assert running("abandoned")
+    assert supervisor.submit({"id": "abandoned"}, timeout=1)["ok"] is False
+    sock.close()
+    
+    handle = export_image(np.zeros((4, 4, 3), dtype=np.float32))
+    slot.current_task = None
+    supervisor.resolve("abandoned", {"ok": True, "id": "abandoned", "image": handle})
+    for _ in range(100):
+        try:
+            shared_memory.SharedMemory(name=handle["shm"]).close()
+        except FileNotFoundError:
+            break
+        time.sleep(0.01)
+    else:
+        assert False, "the undelivered image was left in shared memory"
+    assert "abandoned" not in supervisor.pending
+    server.shutdown()
+    server.server_close()
+
+def test_wal_increments_restore_each_point_in_time():
+    """Test that increments ship only WAL frames, restore by id or time, and a restarted WAL forces a base"""
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    from backups import BackupManager
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "poems.db")
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("PRAGMA journal_mode=WAL")
+    writer.execute("PRAGMA wal_autocheckpoint=0")
+    writer.execute("CREATE TABLE lines (id INTEGER PRIMARY KEY, text TEXT)")
+    for i in range(300):
+        writer.execute("INSERT INTO lines (text) VALUES (?)", ("verse " * 40,))
+    manager = BackupManager({"poems": path}, os.path.join(directory, "snapshots"), full_every=3)
+    
+    def count(database: str) -> int:
+        conn = sqlite3.connect(database)
+        try:
+            return conn.execute("SELECT count(*) FROM lines").fetchone()[0]
+        finally:
+            conn.close()
+    
+    try:
+        taken = []
+        for round in range(5):
+            taken.append((manager.snapshot("poems"), count(path)))
+            for i in range(20):
+                writer.execute("INSERT INTO lines (text) VALUES (?)", ("refrain",))
+            if round == 1:
+                # Shrinking the file must come back too
+                writer.execute("DELETE FROM lines WHERE id % 2 = 0")
+                writer.execute("VACUUM")
+        assert [snapshot["kind"] for snapshot, _ in taken] == ["full", "incremental", "incremental", "full", "incremental"]
+        full, increment = taken[0][0], taken[1][0]
+        assert increment["wal_frames"] == 20 and increment["changed_pages"] < full["changed_pages"]
+        
+        # An outside checkpoint cannot restart the WAL under the manager
+        writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        writer.execute("INSERT INTO lines (text) VALUES ('coda')")
+        taken.append((manager.snapshot("poems"), count(path)))
+        assert taken[-1][0]["kind"] == "incremental"
+        for snapshot, expected in taken:
+            restored = os.path.join(directory, f"{snapshot['id']}.db")
+            manager.restore("poems", restored, snapshot["id"])
+            assert count(restored) == expected
+        restored = os.path.join(directory, "at.db")
+        assert manager.restore("poems", restored, at=taken[2][0]["captured_at"])["snapshot"] == taken[2][0]["id"]
+        assert count(restored) == taken[2][1]
+        
+        # Once nobody was holding it, the WAL may have lost frames: take a base
+        manager.close()
+        writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        writer.execute("INSERT INTO lines (text) VALUES ('encore')")
+        manager = BackupManager({"poems": path}, os.path.join(directory, "snapshots"), full_every=3)
+        snapshot = manager.snapshot("poems", "incremental")
+        assert snapshot["kind"] == "full" and "started over" in snapshot["reason"]
+        manager.restore("poems", restored, force=True)
+        assert count(restored) == count(path)
+    finally:
+        manager.close()
+        writer.close()
+        shutil.rmtree(directory)
+
+def test_edits_run_duplicate_detection():
+    """Test that new text and publishing a private poem are checked for duplicates like a new poem"""
+    import main
+    original = "\n".join([
+        "The orchard keeps a ledger of the frost",
+        "in bark and broken twigs along the wall",
+        "and every spring it pays the winter back",
+        "in blossoms no accountant ever saw",
+    ])
+    source = client.post("/api/poems", json={
+        "title": "Orchard",
+        "content": original,
+        "author_id": "edit_dup_original",
+        "author_name": "Original Author",
+        "is_public": True
+    }).json()
+    poem_id = client.post("/api/poems", json={
+        "title": "Draft",
+        "content": "Nothing like the orchard yet",
+        "author_id": "edit_dup_copier",
+        "author_name": "Copier",
+        "is_public": False
+    }).json()["id"]
+    edit = f"/api/poems/{poem_id}?current_user_id=edit_dup_copier"
+    
+    # Private text is not checked; publishing it is, and so is new public text
+    assert "possible_duplicate" not in client.put(edit, json={"content": original}).json()
+    published = client.put(edit, json={"is_public": True}).json()
+    assert published["possible_duplicate"]["poem_id"] == source["id"]
+    assert "possible_duplicate" not in client.put(edit, json={"title": "Still a Copy"}).json()
+    assert "possible_duplicate" not in client.put(edit, json={"content": "Entirely my own lines now"}).json()
+    assert client.put(edit, json={"content": original + "\n"}).json()["possible_duplicate"]["poem_id"] == source["id"]
+    
+    # Under the reject policy the edit is refused and the poem left as it was
+    client.put(edit, json={"content": "Entirely my own lines now", "is_public": False})
+    saved = main.DUPLICATE_POLICY
+    main.DUPLICATE_POLICY = "reject"
+    try:
+        assert client.put(edit, json={"content": original, "is_public": True}).status_code == 409
+        assert client.put(edit, json={"content": original}).status_code == 200
+        assert client.put(edit, json={"is_public": True}).status_code == 409
+        poem = client.get(f"/api/poems/{poem_id}").json()
+        assert poem["is_public"] is False
+        client.put(edit, json={"content": "Entirely my own lines now"})
+        assert client.put(edit, json={"is_public": True}).status_code == 200
+        assert client.put(edit, json={"content": original}).status_code == 409
+        assert client.get(f"/api/poems/{poem_id}").json()["content"] == "Entirely my own lines now"
+    finally:
+        main.DUPLICATE_POLICY = saved
+        client.delete(f"/api/poems/{poem_id}?current_user_id=edit_dup_copier")
+
 if __name__ == "__main__":
     print("Running tests...")
     
@@ -499,6 +1970,18 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"❌ Reject PR test failed: {e}")
     
+    try:
+        test_approving_stale_pull_request_conflicts()
+        print("✅ Stale PR approval test passed")
+    except Exception as e:
+        print(f"❌ Stale PR approval test failed: {e}")
+    
+    try:
+        test_metadata_edits_keep_pull_requests_approvable()
+        print("✅ Metadata edit PR approval test passed")
+    except Exception as e:
+        print(f"❌ Metadata edit PR approval test failed: {e}")
+    
     try:
         test_cannot_create_pr_for_own_poem()
         print("✅ Own poem PR prevention test passed")
@@ -529,11 +2012,157 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"❌ Duplicate PR prevention test failed: {e}")
     
+    try:
+        test_upgrade_closes_duplicate_pending_prs()
+        print("✅ Duplicate pending PR upgrade test passed")
+    except Exception as e:
+        print(f"❌ Duplicate pending PR upgrade test failed: {e}")
+    
     try:
         test_private_poem_pr_prevention()
         print("✅ Private poem PR prevention test passed")
     except Exception as e:
         print(f"❌ Private poem PR prevention test failed: {e}")
     
+    try:
+        test_concurrent_pull_request_creation_and_approval()
+        print("✅ Concurrent PR stress test passed")
+    except Exception as e:
+        print(f"❌ Concurrent PR stress test failed: {e}")
+    
+    try:
+        test_summary_views_and_sparse_fields()
+        print("✅ Summary view test passed")
+    except Exception as e:
+        print(f"❌ Summary view test failed: {e}")
+    
+    try:
+        test_trending_and_popular_explore()
+        print("✅ Trending/popular explore test passed")
+    except Exception as e:
+        print(f"❌ Trending/popular explore test failed: {e}")
+    
+    try:
+        test_request_profiling_and_slow_logs()
+        print("✅ Request profiling test passed")
+    except Exception as e:
+        print(f"❌ Request profiling test failed: {e}")
+    
+    try:
+        test_compressed_response_cache()
+        print("✅ Compressed response cache test passed")
+    except Exception as e:
+        print(f"❌ Compressed response cache test failed: {e}")
+    
+    try:
+        test_near_duplicate_detection()
+        print("✅ Near-duplicate detection test passed")
+    except Exception as e:
+        print(f"❌ Near-duplicate detection test failed: {e}")
+    
+    try:
+        test_prosody_analysis_and_detected_form()
+        print("✅ Prosody analysis test passed")
+    except Exception as e:
+        print(f"❌ Prosody analysis test failed: {e}")
+    
+    try:
+        test_faceted_explore_and_counts()
+        print("✅ Faceted explore test passed")
+    except Exception as e:
+        print(f"❌ Faceted explore test failed: {e}")
+    
+    try:
+        test_online_backup_and_restore()
+        print("✅ Online backup test passed")
+    except Exception as e:
+        print(f"❌ Online backup test failed: {e}")
+    
+    try:
+        test_sharded_storage_routes_by_author()
+        print("✅ Sharded storage test passed")
+    except Exception as e:
+        print(f"❌ Sharded storage test failed: {e}")
+    
+    try:
+        test_change_events_over_websocket()
+        test_slow_event_subscriber_is_dropped()
+        print("✅ Change event tests passed")
+    except Exception as e:
+        print(f"❌ Change event tests failed: {e}")
+    
+    try:
+        test_generation_priority_and_fairness_key()
+        print("✅ Generation priority test passed")
+    except Exception as e:
+        print(f"❌ Generation priority test failed: {e}")
+    
+    try:
+        test_write_coalescer_batches_retries_and_withdraws()
+        print("✅ Write coalescer test passed")
+    except Exception as e:
+        print(f"❌ Write coalescer test failed: {e}")
+    
+    try:
+        test_inference_supervisor_fails_and_restarts_dead_workers()
+        print("✅ Inference worker supervision test passed")
+    except Exception as e:
+        print(f"❌ Inference worker supervision test failed: {e}")
+    
+    try:
+        test_generation_profile_selection()
+        print("✅ Generation profile test passed")
+    except Exception as e:
+        print(f"❌ Generation profile test failed: {e}")
+    
+    try:
+        test_prompt_embedding_cache_lru()
+        print("✅ Prompt embedding cache test passed")
+    except Exception as e:
+        print(f"❌ Prompt embedding cache test failed: {e}")
+    
+    try:
+        test_inference_scheduler_fairness_and_admission()
+        print("✅ Inference scheduler test passed")
+    except Exception as e:
+        print(f"❌ Inference scheduler test failed: {e}")
+    
+    try:
+        test_streamed_generation_previews()
+        print("✅ Streamed preview test passed")
+    except Exception as e:
+        print(f"❌ Streamed preview test failed: {e}")
+    
+    try:
+        test_variant_seeds_and_out_of_memory_halving()
+        print("✅ Variant generation test passed")
+    except Exception as e:
+        print(f"❌ Variant generation test failed: {e}")
+    
+    try:
+        test_sharded_endpoints_merge_across_shards()
+        print("✅ Sharded endpoint test passed")
+    except Exception as e:
+        print(f"❌ Sharded endpoint test failed: {e}")
+    
+    try:
+        test_inference_client_resends_only_unsent_requests()
+        test_inference_pool_frees_images_nobody_reads()
+        print("✅ Inference pool connection test passed")
+    except Exception as e:
+        print(f"❌ Inference pool connection test failed: {e}")
+    
+    try:
+        test_wal_increments_restore_each_point_in_time()
+        print("✅ WAL increments passed")
+    except Exception as e:
+        print(f"❌ WAL increments failed: {e}")
+    
+    try:
+        test_edits_run_duplicate_detection()
+        print("✅ Edit duplicate detection passed")
+    except Exception as e:
+        print(f"❌ Edit duplicate detection failed: {e}")
+    
     print("\n🎉 All tests completed!")
     print("\nYour GitHub-like pull request system for poems is ready for testing!")
\ No newline at end of file
@@ -1,6 +1,7 @@
 // src/pages/AdminReviewPage.tsx
 import React, { useEffect, useState } from 'react';
 import { Button } from '../components/ui/Button';
+import { subscribeToEvents } from '../store/liveEvents';
 
 type PullRequest = {
   id: string;
@@ -33,6 +34,18 @@ export const AdminReviewPage: React.FC = () => {
 
   useEffect(() => {
     fetchPullRequests();
+    // Keep the queue current from the change feed instead of re-fetching it
+    return subscribeToEvents(['pull-requests'], async (event) => {
+      const { id } = event.data;
+      if (event.type !== 'pull_request.created') {
+        setPullRequests(prs => prs.filter(pr => pr.id !== id));
+        return;
+      }
+      const res = await fetch(`/api/pull-requests/${id}`);
+      if (!res.ok) return;
+      const pr = await res.json();
+      setPullRequests(prs => prs.some(p => p.id === id) ? prs : [pr, ...prs]);
+    }, fetchPullRequests);
   }, []);
 
   const handleAction = async (id: string, action: 'approve' | 'reject') => {
@@ -46,7 +59,7 @@ export const AdminReviewPage: React.FC = () => {
         const json = await res.json();
         throw new Error(json.detail || 'Action failed');
       }
-      await fetchPullRequests(); // refresh list after action
+      setPullRequests(prs => prs.filter(pr => pr.id !== id)); // the change feed confirms it
     } catch (err: any) {
       setError(err.message || 'Error processing action');
     } finally {
@@ -31,7 +31,8 @@ export const LibraryPage: React.FC = () => {
     try {
       const response = await axios.post('http://localhost:8000/generate-image', {
         title: poem.title,
-        content: poem.content
+        content: poem.content,
+        poem_id: poem.id
       });
 
       setGeneratedImages(prev => ({
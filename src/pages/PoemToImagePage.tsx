@@ -1,6 +1,5 @@
 import React, { useState } from 'react';
 import { usePoemStore } from '../store/poemStore';
-import axios from 'axios';
 import { motion } from 'framer-motion';
 import { Loader2, ImageIcon, Sparkles } from 'lucide-react';
 
@@ -11,11 +10,37 @@ interface Poem {
   content: string;
 }
 
+interface GenerationEvent {
+  event: string;
+  data: any;
+}
+
+// Split a Server-Sent Events buffer into complete events plus the unfinished tail
+const parseEvents = (buffer: string): { events: GenerationEvent[]; rest: string } => {
+  const events: GenerationEvent[] = [];
+  let boundary = buffer.indexOf('\n\n');
+  while (boundary !== -1) {
+    const block = buffer.slice(0, boundary);
+    buffer = buffer.slice(boundary + 2);
+    let event = 'message';
+    let data = '';
+    for (const line of block.split('\n')) {
+      if (line.startsWith('event:')) event = line.slice(6).trim();
+      else if (line.startsWith('data:')) data += line.slice(5).trim();
+    }
+    if (data) events.push({ event, data: JSON.parse(data) });
+    boundary = buffer.indexOf('\n\n');
+  }
+  return { events, rest: buffer };
+};
+
 export const PoemToImagePage: React.FC = () => {
   const poemStore = usePoemStore();
   const savedPoems = poemStore.myPoems || [];
   const [selectedId, setSelectedId] = useState<string>('');
   const [imageURL, setImageURL] = useState<string | null>(null);
+  const [previewURL, setPreviewURL] = useState<string | null>(null);
+  const [progress, setProgress] = useState<{ step: number; total: number } | null>(null);
   const [loading, setLoading] = useState(false);
 
   const generateImage = async () => {
@@ -23,18 +48,50 @@ export const PoemToImagePage: React.FC = () => {
     if (!selectedPoem) return;
 
     setLoading(true);
+    setImageURL(null);
+    setPreviewURL(null);
+    setProgress(null);
     try {
-      const response = await axios.post('http://127.0.0.1:8000/generate-image', {
-        title: selectedPoem.title,
-        content: selectedPoem.content,
+      // Stream rough previews while diffusion runs, then the final image
+      const response = await fetch('http://127.0.0.1:8000/generate-image/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          title: selectedPoem.title,
+          content: selectedPoem.content,
+          poem_id: selectedPoem.id,
+        }),
       });
+      if (!response.ok || !response.body) {
+        throw new Error(`Generation request failed with status ${response.status}`);
+      }
 
-      setImageURL(`data:image/png;base64,${response.data.image}`);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        const parsed = parseEvents(buffer + decoder.decode(value, { stream: true }));
+        buffer = parsed.rest;
+        for (const { event, data } of parsed.events) {
+          if (event === 'preview') {
+            setPreviewURL(`data:image/jpeg;base64,${data.image}`);
+            setProgress({ step: data.step, total: data.total });
+          } else if (event === 'result') {
+            setImageURL(`data:image/png;base64,${data.image}`);
+          } else if (event === 'error') {
+            throw new Error(data.detail);
+          }
+        }
+      }
     } catch (error) {
       console.error('Error generating image:', error);
       alert('Failed to generate image. Please try again.');
     } finally {
       setLoading(false);
+      setPreviewURL(null);
+      setProgress(null);
     }
   };
 
@@ -97,6 +154,20 @@ export const PoemToImagePage: React.FC = () => {
             </button>
           </div>
 
+          {loading && previewURL && (
+            <div className="mt-10 text-center">
+              <h3 className="text-xl font-semibold text-gray-800 mb-4">
+                {progress ? `Painting... step ${progress.step} of ${progress.total}` : 'Painting...'}
+              </h3>
+              <img
+                src={previewURL}
+                alt="Generation preview"
+                className="max-w-xl w-full mx-auto rounded-xl shadow-lg blur-sm"
+                style={{ imageRendering: 'auto' }}
+              />
+            </div>
+          )}
+
           {imageURL && (
             <motion.div
               initial={{ opacity: 0, y: 20 }}
@@ -0,0 +1,40 @@
+// src/store/liveEvents.ts
+// Subscribes to the backend change feed (GET /api/events) so lists can be
+// patched in place instead of re-fetched. EventSource reconnects on its own
+// and resumes from the last event id it saw.
+
+const EVENTS_URL = 'http://localhost:8000/api/events';
+
+export interface ChangeEvent<T = any> {
+  id: number;
+  type: string;
+  topics: string[];
+  data: T;
+}
+
+const EVENT_TYPES = [
+  'poem.created',
+  'poem.updated',
+  'poem.deleted',
+  'pull_request.created',
+  'pull_request.approved',
+  'pull_request.rejected',
+  'pull_request.updated',
+  'pull_request.withdrawn',
+];
+
+// topics: 'explore', 'pull-requests', `poem:${id}` or `author:${userId}`.
+// onReset runs when the server could not replay what was missed; re-fetch then.
+export const subscribeToEvents = (
+  topics: string[],
+  onEvent: (event: ChangeEvent) => void,
+  onReset?: () => void
+): (() => void) => {
+  const source = new EventSource(`${EVENTS_URL}?topics=${encodeURIComponent(topics.join(','))}`);
+  const handle = (message: MessageEvent) => onEvent(JSON.parse(message.data));
+
+  EVENT_TYPES.forEach(type => source.addEventListener(type, handle as EventListener));
+  source.addEventListener('reset', () => onReset?.());
+
+  return () => source.close();
+};
@@ -1,6 +1,7 @@
 // src/store/poemStore.ts
 import { create } from 'zustand';
 import { persist } from 'zustand/middleware';
+import { subscribeToEvents } from './liveEvents';
 
 // --- Type Definitions ---
 // Assuming these are strings for simplicity based on your usage
@@ -67,6 +68,7 @@ interface PoemState {
   // matching the PublishModal component's onPublish signature.
   publishPoem: (userId: string, userName: string, publishData: { isPublic: boolean; allowCollaboration: boolean; description?: string }) => Promise<void>;
   loadExplorePoems: () => Promise<void>;
+  subscribeToExplore: () => () => void; // Keeps explorePoems current; returns an unsubscribe function
   loadUserPoems: (userId: string) => Promise<void>; // Will populate `myPoems`
   updatePoemVisibility: (isPublic: boolean) => void; // This might be used internally or for quick toggles, but publishPoem handles the main publish logic.
   mergePullRequest: (poemId: string, pullRequestId: string) => Promise<void>;
@@ -85,6 +87,22 @@ const mockGenerateCompletion = async (prompt: string, form: PoeticForm, tone: Po
 // API base URL
 const API_BASE = 'http://localhost:8000/api';
 
+const fromExploreApi = (poem: any): Poem => ({
+  ...poem,
+  id: poem.id.toString(), // Ensure ID is string
+  createdAt: new Date(poem.created_at).toISOString(),
+  updatedAt: new Date(poem.updated_at).toISOString(),
+  publishedAt: poem.published_at ? new Date(poem.published_at).toISOString() : undefined,
+  isPublic: poem.is_public,
+  isPublished: poem.is_published,
+  allowCollaboration: poem.allow_collaboration,
+  description: poem.description,
+  revisions: [], // Revisions not typically returned with explore list
+  collaborators: poem.collaborators || [],
+  author: { name: poem.author_name || 'Unknown', email: '' }, // Map author data
+  stats: { views: poem.views || 0, likes: poem.likes || 0, shares: poem.shares || 0 } // Map stats
+});
+
 export const usePoemStore = create<PoemState>()(
   persist(
     (set, get) => ({
@@ -370,21 +388,7 @@ export const usePoemStore = create<PoemState>()(
 
           const poems = await response.json();
           set({
-            explorePoems: poems.map((poem: any) => ({
-              ...poem,
-              id: poem.id.toString(), // Ensure ID is string
-              createdAt: new Date(poem.created_at).toISOString(),
-              updatedAt: new Date(poem.updated_at).toISOString(),
-              publishedAt: poem.published_at ? new Date(poem.published_at).toISOString() : undefined,
-              isPublic: poem.is_public,
-              isPublished: poem.is_published,
-              allowCollaboration: poem.allow_collaboration,
-              description: poem.description,
-              revisions: [], // Revisions not typically returned with explore list
-              collaborators: poem.collaborators || [],
-              author: { name: poem.author_name || 'Unknown', email: '' }, // Map author data
-              stats: { views: poem.views || 0, likes: poem.likes || 0, shares: poem.shares || 0 } // Map stats
-            })),
+            explorePoems: poems.map(fromExploreApi),
             isLoading: false
           });
 
@@ -396,6 +400,25 @@ export const usePoemStore = create<PoemState>()(
         }
       },
 
+      subscribeToExplore: () => {
+        return subscribeToEvents(['explore'], async (event) => {
+          const { id, is_public } = event.data;
+          if (event.type === 'poem.deleted' || !is_public) {
+            set(state => ({ explorePoems: state.explorePoems.filter(p => p.id !== id) }));
+            return;
+          }
+          // Events carry a summary; fetch the one changed poem rather than the whole feed
+          const response = await fetch(`${API_BASE}/poems/${id}`);
+          if (!response.ok) return;
+          const poem = fromExploreApi(await response.json());
+          set(state => ({
+            explorePoems: state.explorePoems.some(p => p.id === id)
+              ? state.explorePoems.map(p => p.id === id ? poem : p)
+              : [poem, ...state.explorePoems]
+          }));
+        }, () => get().loadExplorePoems());
+      },
+
       loadUserPoems: async (userId: string) => {
         set({ isLoading: true, error: null });
 
@@ -102,7 +102,7 @@ export interface PullRequest {
   proposed_title?: string; // Optional suggested title change
   author_id: string;
   author_name: string;
-  status: 'pending' | 'approved' | 'rejected'; // Match backend statuses
+  status: 'pending' | 'approved' | 'rejected' | 'withdrawn'; // Match backend statuses
   created_at: string;
   updated_at: string; // For PR updates
 }